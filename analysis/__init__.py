@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+"""
+
+from analysis.bootstrap_variance import bootstrap_projected_variance, projected_variance
+from analysis.component_similarity import ComponentSimilarity
+from analysis.ridge_path import RidgePathCV, ridge_path, ridge_path_predictions, ridge_path_loo_errors
+from analysis.biomarker_scan import alteration_matrix, biomarker_scan, permutation_fdr
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+BIOMARKER_SCAN
+
+Association between predicted tumor responses and many alterations at once (e.g. CNA,
+mutations and translocations of all genes), instead of one biomarker per notebook cell
+as in fig4_biomarker_test. Alterations are grouped by pattern of tumors with a known
+status (usually one pattern per data type); in each group, all alterations are tested
+with matrix products:
+    - mann_whitney and t_test for binary alterations, from the sum of the ranks (resp.
+    values) of the responses of altered tumors,
+    - pearson and spearman for continuous alterations, from products of normalized
+    (ranked) values.
+Responses are permuted with the same products, and the false discovery rate of each
+p-value is estimated from the p-values of all alterations on permuted responses.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm, t, rankdata
+
+binary_tests = ['mann_whitney', 't_test']
+correlation_tests = ['pearson', 'spearman']
+
+# Number of permutations whose statistics are held in memory at once
+permutation_block_size = 100
+
+
+def alteration_matrix(tumor_barcodes,
+                      mutation_store=None,
+                      mutation_genes=None,
+                      cna_store=None,
+                      cna_genes=None,
+                      cna_threshold=None,
+                      translocation_store=None,
+                      gene_pairs=None):
+    """
+    Alterations of the given tumors read from the stores of data_reader.
+
+    INPUT:
+        - tumor_barcodes (list): tumor barcodes, in the same order as the predicted responses.
+        - mutation_store (MutationStore, optional) and mutation_genes (list): mutation status,
+        1 for mutated and 0 for non mutated tumors.
+        - cna_store (CNAStore, optional) and cna_genes (list): copy number alterations.
+        - cna_threshold (float, optional, default to None): if given, CNA are binarized, as
+        CNA >= cna_threshold if positive (amplification) and CNA <= cna_threshold otherwise
+        (deletion). Continuous if None.
+        - translocation_store (TranslocationStore, optional) and gene_pairs (list):
+        translocation indicator of each (gene_A, gene_B) pair.
+    OUTPUT:
+        - alterations (np.ndarray): alterations in the form (n_tumors, n_alterations), nan
+        when the status of a tumor is not known.
+        - alteration_names (list): <gene>_mutation, <gene>_cna and <gene_A>_<gene_B>_translocation.
+    """
+    alterations, alteration_names = [], []
+
+    if mutation_store is not None:
+        mutation_status = mutation_store.query(mutation_genes, tumor_barcodes).astype(float)
+        mutation_status[mutation_status == -1] = np.nan
+        alterations.append(mutation_status)
+        alteration_names += ['%s_mutation'%(g) for g in mutation_genes]
+
+    if cna_store is not None:
+        cna = cna_store.query(cna_genes, tumor_barcodes)
+        if cna_threshold is not None:
+            missing = np.isnan(cna)
+            cna = (cna >= cna_threshold if cna_threshold > 0 else cna <= cna_threshold).astype(float)
+            cna[missing] = np.nan
+        alterations.append(cna)
+        alteration_names += ['%s_cna'%(g) for g in cna_genes]
+
+    if translocation_store is not None:
+        alterations.append(translocation_store.query(gene_pairs, tumor_barcodes).astype(float))
+        alteration_names += ['%s_%s_translocation'%(a, b) for a, b in gene_pairs]
+
+    return np.concatenate(alterations, 1), alteration_names
+
+
+def biomarker_scan(response,
+                   alterations,
+                   test='mann_whitney',
+                   alteration_names=None,
+                   n_permutations=1000,
+                   min_samples=3,
+                   random_state=None):
+    """
+    Test the association of the predicted responses with each alteration.
+
+    INPUT:
+        - response (np.ndarray): predicted response of each tumor, (n_tumors,).
+        - alterations (np.ndarray): alterations in the form (n_tumors, n_alterations), nan
+        when unknown, e.g. from alteration_matrix. Binary (0 or 1) for mann_whitney and t_test.
+        - test (str, optional, default to mann_whitney): mann_whitney (two-sided, normal
+        approximation with tie and continuity corrections), t_test (Student), pearson or
+        spearman.
+        - alteration_names (list, optional, default to None): names of the alterations.
+        - n_permutations (int, optional, default to 1000): number of permutations of the
+        responses used to estimate the FDR. No FDR if 0.
+        - min_samples (int, optional, default to 3): minimum number of altered and non-altered
+        tumors (binary tests) or of tumors (correlations) for an alteration to be tested.
+        - random_state (int, optional, default to None): seed of the permutations.
+    OUTPUT:
+        - results (pd.DataFrame): for each alteration, n_samples, n_altered (binary tests),
+        effect (difference of mean response between altered and non-altered tumors, or
+        correlation), statistic (U, t or correlation), p_value and fdr.
+    """
+    if test not in binary_tests + correlation_tests:
+        raise ValueError('%s is not an available test'%(test))
+
+    response = np.asarray(response, dtype=float)
+    alterations = np.asarray(alterations, dtype=float)
+    n_tumors, n_alterations = alterations.shape
+    if test in binary_tests and np.any(~np.isin(alterations[~np.isnan(alterations)], [0, 1])):
+        raise ValueError('%s requires binary alterations'%(test))
+
+    results = pd.DataFrame({
+        'alteration': alteration_names if alteration_names is not None else np.arange(n_alterations),
+        'n_samples': np.zeros(n_alterations, dtype=int),
+        'n_altered': np.nan,
+        'effect': np.nan,
+        'statistic': np.nan,
+        'p_value': np.nan
+    })
+
+    #Random keys of the tumors: the order of the tumors of a pattern in each permutation
+    permutation_keys = np.random.RandomState(random_state).random_sample((n_permutations, n_tumors))
+    null_p_values = []
+
+    #Alterations sharing the same tumors with a known status are tested together
+    observed = ~np.isnan(alterations)
+    patterns, alteration_pattern = np.unique(observed, axis=1, return_inverse=True)
+    for i in range(patterns.shape[1]):
+        columns = np.where(alteration_pattern.ravel() == i)[0]
+        samples = np.where(patterns[:,i])[0]
+        pattern_response = response[samples]
+        pattern_alterations = alterations[samples][:,columns]
+
+        tested = _testable(pattern_alterations, test, min_samples)
+        results.loc[columns, 'n_samples'] = samples.shape[0]
+        if test in binary_tests:
+            results.loc[columns, 'n_altered'] = np.sum(pattern_alterations, 0)
+        if not np.any(tested) or samples.shape[0] < 3:
+            continue
+        columns, pattern_alterations = columns[tested], pattern_alterations[:,tested]
+
+        prepared_response, prepared_alterations, tie_term = _prepare(pattern_response, pattern_alterations, test)
+        statistic, p_value = _statistics(prepared_response[np.newaxis,:], prepared_alterations, test, tie_term)
+        results.loc[columns, 'statistic'] = statistic[0]
+        results.loc[columns, 'p_value'] = p_value[0]
+        results.loc[columns, 'effect'] = _effect(pattern_response, pattern_alterations, test, statistic[0])
+
+        for start in range(0, n_permutations, permutation_block_size):
+            orders = np.argsort(permutation_keys[start:start+permutation_block_size][:,samples], 1)
+            null_p_values.append(_statistics(prepared_response[orders], prepared_alterations, test, tie_term)[1].ravel())
+
+    if n_permutations > 0:
+        results['fdr'] = permutation_fdr(results['p_value'].values, null_p_values, n_permutations)
+    return results
+
+
+def permutation_fdr(p_values, null_p_values, n_permutations):
+    """
+    False discovery rate of each p-value: expected number of p-values below it under the
+    null (average over permutations) divided by the number of observed p-values below it,
+    made monotonic in p-value.
+
+    INPUT:
+        - p_values (np.ndarray): observed p-values, nan for untested alterations.
+        - null_p_values (list): arrays of p-values of all tested alterations on permuted
+        responses.
+        - n_permutations (int): number of permutations.
+    """
+    fdr = np.full(p_values.shape[0], np.nan)
+    tested = np.where(~np.isnan(p_values))[0]
+    if tested.shape[0] == 0:
+        return fdr
+
+    order = tested[np.argsort(p_values[tested], kind='mergesort')]
+    sorted_p_values = p_values[order]
+
+    null_counts = np.zeros(order.shape[0])
+    for block_p_values in null_p_values:
+        null_counts += np.searchsorted(np.sort(block_p_values), sorted_p_values, side='right')
+    observed_counts = np.searchsorted(sorted_p_values, sorted_p_values, side='right')
+
+    sorted_fdr = np.minimum(null_counts / n_permutations / observed_counts, 1)
+    fdr[order] = np.minimum.accumulate(sorted_fdr[::-1])[::-1]
+    return fdr
+
+
+def _testable(alterations, test, min_samples):
+    if test in binary_tests:
+        n_altered = np.sum(alterations, 0)
+        return (n_altered >= min_samples) & (alterations.shape[0] - n_altered >= min_samples)
+    return (alterations.shape[0] >= max(min_samples, 3)) & (np.ptp(alterations, 0) > 0)
+
+
+def _normalize_columns(values):
+    values = values - np.mean(values, 0)
+    return values / np.linalg.norm(values, axis=0)
+
+
+def _prepare(response, alterations, test):
+    #Responses and alterations such that statistics of any permutation are matrix products
+    tie_term = None
+    if test == 'mann_whitney':
+        response = rankdata(response)
+        _, tie_counts = np.unique(response, return_counts=True)
+        tie_term = np.sum(tie_counts ** 3 - tie_counts)
+    elif test == 't_test':
+        response = response - np.mean(response)
+    elif test == 'pearson':
+        response, alterations = _normalize_columns(response), _normalize_columns(alterations)
+    elif test == 'spearman':
+        response, alterations = _normalize_columns(rankdata(response)), _normalize_columns(rankdata(alterations, axis=0))
+
+    return response, alterations, tie_term
+
+
+def _statistics(responses, alterations, test, tie_term=None):
+    """
+    Statistic and two-sided p-value of each (permuted) response and alteration.
+
+    INPUT:
+        - responses (np.ndarray): prepared responses, (n_permutations, n_samples).
+        - alterations (np.ndarray): prepared alterations, (n_samples, n_alterations).
+    OUTPUT:
+        - statistic, p_value (np.ndarray): (n_permutations, n_alterations).
+    """
+    n_samples = alterations.shape[0]
+
+    if test == 'mann_whitney':
+        n_altered = np.sum(alterations, 0)
+        n_other = n_samples - n_altered
+        statistic = responses.dot(alterations) - n_altered * (n_altered + 1) / 2.
+        mean_statistic = n_altered * n_other / 2.
+        std_statistic = np.sqrt(n_altered * n_other / 12. * ((n_samples + 1) - tie_term / (n_samples * (n_samples - 1.))))
+        z = (np.abs(statistic - mean_statistic) - 0.5) / std_statistic
+        p_value = np.minimum(2 * norm.sf(z), 1)
+
+    elif test == 't_test':
+        n_altered = np.sum(alterations, 0)
+        n_other = n_samples - n_altered
+        altered_sum = responses.dot(alterations)
+        altered_squares = (responses ** 2).dot(alterations)
+        total_sum = np.sum(responses, 1)[:,np.newaxis]
+        total_squares = np.sum(responses ** 2, 1)[:,np.newaxis]
+
+        within_squares = altered_squares - altered_sum ** 2 / n_altered\
+                         + (total_squares - altered_squares) - (total_sum - altered_sum) ** 2 / n_other
+        pooled_variance = within_squares / (n_samples - 2)
+        statistic = (altered_sum / n_altered - (total_sum - altered_sum) / n_other)\
+                    / np.sqrt(pooled_variance * (1. / n_altered + 1. / n_other))
+        p_value = 2 * t.sf(np.abs(statistic), n_samples - 2)
+
+    else:
+        statistic = np.clip(responses.dot(alterations), -1, 1)
+        with np.errstate(divide='ignore'):
+            t_statistic = statistic * np.sqrt((n_samples - 2) / (1 - statistic ** 2))
+        p_value = 2 * t.sf(np.abs(t_statistic), n_samples - 2)
+
+    return statistic, p_value
+
+
+def _effect(response, alterations, test, statistic):
+    #Difference of mean response of altered and non-altered tumors, or correlation
+    if test in correlation_tests:
+        return statistic
+    n_altered = np.sum(alterations, 0)
+    altered_mean = response.dot(alterations) / n_altered
+    other_mean = response.dot(1 - alterations) / (alterations.shape[0] - n_altered)
+    return altered_mean - other_mean
+
+
+if __name__ == '__main__':
+    from time import time
+    from scipy.stats import mannwhitneyu, ttest_ind, spearmanr
+
+    # 1000 tumors and 20000 mutated genes, 1% of tumors not sequenced, compared to one
+    # scipy test per gene
+    n_tumors, n_genes = 1000, 20000
+    response = np.random.randn(n_tumors)
+    alterations = (np.random.rand(n_tumors, n_genes) < 0.05).astype(float)
+    alterations[:10] = np.nan
+    response[np.where(alterations[:,0] == 1)[0]] += 1
+
+    start_time = time()
+    scipy_p_values = []
+    for i in range(200):
+        altered = alterations[10:,i] == 1
+        scipy_p_values.append(mannwhitneyu(response[10:][altered], response[10:][~altered],
+                                           alternative='two-sided', method='asymptotic')[1])
+    print('scipy, 200 genes: %.2f s'%(time() - start_time))
+
+    for test in ['mann_whitney', 't_test']:
+        start_time = time()
+        results = biomarker_scan(response, alterations, test, n_permutations=100, random_state=0)
+        print('%s, %s genes and 100 permutations: %.2f s'%(test, n_genes, time() - start_time))
+    results = biomarker_scan(response, alterations, 'mann_whitney', n_permutations=0)
+    print('Maximum p-value difference to scipy: %.2e'%(np.max(np.abs(results['p_value'].values[:200] - scipy_p_values))))
+
+    # Continuous CNA
+    cna = np.random.randn(n_tumors, 2000)
+    start_time = time()
+    results = biomarker_scan(response, cna, 'spearman', n_permutations=100, random_state=0)
+    print('spearman, 2000 genes and 100 permutations: %.2f s'%(time() - start_time))
+    print('Maximum correlation difference to scipy: %.2e'%(np.max(np.abs(results['statistic'].values[:20]
+                                                                         - [spearmanr(response, cna[:,i])[0] for i in range(20)]))))
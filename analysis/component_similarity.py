@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+COMPONENT_SIMILARITY
+
+Cosine similarities between sets of components (e.g. PCs or PVs of cell lines, PDX and
+tumors) and variance of each domain projected on them, as in fig2 and fig3.
+
+All component sets are expressed in one orthonormal basis of their span (m directions,
+m being at most the total number of components). Each domain is projected once on this
+basis, keeping only the (m, m) covariance of the projection and the total variance. Any
+similarity matrix or projected variance is then computed with (k, m) algebra, without
+reading the (n_samples, n_genes) data again.
+"""
+
+import numpy as np
+
+# Relative tolerance under which directions of the stacked components are dropped
+rank_tolerance = 1e-10
+
+
+class ComponentSimilarity():
+    """
+    ATTRIBUTES:
+        - basis (np.ndarray): orthonormal basis of the span of all components, (m, n_genes).
+        - coordinates (dict): coordinates of each component set in basis, (k, m).
+        - covariances (dict): covariance of each domain projected on basis, (m, m).
+        - total_variances (dict): sum of the gene variances of each domain.
+    """
+
+    def __init__(self, component_sets):
+        """
+        INPUT:
+            - component_sets (dict): components of each set in the form (k, n_genes),
+            e.g. {'source': source_components, 'target': target_components}.
+        """
+        names = list(component_sets.keys())
+        stacked_components = np.concatenate([np.asarray(component_sets[n], dtype=float) for n in names])
+
+        #Orthonormal basis of the span, from the right singular vectors
+        _, singular_values, right_vectors = np.linalg.svd(stacked_components, full_matrices=False)
+        rank = np.sum(singular_values > rank_tolerance * singular_values[0])
+        self.basis = right_vectors[:rank]
+
+        coordinates = stacked_components.dot(self.basis.transpose())
+        split_index = np.cumsum([np.asarray(component_sets[n]).shape[0] for n in names])[:-1]
+        self.coordinates = dict(zip(names, np.split(coordinates, split_index)))
+
+        self.covariances = {}
+        self.total_variances = {}
+
+    def add_components(self, name, components):
+        """
+        Register a component set after construction. Components are projected on the
+        existing basis, which is extended if they leave its span. The basis can only be
+        extended before any domain is added, since the covariances of domains added before
+        do not cover the new directions.
+
+        INPUT:
+            - name (str): name of the set.
+            - components (np.ndarray): components in the form (k, n_genes).
+        """
+        components = np.asarray(components, dtype=float)
+        coordinates = components.dot(self.basis.transpose())
+        residuals = components - coordinates.dot(self.basis)
+
+        #Directions of the new components orthogonal to the basis
+        _, singular_values, right_vectors = np.linalg.svd(residuals, full_matrices=False)
+        rank = np.sum(singular_values > rank_tolerance * max(np.max(np.linalg.norm(components, axis=1)), 1.))
+        if rank > 0:
+            if len(self.covariances) > 0:
+                raise ValueError('Components %s are not in the span of the basis, '\
+                                 'they should be added before the domains'%(name))
+            self.basis = np.concatenate([self.basis, right_vectors[:rank]])
+            self.coordinates = {n: np.concatenate([c, np.zeros((c.shape[0], rank))], 1) for n, c in self.coordinates.items()}
+            coordinates = components.dot(self.basis.transpose())
+
+        self.coordinates[name] = coordinates
+        return self
+
+    def add_domain(self, name, data):
+        """
+        Project a domain on the basis. This is the only step reading the data.
+
+        INPUT:
+            - name (str): name of the domain, e.g. 'target'.
+            - data (np.ndarray): data in the form (n_samples, n_genes).
+        """
+        projected_data = data.dot(self.basis.transpose())
+        projected_data -= np.mean(projected_data, 0)
+
+        self.covariances[name] = projected_data.transpose().dot(projected_data) / data.shape[0]
+        self.total_variances[name] = np.sum(np.var(data, 0))
+        return self
+
+    def cosine_similarity(self, first_set, second_set):
+        """
+        Cosine similarity matrix between two sets of (unit-norm) components, (k1, k2).
+        """
+        return self.coordinates[first_set].dot(self.coordinates[second_set].transpose())
+
+    def projected_variance(self, domain, component_set):
+        """
+        Variance of the domain projected on each component of the set.
+        """
+        coordinates = self.coordinates[component_set]
+        return np.sum(coordinates.dot(self.covariances[domain]) * coordinates, 1)
+
+    def variance_explained(self, domain, component_set):
+        """
+        Projected variance of each component relative to the total variance of the domain.
+        """
+        return self.projected_variance(domain, component_set) / self.total_variances[domain]
+
+    def cumulative_variance_explained(self, domain, component_set):
+        """
+        Proportion of the variance of the domain contained in the subspace spanned by the
+        first j components, for each j. Components do not need to be orthogonal.
+        """
+        coordinates = self.coordinates[component_set]
+        covariance = self.covariances[domain]
+
+        cumulative_variance = np.zeros(coordinates.shape[0])
+        for j in range(1, coordinates.shape[0]+1):
+            #Orthonormal basis of the first j components, in basis coordinates
+            subspace = np.linalg.qr(coordinates[:j].transpose())[0]
+            cumulative_variance[j-1] = np.trace(subspace.transpose().dot(covariance).dot(subspace))
+
+        return cumulative_variance / self.total_variances[domain]
+
+
+if __name__ == '__main__':
+    from time import time
+
+    # Three domains and four component sets, compared to direct projections of the data
+    n_genes, n_components = 20000, 20
+    domains = {name: np.random.randn(n_samples, n_genes) for name, n_samples in
+               [('cell_line', 800), ('pdx', 400), ('tumor', 1000)]}
+    component_sets = {name: np.linalg.qr(np.random.randn(n_genes, n_components))[0].transpose()
+                      for name in ['cell_line', 'pdx', 'tumor', 'pv']}
+
+    start_time = time()
+    direct_variance = {(d, c): np.var(domains[d].dot(component_sets[c].transpose()), 0) / np.sum(np.var(domains[d], 0))
+                       for d in domains for c in component_sets}
+    print('Direct projections: %.2f s'%(time() - start_time))
+
+    start_time = time()
+    similarity = ComponentSimilarity(component_sets)
+    for d in domains:
+        similarity.add_domain(d, domains[d])
+    print('Sketches: %.2f s'%(time() - start_time))
+
+    start_time = time()
+    sketch_variance = {(d, c): similarity.variance_explained(d, c) for d in domains for c in component_sets}
+    print('Variances from sketches: %.4f s'%(time() - start_time))
+
+    print('Maximum relative difference: %s'%(np.max([np.max(np.abs(sketch_variance[k] - direct_variance[k]) / direct_variance[k])
+                                                     for k in direct_variance])))
+    print('Maximum cosine similarity difference: %s'%(np.max(np.abs(similarity.cosine_similarity('pdx', 'tumor')
+                                                                    - component_sets['pdx'].dot(component_sets['tumor'].transpose())))))
+
+    # Component set registered after the domains, within the span of the basis
+    similarity.add_components('pv_first', component_sets['pv'][:5])
+    print('Maximum relative difference, added components: %s'%(np.max(np.abs(similarity.variance_explained('tumor', 'pv_first')
+                                                                              - direct_variance['tumor', 'pv'][:5])
+                                                                       / direct_variance['tumor', 'pv'][:5])))
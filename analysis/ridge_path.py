@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+RIDGE_PATH
+
+Ridge regression over a grid of alpha values from one thin SVD per fold, replacing the
+grid searches of fig4 (GridSearchCV of Pipeline([StandardScaler, Ridge()])). With the
+centered (and optionally scaled) training data X = U S V^T, coefficients and predictions
+of all alphas only differ by the diagonal S / (S^2 + alpha), such that the whole path costs
+one SVD and small matrix products. Leave-one-out and generalized cross-validation errors
+are obtained in closed form from the diagonal of the hat matrix.
+
+Several targets (e.g. all drugs of a tissue) are fitted at once, with one alpha per
+target. Targets with missing values are grouped by pattern of observed samples, each
+group sharing its SVDs.
+"""
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.model_selection import KFold, check_cv
+
+
+def _scale_features(X, with_std=False):
+    #Mean and scale of the features as StandardScaler (scale set to 1 for constant features)
+    mean = np.mean(X, 0)
+    scale = np.std(X, 0) if with_std else np.ones(X.shape[1])
+    scale[scale == 0] = 1.
+    return mean, scale
+
+
+def _fold_svd(X, Y, with_std=False):
+    mean, scale = _scale_features(X, with_std)
+    U, s, Vt = np.linalg.svd((X - mean) / scale, full_matrices=False)
+    Y_mean = np.mean(Y, 0)
+    return {
+        'mean': mean,
+        'scale': scale,
+        'U': U,
+        's': s,
+        'Vt': Vt,
+        'Y_mean': Y_mean,
+        'UtY': U.transpose().dot(Y - Y_mean)
+    }
+
+
+def _shrinkage(s, alphas):
+    #Diagonal S / (S^2 + alpha) of each alpha, (n_alphas, rank)
+    return s / (s ** 2 + np.array(alphas)[:,np.newaxis])
+
+
+def ridge_path(X, Y, alphas, with_std=False):
+    """
+    Coefficients of ridge regressions (with intercept) for all alphas, from one SVD.
+
+    INPUT:
+        - X (np.ndarray): data in the form (n_samples, n_genes).
+        - Y (np.ndarray): targets in the form (n_samples, n_targets).
+        - alphas (list): regularization values.
+        - with_std (bool, optional, default to False): whether features are scaled to unit
+        variance before the regression, as StandardScaler(with_std=True).
+    OUTPUT:
+        - coefs (np.ndarray): coefficients on the original features, (n_alphas, n_genes, n_targets).
+        - intercepts (np.ndarray): intercepts, (n_alphas, n_targets).
+    """
+    fold = _fold_svd(X, Y, with_std)
+    coefs = np.stack([_original_coefs(fold, d[:,np.newaxis] * fold['UtY']) for d in _shrinkage(fold['s'], alphas)])
+    intercepts = fold['Y_mean'] - np.einsum('k,akt->at', fold['mean'], coefs)
+    return coefs, intercepts
+
+
+def _original_coefs(fold, shrunk_UtY):
+    #Coefficients on the original (unscaled) features, from diag(S / (S^2 + alpha)) U^T Y
+    return fold['Vt'].transpose().dot(shrunk_UtY) / fold['scale'][:,np.newaxis]
+
+
+def ridge_path_predictions(X_train, Y_train, X_test, alphas, with_std=False):
+    """
+    Predictions on X_test of the ridge regressions fitted on (X_train, Y_train) for all
+    alphas, (n_alphas, n_test, n_targets).
+    """
+    fold = _fold_svd(X_train, Y_train, with_std)
+    projected_test = ((X_test - fold['mean']) / fold['scale']).dot(fold['Vt'].transpose())
+    return np.einsum('nr,ar,rt->ant', projected_test, _shrinkage(fold['s'], alphas), fold['UtY'], optimize=True) + fold['Y_mean']
+
+
+def ridge_path_loo_errors(X, Y, alphas, with_std=False, gcv=False):
+    """
+    Leave-one-out squared errors of ridge regressions for all alphas, in closed form:
+    the residual of sample i is divided by 1 - H_ii, H being the hat matrix (including the
+    intercept). Features are scaled on all samples, as RidgeCV. If gcv is True, H_ii is
+    replaced by its mean (generalized cross-validation).
+
+    OUTPUT:
+        - loo_errors (np.ndarray): squared errors, (n_alphas, n_samples, n_targets).
+    """
+    fold = _fold_svd(X, Y, with_std)
+    n_samples = X.shape[0]
+    filter_factors = fold['s'] * _shrinkage(fold['s'], alphas)
+
+    fitted_values = np.einsum('nr,ar,rt->ant', fold['U'], filter_factors, fold['UtY'], optimize=True) + fold['Y_mean']
+    leverages = 1. / n_samples + (fold['U'] ** 2).dot(filter_factors.transpose()).transpose()
+    if gcv:
+        leverages = np.repeat(np.mean(leverages, 1, keepdims=True), n_samples, 1)
+
+    return ((Y - fitted_values) / (1 - leverages[:,:,np.newaxis])) ** 2
+
+
+class RidgePathCV():
+    """
+    Cross-validated ridge regression over a grid of alphas, with the attributes of
+    GridSearchCV used in fig4 (best_params_, best_score_, cv_results_, predict).
+
+    ATTRIBUTES:
+        - alpha_ (float or np.ndarray): selected alpha (of each target).
+        - cv_results_ (dict): param_alpha, mean_test_score and std_test_score (negative mean
+        squared error) of each alpha, (n_alphas,) or (n_alphas, n_targets).
+        - best_params_, best_score_, best_index_: as GridSearchCV, for a single target.
+        - coef_ (np.ndarray): coefficients refitted on all samples, (n_genes,) or
+        (n_targets, n_genes).
+        - intercept_ (float or np.ndarray): intercept(s).
+    """
+
+    def __init__(self, alphas, cv=10, with_std=False, n_jobs=1):
+        """
+        INPUT:
+            - alphas (list): regularization values.
+            - cv (int, splitter, None or 'gcv', optional, default to 10): number of folds
+            (KFold, as GridSearchCV for regressors) or splitter, e.g. GroupKFold(10).
+            None for closed-form leave-one-out and 'gcv' for generalized cross-validation.
+            - with_std (bool, optional, default to False): whether features are scaled to
+            unit variance in each fold, as StandardScaler(with_std=True).
+            - n_jobs (int, optional, default to 1): number of threads running folds.
+        """
+        self.alphas = np.array(alphas, dtype=float)
+        self.cv = cv
+        self.with_std = with_std
+        self.n_jobs = n_jobs
+
+    def fit(self, X, y, groups=None):
+        """
+        INPUT:
+            - X (np.ndarray): data in the form (n_samples, n_genes).
+            - y (np.ndarray): response (n_samples,) or responses (n_samples, n_targets),
+            possibly with nan for missing responses.
+            - groups (np.ndarray, optional, default to None): groups of the samples for the
+            splitter.
+        """
+        X = np.asarray(X, dtype=float)
+        Y = np.asarray(y, dtype=float)
+        single_target = Y.ndim == 1
+        Y = Y.reshape(Y.shape[0], -1)
+
+        self.coef_ = np.zeros((Y.shape[1], X.shape[1]))
+        self.intercept_ = np.zeros(Y.shape[1])
+        self.alpha_ = np.zeros(Y.shape[1])
+        mean_test_score = np.zeros((self.alphas.shape[0], Y.shape[1]))
+        std_test_score = np.zeros((self.alphas.shape[0], Y.shape[1]))
+
+        #Targets sharing the same observed samples share their SVDs
+        observed = ~np.isnan(Y)
+        patterns, target_pattern = np.unique(observed, axis=1, return_inverse=True)
+        for i in range(patterns.shape[1]):
+            targets = np.where(target_pattern.ravel() == i)[0]
+            samples = np.where(patterns[:,i])[0]
+            group_scores = self._test_scores(X[samples], Y[samples][:,targets],
+                                             None if groups is None else np.asarray(groups)[samples])
+            mean_test_score[:,targets] = np.mean(group_scores, 1)
+            std_test_score[:,targets] = np.std(group_scores, 1)
+
+            #Refit with the best alpha of each target (first one in case of ties)
+            best_alphas = self.alphas[np.argmax(mean_test_score[:,targets], 0)]
+            fold = _fold_svd(X[samples], Y[samples][:,targets], self.with_std)
+            coefs = _original_coefs(fold, _shrinkage(fold['s'], best_alphas).transpose() * fold['UtY'])
+            self.coef_[targets] = coefs.transpose()
+            self.intercept_[targets] = fold['Y_mean'] - fold['mean'].dot(coefs)
+            self.alpha_[targets] = best_alphas
+
+        self.cv_results_ = {
+            'param_alpha': self.alphas,
+            'mean_test_score': mean_test_score,
+            'std_test_score': std_test_score
+        }
+        self.best_index_ = np.argmax(mean_test_score, 0)
+        self.best_score_ = np.max(mean_test_score, 0)
+
+        if single_target:
+            self.coef_, self.intercept_, self.alpha_ = self.coef_[0], self.intercept_[0], self.alpha_[0]
+            self.cv_results_['mean_test_score'] = mean_test_score[:,0]
+            self.cv_results_['std_test_score'] = std_test_score[:,0]
+            self.best_index_, self.best_score_ = self.best_index_[0], self.best_score_[0]
+            self.best_params_ = {'alpha': self.alpha_}
+
+        return self
+
+    def _test_scores(self, X, Y, groups):
+        #Negative mean squared error of each alpha, split and target, (n_alphas, n_splits, n_targets)
+        if self.cv is None or self.cv == 'gcv':
+            loo_errors = ridge_path_loo_errors(X, Y, self.alphas, self.with_std, gcv=(self.cv == 'gcv'))
+            return - np.mean(loo_errors, 1, keepdims=True)
+
+        cv = KFold(self.cv) if isinstance(self.cv, int) else check_cv(self.cv)
+        splits = list(cv.split(X, Y, groups))
+        predictions = Parallel(n_jobs=self.n_jobs, prefer='threads')(delayed(ridge_path_predictions)(X[train],
+                                                                                                    Y[train],
+                                                                                                    X[test],
+                                                                                                    self.alphas,
+                                                                                                    self.with_std)
+                                                                     for train, test in splits)
+        return np.stack([- np.mean((p - Y[test]) ** 2, 1) for p, (_, test) in zip(predictions, splits)], 1)
+
+    def predict(self, X):
+        return np.asarray(X, dtype=float).dot(self.coef_.transpose()) + self.intercept_
+
+
+if __name__ == '__main__':
+    from time import time
+    from sklearn.pipeline import Pipeline
+    from sklearn.model_selection import GridSearchCV
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.linear_model import Ridge
+
+    # Synthetic cell lines, compared to the grid search of fig4_biomarker_test
+    n_samples, n_genes = 400, 5000
+    X = np.random.randn(n_samples, n_genes)
+    y = X[:,:50].dot(np.random.randn(50)) + 5 * np.random.randn(n_samples)
+    alpha_values = np.logspace(-1,8,20)
+
+    start_time = time()
+    grid_en = GridSearchCV(Pipeline([
+                            ('normalization', StandardScaler(with_mean=True, with_std=True)),
+                            ('regression', Ridge())
+                        ]),
+                        cv=10, param_grid={'regression__alpha': alpha_values}, scoring='neg_mean_squared_error')
+    grid_en.fit(X, y)
+    print('GridSearchCV: %.2f s'%(time() - start_time))
+
+    start_time = time()
+    ridge_cv = RidgePathCV(alpha_values, cv=10, with_std=True).fit(X, y)
+    print('RidgePathCV: %.2f s'%(time() - start_time))
+
+    print('Same alpha: %s'%(ridge_cv.alpha_ == grid_en.best_params_['regression__alpha']))
+    print('Maximum relative score difference: %s'%(np.max(np.abs(ridge_cv.cv_results_['mean_test_score']
+                                                                  - grid_en.cv_results_['mean_test_score'])
+                                                           / np.abs(grid_en.cv_results_['mean_test_score']))))
+    print('Maximum prediction difference: %s'%(np.max(np.abs(ridge_cv.predict(X) - grid_en.predict(X)))))
+
+    # 50 drugs at once
+    Y = X[:,:50].dot(np.random.randn(50, 50)) + 5 * np.random.randn(n_samples, 50)
+    start_time = time()
+    RidgePathCV(alpha_values, cv=10, with_std=True).fit(X, Y)
+    print('RidgePathCV, 50 targets: %.2f s'%(time() - start_time))
+
+    start_time = time()
+    RidgePathCV(alpha_values, cv=None, with_std=True).fit(X, Y)
+    print('RidgePathCV, 50 targets, leave-one-out: %.2f s'%(time() - start_time))
@@ -4,10 +4,17 @@
 @author: Soufiane Mourragui
 """
 
-from data_reader.harmonize_feature_naming import harmonize_feature_naming
+from data_reader.harmonize_feature_naming import harmonize_feature_naming, harmonize_feature_naming_domains
 from data_reader.read_cell_line_data import read_cell_line_data
 from data_reader.read_cna_tumors import read_cna_tumors
-from data_reader.read_data import read_data
+from data_reader.read_mutations_tumors import read_mutations_tumors
+from data_reader.mutation_store import MutationStore
+from data_reader.read_translocations_tumors import read_translocations_tumors
+from data_reader.translocation_store import TranslocationStore
+from data_reader.cna_store import CNAStore
+from data_reader.read_data import read_data, read_data_domains
+from data_reader.gene_annotation_index import GeneAnnotationIndex
 from data_reader.read_drug_response import read_drug_response, read_drug_response_cell_lines
+from data_reader.drug_response_store import DrugResponseStore
 from data_reader.read_pdx_data import read_pdx_data
-from data_reader.read_tumor_data import read_tumor_data
\ No newline at end of file
+from data_reader.read_tumor_data import read_tumor_data, read_tumor_data_lazy
\ No newline at end of file
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+CNA_STORE
+
+Loads a Copy Number Alterations table once and answers queries for many genes and
+tumor barcodes with a vectorized gather. The matrix can be persisted as a memory-mapped
+.npy file (e.g. in int8 for discrete CNA) so that later loads are near-instant and
+shared between processes.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from data_reader.data_cache import cache_key
+
+default_location = '../../data/2018_03_29_cna/tcga_breast/data.txt'
+
+# Value used to encode missing values in integer matrices
+missing_integer_value = {
+    np.dtype('int8'): np.iinfo(np.int8).min,
+    np.dtype('int16'): np.iinfo(np.int16).min,
+    np.dtype('int32'): np.iinfo(np.int32).min
+}
+
+_loaded_stores = {}
+
+
+class CNAStore():
+    """
+    CNA table indexed by gene and by (shortened) tumor barcode.
+
+    ATTRIBUTES:
+        - cna (np.ndarray or np.memmap): CNA in the form (n_genes, n_barcodes).
+        - gene_names (np.ndarray): Hugo symbols, in the same order as cna rows.
+        - barcodes (np.ndarray): shortened barcodes, in the same order as cna columns.
+        - length_barcode (int): length of the barcodes used for matching.
+    """
+
+    def __init__(self, cna_data_location=default_location, dtype=None, cache_folder=None):
+        """
+        INPUT:
+            - cna_data_location (str, optional, default to breast for tcga): csv table
+            separated with '\\t' with Hugo_Symbol and Entrez_Gene_Id columns followed by
+            one column per barcode.
+            - dtype (np.dtype, optional, default to None): type used to store the matrix,
+            e.g. np.int8 for discrete CNA. Float if None.
+            - cache_folder (str, optional, default to None): if given, the matrix is saved
+            there as .npy and memory-mapped.
+        """
+        self.dtype = np.dtype(dtype or np.float64)
+
+        key = None
+        if cache_folder is not None:
+            key = cache_key({'reader': 'cna_store', 'dtype': self.dtype.str}, [cna_data_location])
+            if self._load_cache(cache_folder, key):
+                return
+
+        #Read CNA and shorten the barcodes for later usage
+        cna_df = pd.read_csv(cna_data_location, sep='\t')
+        barcode_columns = np.array(cna_df.columns[2:]).astype(str)
+        self.length_barcode = int(np.min([len(e) for e in barcode_columns]))
+        self.gene_names = np.array(cna_df['Hugo_Symbol'].values, dtype=str)
+        self.barcodes = np.array([e[:self.length_barcode] for e in barcode_columns])
+        self.cna = self._convert(cna_df[cna_df.columns[2:]].values.astype(float))
+        del cna_df
+
+        if cache_folder is not None:
+            self._save_cache(cache_folder, key)
+
+        self._build_index()
+
+    @classmethod
+    def load(cls, cna_data_location=default_location, dtype=None, cache_folder=None):
+        """
+        Return the store of the given file, loading it only once per process.
+        The store is re-loaded if the file has been modified.
+        """
+        key = (os.path.abspath(cna_data_location), os.path.getmtime(cna_data_location),
+               np.dtype(dtype or np.float64).str, cache_folder)
+        if key not in _loaded_stores:
+            _loaded_stores[key] = cls(cna_data_location, dtype, cache_folder)
+        return _loaded_stores[key]
+
+    def query(self, genes, tumor_barcodes):
+        """
+        CNA of the given genes for the given tumors.
+
+        INPUT:
+            - genes (list): names of the genes considered.
+            - tumor_barcodes (array): array of tumor barcodes.
+        OUTPUT:
+            - cna (np.ndarray): CNA in the form (n_barcodes, n_genes), nan if the gene
+            or the tumor has not been found.
+        """
+        shortened_barcodes = np.array([barcode[:self.length_barcode] for barcode in tumor_barcodes])
+        gene_position = self._gene_index.get_indexer(np.asarray(genes).astype(str))
+        barcode_position = self._barcode_index.get_indexer(shortened_barcodes)
+        gene_rows = self._gene_rows[np.maximum(gene_position, 0)]
+        barcode_columns = self._barcode_columns[np.maximum(barcode_position, 0)]
+
+        #Gather the rows of the genes first, i.e. only a few rows of a memory-mapped matrix
+        unique_rows, gene_inverse = np.unique(gene_rows, return_inverse=True)
+        cna = np.asarray(self.cna[unique_rows])[gene_inverse]
+        cna = cna[:,barcode_columns].transpose().astype(float)
+
+        if self.dtype in missing_integer_value:
+            cna[cna == missing_integer_value[self.dtype]] = np.nan
+        cna[barcode_position == -1] = np.nan
+        cna[:,gene_position == -1] = np.nan
+
+        return cna
+
+    def _convert(self, cna):
+        if self.dtype.kind != 'i':
+            return cna.astype(self.dtype)
+        if self.dtype not in missing_integer_value:
+            raise ValueError('%s is not an available type for CNA'%(self.dtype))
+
+        missing = np.isnan(cna)
+        if np.any(cna[~missing] != np.round(cna[~missing])):
+            raise ValueError('CNA are not integers and can not be stored as %s'%(self.dtype))
+        cna[missing] = missing_integer_value[self.dtype]
+        return cna.astype(self.dtype)
+
+    def _build_index(self):
+        #Keep the first occurrence of duplicated genes and barcodes
+        gene_names = pd.Index(self.gene_names)
+        first_genes = ~gene_names.duplicated(keep='first')
+        self._gene_index = gene_names[first_genes]
+        self._gene_rows = np.where(first_genes)[0]
+
+        barcodes = pd.Index(self.barcodes)
+        first_barcodes = ~barcodes.duplicated(keep='first')
+        self._barcode_index = barcodes[first_barcodes]
+        self._barcode_columns = np.where(first_barcodes)[0]
+
+    def _save_cache(self, cache_folder, key):
+        os.makedirs(cache_folder, exist_ok=True)
+        np.save(os.path.join(cache_folder, '%s_genes.npy'%(key)), self.gene_names, allow_pickle=False)
+        np.save(os.path.join(cache_folder, '%s_barcodes.npy'%(key)), self.barcodes, allow_pickle=False)
+
+        #The matrix is written last and atomically, as its presence marks a complete entry
+        cna_file = os.path.join(cache_folder, '%s_cna.npy'%(key))
+        np.save(cna_file + '.%s.tmp.npy'%(os.getpid()), self.cna, allow_pickle=False)
+        os.replace(cna_file + '.%s.tmp.npy'%(os.getpid()), cna_file)
+        self.cna = np.load(cna_file, mmap_mode='r')
+
+    def _load_cache(self, cache_folder, key):
+        files = [os.path.join(cache_folder, '%s_%s.npy'%(key, e)) for e in ['cna', 'genes', 'barcodes']]
+        if not all(os.path.isfile(f) for f in files):
+            return False
+
+        self.cna = np.load(files[0], mmap_mode='r')
+        self.gene_names = np.load(files[1], allow_pickle=False)
+        self.barcodes = np.load(files[2], allow_pickle=False)
+        self.length_barcode = int(np.min([len(e) for e in self.barcodes]))
+        self._build_index()
+
+        return True
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+DATA_CACHE
+
+On-disk cache for the output of read_data. Each entry is stored in a folder named
+after a content-addressed key computed from the reading parameters and from the
+fingerprint (size, modification time and optionally content hash) of all input files.
+Matrices are saved as .npy files so that they can be memory-mapped: warm loads are
+near-instant and several processes reading the same entry share one copy in memory
+through the page cache.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+default_cache_folder = '../data/cache/'
+
+cache_version = 1
+cached_arrays = ['target_data', 'source_data', 'gene_names', 'source_samples', 'target_samples']
+
+
+def file_fingerprint(file_name, hash_content=False):
+    """
+    Fingerprint of one input file used to compute the cache key.
+
+    INPUT:
+        - file_name (str): path to the file (or folder).
+        - hash_content (bool, optional, default to False): whether the content should
+        be hashed, which is safer than modification times but requires reading the file.
+    OUTPUT:
+        - fingerprint (list): absolute path, size and modification time (and content hash).
+    """
+    if file_name is None:
+        return None
+
+    file_name = os.path.abspath(file_name)
+    if not os.path.exists(file_name):
+        return [file_name, 'missing']
+
+    file_stat = os.stat(file_name)
+    fingerprint = [file_name, file_stat.st_size, file_stat.st_mtime_ns]
+
+    if hash_content and os.path.isfile(file_name):
+        content_hash = hashlib.sha1()
+        with open(file_name, 'rb') as f:
+            for block in iter(lambda: f.read(2**22), b''):
+                content_hash.update(block)
+        fingerprint.append(content_hash.hexdigest())
+
+    return fingerprint
+
+
+def cache_key(parameters, input_files, hash_content=False):
+    """
+    Compute the key of a cache entry.
+
+    INPUT:
+        - parameters (dict): reading parameters, e.g. source and target type, tissues.
+        - input_files (list): all the files read to produce the entry.
+        - hash_content (bool, optional, default to False): whether to hash input files.
+    OUTPUT:
+        - key (str): hexadecimal SHA1 key.
+    """
+    key_content = {
+        'version': cache_version,
+        'parameters': parameters,
+        'files': [file_fingerprint(f, hash_content) for f in sorted(set(input_files))]
+    }
+    key_content = json.dumps(key_content, sort_keys=True, default=str)
+
+    return hashlib.sha1(key_content.encode('utf-8')).hexdigest()
+
+
+def load_cached_data(key, cache_folder=default_cache_folder, mmap_mode='r'):
+    """
+    Load a cache entry if it exists.
+
+    INPUT:
+        - key (str): key of the entry, as computed by cache_key.
+        - cache_folder (str, optional): folder containing the cache.
+        - mmap_mode (str, optional, default to 'r'): memory-map mode of the data matrices.
+        Use None to load them in memory, 'c' for copy-on-write.
+    OUTPUT:
+        - None if the entry is not available, otherwise the tuple (target_data, source_data,
+        gene_names, source_samples, target_samples).
+    """
+    entry_folder = os.path.join(cache_folder, key)
+    if not os.path.isfile(os.path.join(entry_folder, 'metadata.json')):
+        return None
+
+    data = []
+    for name in cached_arrays:
+        is_matrix = name.endswith('_data')
+        data.append(np.load(os.path.join(entry_folder, '%s.npy'%(name)),
+                            mmap_mode=mmap_mode if is_matrix else None,
+                            allow_pickle=False))
+
+    return tuple(data)
+
+
+def save_cached_data(key,
+                    target_data,
+                    source_data,
+                    gene_names,
+                    source_samples,
+                    target_samples,
+                    cache_folder=default_cache_folder,
+                    parameters=None):
+    """
+    Save a cache entry. The entry is first written in a temporary folder and then moved,
+    so that concurrent readers never see a partially written entry.
+
+    INPUT:
+        - key (str): key of the entry, as computed by cache_key.
+        - target_data, source_data, gene_names, source_samples, target_samples: output
+        of read_data.
+        - cache_folder (str, optional): folder containing the cache.
+        - parameters (dict, optional): reading parameters, saved for information.
+    OUTPUT:
+        - entry_folder (str): folder of the entry.
+    """
+    if not os.path.isdir(cache_folder):
+        os.makedirs(cache_folder, exist_ok=True)
+    entry_folder = os.path.join(cache_folder, key)
+    temp_folder = tempfile.mkdtemp(prefix='.%s_'%(key), dir=cache_folder)
+
+    try:
+        arrays = [target_data, source_data, gene_names, source_samples, target_samples]
+        for name, array in zip(cached_arrays, arrays):
+            array = np.ascontiguousarray(array)
+            if not name.endswith('_data'):
+                array = array.astype(str)
+            np.save(os.path.join(temp_folder, '%s.npy'%(name)), array, allow_pickle=False)
+
+        with open(os.path.join(temp_folder, 'metadata.json'), 'w') as f:
+            json.dump({'key': key, 'version': cache_version, 'parameters': parameters},
+                      f, sort_keys=True, default=str)
+    except Exception:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+        raise
+
+    try:
+        os.rename(temp_folder, entry_folder)
+    except OSError:
+        # Another process has written the same entry in the meantime.
+        shutil.rmtree(temp_folder, ignore_errors=True)
+        if not os.path.isdir(entry_folder):
+            raise
+
+    return entry_folder
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+DRUG_RESPONSE_STORE
+
+Parses the IC50 table and the drug specifications once and answers drug response
+queries for many drugs by index lookups, instead of re-reading the files for every drug.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+_loaded_stores = {}
+
+
+class DrugResponseStore():
+    """
+    In-memory drug response table.
+
+    ATTRIBUTES:
+        - response (np.ndarray): IC50 in the form (n_samples, n_drugs), nan when unknown.
+        - sample_names (np.ndarray): names of the samples, in the same order as response rows.
+        - drug_ids (np.ndarray): drug IDs as str, in the same order as response columns.
+        - drug_names (dict): name of each drug, indexed by drug ID as str.
+    """
+
+    def __init__(self, drug_response_file, drug_specification_file=None):
+        """
+        INPUT:
+            - drug_response_file (str): where the drug responses are stored, with samples
+            in rows (names in the first column) and drug IDs in columns.
+            - drug_specification_file (str, optional): where specification for drugs are
+            stored, with 'Identifier' and 'Name' columns.
+        """
+        drug_response = pd.read_csv(drug_response_file)
+        self.sample_names = drug_response.iloc[:,0].values.astype(str)
+        self.drug_ids = np.array(drug_response.columns[1:]).astype(str)
+        self.response = drug_response.iloc[:,1:].values.astype(float)
+
+        #Index samples and drugs, keeping the first occurrence of duplicates
+        self._sample_index = _first_occurrence_index(self.sample_names)
+        self._drug_index = _first_occurrence_index(self.drug_ids)
+
+        self.drug_names = {}
+        if drug_specification_file is not None:
+            drug_specifications = pd.read_csv(drug_specification_file, sep=',')
+            drug_specifications = drug_specifications.drop_duplicates(subset=['Identifier'], keep='first')
+            self.drug_names = dict(zip(drug_specifications.Identifier.astype(str),
+                                      drug_specifications.Name))
+
+    @classmethod
+    def load(cls, drug_response_file, drug_specification_file=None):
+        """
+        Return the store of the given files, parsing them only once per process.
+        The store is re-parsed if one of the files has been modified.
+        """
+        files = [drug_response_file, drug_specification_file]
+        key = tuple((os.path.abspath(f), os.path.getmtime(f)) if f is not None else None for f in files)
+        if key not in _loaded_stores:
+            _loaded_stores[key] = cls(drug_response_file, drug_specification_file)
+        return _loaded_stores[key]
+
+    def response_matrix(self, sample_names, drug_ids=None):
+        """
+        Response of the given samples to the given drugs.
+
+        INPUT:
+            - sample_names (np.ndarray): names of the samples.
+            - drug_ids (list, optional, default to None): drug IDs, all drugs if None.
+        OUTPUT:
+            - response (np.ma.MaskedArray): IC50 in the form (n_samples, n_drugs), masked
+            when the sample or the response is not available.
+        """
+        drug_ids = self.drug_ids if drug_ids is None else np.array(drug_ids).astype(str)
+
+        sample_position = self._sample_index.get_indexer(np.asarray(sample_names).astype(str))
+        drug_position = self._drug_index.get_indexer(drug_ids)
+        if np.any(drug_position == -1):
+            raise ValueError('Drug(s) not available: %s'%(', '.join(drug_ids[drug_position == -1])))
+
+        response = self.response[np.maximum(sample_position, 0)][:,drug_position]
+        mask = np.isnan(response)
+        mask[sample_position == -1] = True
+
+        return np.ma.masked_array(np.where(mask, np.nan, response), mask=mask)
+
+    def read_drug_response(self, drug_id, data, sample_names):
+        """
+        Filter the samples that have a response for one drug.
+
+        INPUT:
+            - drug_id (int): ID of the drug
+            - data (2d array): data in the form (n_samples, n_genes).
+            - sample_names (np.ndarray): names of samples, in the same order as data rows.
+        OUTPUT:
+            - data (2d array) : data filtered to give only the samples with known response.
+            - drug_response (array): drug response in the same order as data.
+            - sample_names : names of the samples with known drug response.
+            - drug_name (str) : name of the drug.
+        """
+        return self.read_drug_responses([drug_id], data, sample_names)[drug_id]
+
+    def read_drug_responses(self, drug_ids, data, sample_names):
+        """
+        Same as read_drug_response for several drugs at once.
+
+        OUTPUT:
+            - drug_responses (dict): for each drug ID, the tuple (data, drug_response,
+            sample_names, drug_name) returned by read_drug_response.
+        """
+        sample_names = np.asarray(sample_names)
+        response = self.response_matrix(sample_names, drug_ids)
+
+        drug_responses = {}
+        for i, drug_id in enumerate(drug_ids):
+            available_index = np.where(~response.mask[:,i])[0]
+            drug_responses[drug_id] = (data[available_index],
+                                       response.data[available_index,i],
+                                       sample_names[available_index],
+                                       self.drug_names.get(str(drug_id)))
+
+        return drug_responses
+
+
+def _first_occurrence_index(values):
+    values = pd.Index(values)
+    return values[~values.duplicated(keep='first')]
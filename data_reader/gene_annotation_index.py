@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+GENE_ANNOTATION_INDEX
+
+Gene annotation table (e.g. gene_status.csv or the pybiomart export) parsed once per
+process and indexed by gene name. Readers use it to filter protein coding genes and
+to retrieve chromosomes with hash lookups instead of re-reading the table. The parsed
+columns can be persisted as a compact .npz file.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from data_reader.data_cache import cache_key
+
+# Columns kept from the annotation table, when available
+annotation_columns = ['TCGA_name', 'ENSEMBL', 'Hugo', 'status', 'chromosome_name']
+
+# Nuclear chromosomes, used to remove mitochondrial and unplaced genes
+accepted_chromosomes = np.array(list(range(1,23)) + ['X','Y']).astype(str)
+
+_loaded_indexes = {}
+
+
+class GeneAnnotationIndex():
+    """
+    Annotation of genes indexed by TCGA name, ENSEMBL ID and Hugo symbol.
+
+    ATTRIBUTES:
+        - annotations (dict): column of the table (np.ndarray of str, '' when missing)
+        for each available column in annotation_columns.
+        - protein_coding (np.ndarray): boolean mask of the protein coding rows.
+        - canonical_chromosome (np.ndarray): boolean mask of the rows located on a
+        nuclear chromosome.
+    """
+
+    def __init__(self, gene_lookup_file, sep=',', cache_folder=None):
+        """
+        INPUT:
+            - gene_lookup_file (str): annotation table with at least one name column among
+            TCGA_name, ENSEMBL and Hugo, and a status column.
+            - sep (str, optional, default to ','): separator of the table.
+            - cache_folder (str, optional, default to None): if given, parsed columns are
+            saved there as .npz and re-used by later processes.
+        """
+        cache_file = None
+        if cache_folder is not None:
+            key = cache_key({'reader': 'gene_annotation_index', 'sep': sep}, [gene_lookup_file])
+            cache_file = os.path.join(cache_folder, '%s_genes.npz'%(key))
+
+        if cache_file is not None and os.path.isfile(cache_file):
+            with np.load(cache_file, allow_pickle=False) as cached_annotations:
+                self.annotations = {c: cached_annotations[c] for c in cached_annotations.files}
+        else:
+            genes_lookup_table = pd.read_csv(gene_lookup_file, sep=sep, dtype=str)
+            self.annotations = {c: np.array(genes_lookup_table[c].fillna('').values, dtype=str)
+                                for c in annotation_columns if c in genes_lookup_table.columns}
+            if cache_file is not None:
+                self._save_cache(cache_file)
+
+        self.protein_coding = self.annotations['status'] == 'protein_coding'
+        self.canonical_chromosome = np.isin(self.annotations.get('chromosome_name', np.array([], dtype=str)),
+                                            accepted_chromosomes)
+        self._indexes = {}
+
+    @classmethod
+    def load(cls, gene_lookup_file, sep=',', cache_folder=None):
+        """
+        Return the index of the given table, parsing it only once per process.
+        The index is re-parsed if the file has been modified.
+        """
+        key = (os.path.abspath(gene_lookup_file), os.path.getmtime(gene_lookup_file), sep, cache_folder)
+        if key not in _loaded_indexes:
+            _loaded_indexes[key] = cls(gene_lookup_file, sep, cache_folder)
+        return _loaded_indexes[key]
+
+    def protein_coding_genes(self, key='TCGA_name', unique_on=None):
+        """
+        Names of the protein coding genes.
+
+        INPUT:
+            - key (str, optional, default to TCGA_name): naming used, i.e. TCGA_name,
+            ENSEMBL or Hugo.
+            - unique_on (str, optional, default to None): if given, rows whose value in this
+            column is duplicated are discarded beforehand.
+        OUTPUT:
+            - genes (np.ndarray): unique names of protein coding genes.
+        """
+        return np.array(self._protein_coding_index(key, unique_on))
+
+    def is_protein_coding(self, gene_names, key='TCGA_name', unique_on=None):
+        """
+        Boolean mask of the protein coding genes among gene_names, i.e. genes with at
+        least one protein coding entry in the table.
+        """
+        index = self._protein_coding_index(key, unique_on)
+        return index.get_indexer(np.asarray(gene_names).astype(str)) != -1
+
+    def status(self, gene_names, key='TCGA_name'):
+        """
+        Status (e.g. protein_coding) of each gene, '' if not annotated. When a name
+        appears several times, the first entry is used.
+        """
+        return self._lookup('status', gene_names, key, keep='first')
+
+    def chromosome(self, gene_names, key='ENSEMBL'):
+        """
+        Chromosome of each gene, '' if not annotated. Names appearing several times in the
+        table are ambiguous and also return ''.
+        """
+        return self._lookup('chromosome_name', gene_names, key, keep=False)
+
+    def is_canonical_chromosome(self, gene_names, key='ENSEMBL'):
+        """
+        Boolean mask of the genes unambiguously located on a nuclear chromosome.
+        """
+        return np.isin(self.chromosome(gene_names, key), accepted_chromosomes)
+
+    def _protein_coding_index(self, key, unique_on):
+        index_key = ('protein_coding', key, unique_on)
+        if index_key not in self._indexes:
+            is_selected = self.protein_coding.copy()
+            if unique_on is not None:
+                is_selected &= ~pd.Index(self.annotations[unique_on]).duplicated(keep=False)
+            self._indexes[index_key] = pd.Index(np.unique(self.annotations[key][is_selected]))
+        return self._indexes[index_key]
+
+    def _lookup(self, column, gene_names, key, keep):
+        index_key = (column, key, keep)
+        if index_key not in self._indexes:
+            names = pd.Index(self.annotations[key])
+            if keep == 'first':
+                kept_rows = np.where(~names.duplicated(keep='first'))[0]
+            else:
+                kept_rows = np.where(~names.duplicated(keep=False))[0]
+            self._indexes[index_key] = (names[kept_rows], self.annotations[column][kept_rows])
+
+        names, values = self._indexes[index_key]
+        position = names.get_indexer(np.asarray(gene_names).astype(str))
+        return np.where(position != -1, values[np.maximum(position, 0)], '')
+
+    def _save_cache(self, cache_file):
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = '%s.%s.tmp.npz'%(cache_file, os.getpid())
+        np.savez(tmp_file, **self.annotations)
+        os.replace(tmp_file, cache_file)
@@ -5,48 +5,109 @@
 Harmonize the features between the target and the source data so that:
 - same feature space is considered between the source and the target.
 - features are odered in the same way, avoiding permutation issue.
+
+Any number of domains (e.g. cell lines, PDX and several tumor types) can be aligned at
+once with harmonize_feature_naming_domains.
 """
 
 import numpy as np
-import pandas as pd
+from data_reader.gene_annotation_index import GeneAnnotationIndex
 
 
-def harmonize_feature_naming(target_data, 
+def harmonize_feature_naming(target_data,
                             source_data,
                             target_gene_names,
                             source_gene_names,
                             remove_mytochondria=False,
-                            gene_lookup_file=None):
-    
-    #Find common genes
-    common_genes = np.intersect1d(target_gene_names, source_gene_names)
-    
-    #Find common gene location
-    target_common_gene_index = np.where(np.isin(target_gene_names, common_genes))[0]
-    source_common_gene_index = np.where(np.isin(source_gene_names, common_genes))[0]
-    
-    #Stack data
-    target_data = target_data[:,target_common_gene_index]
-    source_data = source_data[:,source_common_gene_index]
+                            gene_lookup_file=None,
+                            cache_folder=None):
+
+    (target_data, source_data), common_genes = harmonize_feature_naming_domains([target_data, source_data],
+                                                                               [target_gene_names, source_gene_names],
+                                                                               remove_mytochondria,
+                                                                               gene_lookup_file,
+                                                                               cache_folder)
+
+    return target_data, source_data, common_genes
+
+
+def harmonize_feature_naming_domains(data,
+                                    gene_names,
+                                    remove_mytochondria=False,
+                                    gene_lookup_file=None,
+                                    cache_folder=None):
+    """
+    Restrict several domains to their common genes, sorted by name.
+
+    INPUT:
+        - data (list): data of each domain in the form (n_samples, n_genes).
+        - gene_names (list): gene names of each domain, in the same order as data columns.
+        - remove_mytochondria (bool, optional, default to False): whether genes not located
+        on a nuclear chromosome should be removed.
+        - gene_lookup_file (str, optional, default to None): gene annotation table used to
+        remove mitochondrial genes.
+        - cache_folder (str, optional, default to None): folder where the parsed gene
+        annotation is persisted (see GeneAnnotationIndex).
+    OUTPUT:
+        - data (list): data of each domain restricted to the common genes. Domains whose
+        common genes are contiguous are returned as views, others as one gathered copy.
+        - common_genes (np.ndarray): sorted common genes, in the same order as data columns.
+    """
+    common_genes, gene_index = common_gene_index(gene_names)
 
     if remove_mytochondria and gene_lookup_file is not None:
-        #Load table
-        genes_lookup_table = pd.read_csv(gene_lookup_file, delimiter=',')
-        print(genes_lookup_table.shape)
-        genes_lookup_table = genes_lookup_table.drop_duplicates(subset=['ENSEMBL'], keep=False)
-        print(genes_lookup_table.shape)
-
-        #Transform gene names
-        df_genes_name = pd.DataFrame(common_genes, columns=['ENSEMBL'])
-        df_genes_name = df_genes_name.merge(genes_lookup_table, on='ENSEMBL', how='left')
-        chromosome_name = df_genes_name['chromosome_name'].values
-
-        #Filter data on mitochondria
-        accepted_chromosomes = np.array(list(range(1,23)) + ['X','Y'])
-        filtered_genes_index = np.where(np.isin(chromosome_name, accepted_chromosomes))[0]
-        target_data = target_data[:,filtered_genes_index]
-        source_data = source_data[:,filtered_genes_index]
+        #Filter data on mitochondria, genes with duplicated ENSEMBL ID being ambiguous
+        gene_annotation = GeneAnnotationIndex.load(gene_lookup_file, cache_folder=cache_folder)
+        filtered_genes_index = np.where(gene_annotation.is_canonical_chromosome(common_genes, key='ENSEMBL'))[0]
         common_genes = common_genes[filtered_genes_index]
+        gene_index = [index[filtered_genes_index] for index in gene_index]
+
+    #Gather data and verify that all domains have the same features
+    harmonized_data = []
+    for domain_data, domain_gene_names, index in zip(data, gene_names, gene_index):
+        if not np.array_equal(np.asarray(domain_gene_names)[index], common_genes):
+            raise ValueError('Genes are not aligned after harmonization')
+        harmonized_data.append(_gather_columns(domain_data, index))
+
+    return harmonized_data, common_genes
+
+
+def common_gene_index(gene_names):
+    """
+    Compute the genes shared by all domains and their location in each domain with one
+    sort of all gene names. For genes appearing several times in a domain, the first
+    occurrence is used.
+
+    INPUT:
+        - gene_names (list): gene names of each domain.
+    OUTPUT:
+        - common_genes (np.ndarray): sorted common genes.
+        - gene_index (list): for each domain, column of each common gene.
+    """
+    #Unique genes of each domain and position of their first occurrence
+    unique_genes = [np.unique(np.asarray(names).astype(str), return_index=True) for names in gene_names]
+
+    #Sorted merge: a gene is common if it appears once in each domain
+    all_genes = np.concatenate([genes for genes, _ in unique_genes])
+    all_positions = np.concatenate([positions for _, positions in unique_genes])
+    all_domains = np.concatenate([np.full(genes.shape[0], i) for i, (genes, _) in enumerate(unique_genes)])
+    order = np.lexsort((all_domains, all_genes))
+    all_genes, all_positions = all_genes[order], all_positions[order]
+
+    n_domains = len(gene_names)
+    run_start = np.concatenate([[True], all_genes[1:] != all_genes[:-1]]) if all_genes.shape[0] else np.array([], dtype=bool)
+    run_start = np.where(run_start)[0]
+    run_length = np.diff(np.append(run_start, all_genes.shape[0]))
+    common_start = run_start[run_length == n_domains]
+
+    common_genes = all_genes[common_start]
+    gene_index = [all_positions[common_start + i] for i in range(n_domains)]
+
+    return common_genes, gene_index
+
 
-    
-    return target_data, source_data, common_genes
\ No newline at end of file
+def _gather_columns(data, index):
+    #View when columns are contiguous and ordered, copy otherwise
+    if index.shape[0] > 0 and np.all(np.diff(index) == 1):
+        return data[:,index[0]:index[-1]+1]
+    return data[:,index]
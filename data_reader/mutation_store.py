@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+MUTATION_STORE
+
+Parses cBioPortal mutation status (and detailed) files once per gene and answers
+queries for many genes and tumor barcodes with hash-index lookups.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+# Status of tumors not present in the mutation data
+missing_status = -1
+
+_loaded_stores = {}
+
+
+class MutationStore():
+    """
+    Mutation status of several genes indexed by (shortened) tumor barcode.
+
+    Genes are added with add_gene. Status is 1 for mutated tumors, 0 for sequenced
+    tumors without mutation and -1 for tumors not found.
+    """
+
+    def __init__(self):
+        self._status = {}
+        self._protein_changes = {}
+        self._length_barcode = {}
+
+    @classmethod
+    def load(cls, mutation_files):
+        """
+        Return a store with the given genes, parsing each file only once per process.
+
+        INPUT:
+            - mutation_files (dict): for each gene name, the location of the status file
+            or a tuple (status file, detailed file).
+        """
+        store = cls()
+        for gene_name, files in mutation_files.items():
+            files = (files, None) if isinstance(files, str) else tuple(files)
+            key = (gene_name,) + tuple((os.path.abspath(f), os.path.getmtime(f)) if f is not None else None
+                                       for f in files)
+            if key not in _loaded_stores:
+                _loaded_stores[key] = cls()
+                _loaded_stores[key].add_gene(gene_name, *files)
+            store._copy_gene(_loaded_stores[key], gene_name)
+
+        return store
+
+    @property
+    def genes(self):
+        return list(self._status)
+
+    def add_gene(self, gene_name, mutation_data_location, mutation_detailed_data_location=None):
+        """
+        Parse the mutation files of one gene.
+
+        INPUT:
+            - gene_name (str): name of the gene considered
+            - mutation_data_location (str): where the cBioPortal status file is located.
+            - mutation_detailed_data_location (str, optional, default to None): where the
+            detailed file, with 'Sample ID' and 'Protein Change' columns, is located.
+        """
+        # Read mutation data
+        mutation_data = pd.read_csv(mutation_data_location, sep ='\t').transpose()
+        mutation_data = mutation_data[[0,2]]
+        mutation_data.columns = ['CLINICAL', 'MUTATIONS']
+        mutation_data = mutation_data.iloc[2:]
+        mutation_data = mutation_data[mutation_data.CLINICAL == 'Yes']
+
+        # Index samples on their shortened barcode, a sample is mutated if one of its
+        # aliquots is mutated.
+        samples = np.array(mutation_data.index).astype(str)
+        length_barcode = min([len(e) for e in samples])
+        status = pd.Series((~pd.isna(mutation_data.MUTATIONS.values)).astype(np.int8),
+                           index=[e[:length_barcode] for e in samples])
+        status = status.groupby(level=0).max()
+
+        self._status[gene_name] = status
+        self._length_barcode[gene_name] = length_barcode
+        self._protein_changes[gene_name] = None
+
+        if mutation_detailed_data_location is not None:
+            detail_data = pd.read_csv(mutation_detailed_data_location, sep='\t')
+            detail_data = detail_data[['Sample ID', 'Protein Change']]
+            detail_data.index = [e[:length_barcode] for e in detail_data['Sample ID'].values.astype(str)]
+            detail_data = detail_data[~detail_data.index.duplicated(keep='last')]
+            self._protein_changes[gene_name] = detail_data['Protein Change']
+
+    def query(self, genes, tumor_barcodes):
+        """
+        Mutation status of the given genes for the given tumors.
+
+        INPUT:
+            - genes (list): names of the genes considered.
+            - tumor_barcodes (list): list of tumor barcodes.
+        OUTPUT:
+            - mutation_status (np.ndarray): int8 status in the form (n_tumors, n_genes),
+            with 1 for mutated, 0 for non mutated and -1 if tumor has not been found.
+        """
+        mutation_status = np.full((len(tumor_barcodes), len(genes)), missing_status, dtype=np.int8)
+
+        for i, gene_name in enumerate(genes):
+            position, _ = self._positions(gene_name, tumor_barcodes)
+            found = position != -1
+            mutation_status[found,i] = self._status[gene_name].values[position[found]]
+
+        return mutation_status
+
+    def query_protein_changes(self, genes, tumor_barcodes):
+        """
+        Detailed mutation status of the given genes for the given tumors, encoded as in
+        read_mutations_tumors: '-1.0' if tumor has not been found, '0.0' if not mutated,
+        the protein change if available and '1.0' otherwise.
+
+        OUTPUT:
+            - protein_changes (pd.DataFrame): categorical columns indexed by gene, in the
+            same order as tumor_barcodes.
+        """
+        mutation_status = self.query(genes, tumor_barcodes)
+        protein_changes = {}
+
+        for i, gene_name in enumerate(genes):
+            gene_status = mutation_status[:,i].astype(float).astype(str)
+            if self._protein_changes[gene_name] is not None:
+                _, truncated_tumor_names = self._positions(gene_name, tumor_barcodes)
+                gene_details = self._protein_changes[gene_name].reindex(truncated_tumor_names).values
+                has_details = ~pd.isna(gene_details)
+                gene_status = gene_status.astype(object)
+                gene_status[has_details] = gene_details[has_details]
+            protein_changes[gene_name] = pd.Categorical(gene_status)
+
+        return pd.DataFrame(protein_changes, columns=genes)
+
+    def _positions(self, gene_name, tumor_barcodes):
+        length_barcode = self._length_barcode[gene_name]
+        truncated_tumor_names = [e[:length_barcode] for e in tumor_barcodes]
+        return self._status[gene_name].index.get_indexer(truncated_tumor_names), truncated_tumor_names
+
+    def _copy_gene(self, store, gene_name):
+        self._status[gene_name] = store._status[gene_name]
+        self._protein_changes[gene_name] = store._protein_changes[gene_name]
+        self._length_barcode[gene_name] = store._length_barcode[gene_name]
@@ -4,16 +4,20 @@
 
 import numpy as np
 import pandas as pd
+from data_reader.gene_annotation_index import GeneAnnotationIndex
 import rpy2.robjects as robjects
 from rpy2.robjects import pandas2ri
 pandas2ri.activate()
 
+# Gene annotation from pybiomart (ENSEMBL, Hugo and status), used for Cell Passport data
+biomart_gene_status_file = '/DATA/s.mourragui/data/2019_04_cell_line_data/pybiomart_gene_status.csv'
 
 
 def read_cell_line_data(cell_line_file,\
                         gene_lookup_file=None,\
                         cell_line_lookup_file=None,\
-                        tumor_type=None):
+                        tumor_type=None,\
+                        cache_folder=None):
     
     #Read data
     dataRDS = robjects.r['readRDS']
@@ -36,12 +40,10 @@ def read_cell_line_data(cell_line_file,\
 
     if gene_lookup_file is not None:
         #Remove non-protein coding genes
-        genes_lookup_table = pd.read_csv(gene_lookup_file)
-        genes_lookup_table = genes_lookup_table[genes_lookup_table.status == 'protein_coding']
-        protein_coding_genes = np.array(genes_lookup_table.TCGA_name.values)
+        gene_annotation = GeneAnnotationIndex.load(gene_lookup_file, cache_folder=cache_folder)
 
         #Filter and retrieve data
-        protein_coding_genes_index = np.where(np.isin(genes_name, protein_coding_genes))[0]
+        protein_coding_genes_index = np.where(gene_annotation.is_protein_coding(genes_name))[0]
         filtered_formatted_data = numpy_formatted_data[:,protein_coding_genes_index]
         filtered_genes = genes_name[protein_coding_genes_index]
 
@@ -53,7 +55,20 @@ def read_cell_line_data(cell_line_file,\
 def read_cell_line_data_cell_passport(cell_line_file,\
                                 gene_lookup_file=None,\
                                 cell_line_lookup_file=None,\
-                                tumor_type=None):
+                                tumor_type=None,\
+                                chunksize=None,\
+                                gene_annotation_file=biomart_gene_status_file,\
+                                cache_folder=None):
+    # Stream the long table when a chunk size is given
+    if chunksize is not None:
+        return _read_cell_line_data_cell_passport_chunked(cell_line_file,
+                                                          gene_lookup_file,
+                                                          cell_line_lookup_file,
+                                                          tumor_type,
+                                                          chunksize,
+                                                          gene_annotation_file,
+                                                          cache_folder)
+
     # Read Cell Model Passport
     cell_model_df = pd.read_csv(cell_line_file, sep=',')
     cell_model_gene_df = pd.read_csv(gene_lookup_file, sep=',')
@@ -66,12 +81,10 @@ def read_cell_line_data_cell_passport(cell_line_file,\
     cell_model_df = cell_model_df.merge(cell_model_gene_df[['gene_id', 'ensembl_gene_id']], on='gene_id', how='inner')
     cell_model_df = cell_model_df[['model_name', 'ensembl_gene_id', 'read_count', 'fpkm']]
 
-    gene_caract_file = '/DATA/s.mourragui/data/2019_04_cell_line_data/pybiomart_gene_status.csv'
-    gene_lookup_df = pd.read_csv(gene_caract_file, sep='\t')[['ENSEMBL','Hugo', 'status']]
-    gene_lookup_df = gene_lookup_df.drop_duplicates(subset=['Hugo'], keep=False)
-    cell_model_df = cell_model_df.merge(gene_lookup_df, left_on='ensembl_gene_id', right_on='ENSEMBL')
-    cell_model_df = cell_model_df[cell_model_df.status == 'protein_coding']
-    cell_model_df.head()
+    # Keep protein coding genes, discarding ambiguous Hugo symbols
+    gene_annotation = GeneAnnotationIndex.load(gene_annotation_file, sep='\t', cache_folder=cache_folder)
+    is_protein_coding = gene_annotation.is_protein_coding(cell_model_df.ensembl_gene_id.values, key='ENSEMBL', unique_on='Hugo')
+    cell_model_df = cell_model_df[is_protein_coding]
 
     # Put data in data matrix (samples per genes)
     cell_model_df = cell_model_df[['model_name', 'ensembl_gene_id', 'read_count']]
@@ -87,7 +100,18 @@ def read_cell_line_data_cell_passport(cell_line_file,\
 def read_cell_line_data_fpkm(cell_line_file,\
                         gene_lookup_file=None,\
                         cell_line_lookup_file=None,\
-                        tumor_type=None):
+                        tumor_type=None,\
+                        chunksize=None,\
+                        cache_folder=None):
+
+    # Stream the file when a chunk size is given
+    if chunksize is not None:
+        return _read_cell_line_data_fpkm_chunked(cell_line_file,
+                                                 gene_lookup_file,
+                                                 cell_line_lookup_file,
+                                                 tumor_type,
+                                                 chunksize,
+                                                 cache_folder)
 
     # Read data
     df_data = pd.read_csv(cell_line_file, sep='\t', index_col=0)
@@ -110,15 +134,123 @@ def read_cell_line_data_fpkm(cell_line_file,\
 
     if gene_lookup_file is not None:
         #Remove non-protein coding genes
-        genes_lookup_table = pd.read_csv(gene_lookup_file)
-        genes_lookup_table = genes_lookup_table[genes_lookup_table.status == 'protein_coding']
-        protein_coding_genes = np.array(genes_lookup_table.TCGA_name.values)
+        gene_annotation = GeneAnnotationIndex.load(gene_lookup_file, cache_folder=cache_folder)
 
         #Filter and retrieve data
-        protein_coding_genes_index = np.where(np.isin(genes_name, protein_coding_genes))[0]
+        protein_coding_genes_index = np.where(gene_annotation.is_protein_coding(genes_name))[0]
         filtered_formatted_data = numpy_formatted_data[:,protein_coding_genes_index]
         filtered_genes = genes_name[protein_coding_genes_index]
 
         return filtered_formatted_data, filtered_genes, samples_name
 
     return numpy_formatted_data, genes_name, samples_name
+
+
+def _read_cell_line_data_fpkm_chunked(cell_line_file,
+                                      gene_lookup_file,
+                                      cell_line_lookup_file,
+                                      tumor_type,
+                                      chunksize,
+                                      cache_folder=None):
+    """
+    Same as read_cell_line_data_fpkm, but reads the file by blocks of chunksize rows,
+    keeping only the relevant samples and genes of each block. Data is returned in float32
+    and peak memory scales with the filtered matrix, not with the file.
+    """
+    # Read the sample and gene names only
+    genes_name = np.array(pd.read_csv(cell_line_file, sep='\t', index_col=0, nrows=0).columns).astype(str)
+    samples_name = pd.read_csv(cell_line_file, sep='\t', usecols=[0]).iloc[:,0].values.astype(str)
+
+    relevant_samples_index = np.arange(samples_name.shape[0])
+    if cell_line_lookup_file is not None and tumor_type is not None:
+        #Load the data types
+        cell_lines_cancer_types = pd.read_csv(cell_line_lookup_file, delimiter='\t')
+        relevant_samples = cell_lines_cancer_types[cell_lines_cancer_types.tcga_type == tumor_type]['sample_name'].values
+        relevant_samples_index = np.where(np.isin(samples_name, relevant_samples))[0]
+
+    relevant_genes_index = np.arange(genes_name.shape[0])
+    if gene_lookup_file is not None:
+        #Remove non-protein coding genes
+        gene_annotation = GeneAnnotationIndex.load(gene_lookup_file, cache_folder=cache_folder)
+        relevant_genes_index = np.where(gene_annotation.is_protein_coding(genes_name))[0]
+
+    # Position of each file row in the data matrix, -1 for filtered samples
+    row_position = np.full(samples_name.shape[0], -1)
+    row_position[relevant_samples_index] = np.arange(relevant_samples_index.shape[0])
+
+    # Scatter each block in the preallocated matrix
+    formatted_data = np.zeros((relevant_samples_index.shape[0], relevant_genes_index.shape[0]), dtype=np.float32)
+    reader = pd.read_csv(cell_line_file,
+                         sep='\t',
+                         index_col=0,
+                         usecols=[0] + list(relevant_genes_index + 1),
+                         chunksize=chunksize)
+    first_row = 0
+    for chunk in reader:
+        chunk_position = row_position[first_row:first_row + chunk.shape[0]]
+        relevant_rows = chunk_position != -1
+        formatted_data[chunk_position[relevant_rows]] = chunk.values[relevant_rows]
+        first_row += chunk.shape[0]
+
+    return formatted_data, genes_name[relevant_genes_index], samples_name[relevant_samples_index]
+
+
+def _read_cell_line_data_cell_passport_chunked(cell_line_file,
+                                               gene_lookup_file,
+                                               cell_line_lookup_file,
+                                               tumor_type,
+                                               chunksize,
+                                               gene_annotation_file=biomart_gene_status_file,
+                                               cache_folder=None):
+    """
+    Same as read_cell_line_data_cell_passport, but reads the long table by blocks of
+    chunksize rows. Each block is mapped to (model, gene) positions using the small lookup
+    tables and accumulated in a preallocated float32 matrix, replacing the merges and the
+    pivot_table. Duplicated entries are averaged, as pivot_table does.
+    """
+    # Lookup tables
+    cell_model_gene_df = pd.read_csv(gene_lookup_file, sep=',')
+    cell_model_sample_df = pd.read_csv(cell_line_lookup_file, sep=',')
+    if tumor_type is not None:
+        cell_model_sample_df = cell_model_sample_df[cell_model_sample_df.tissue == tumor_type]
+
+    gene_annotation = GeneAnnotationIndex.load(gene_annotation_file, sep='\t', cache_folder=cache_folder)
+
+    # Row of each model and column of each gene in the (sorted) data matrix
+    model_lookup = cell_model_sample_df[['model_id', 'model_name']].drop_duplicates()
+    source_samples = np.unique(model_lookup.model_name.values.astype(str))
+    model_lookup = pd.DataFrame({'model_id': model_lookup.model_id.values,
+                                 'row': np.searchsorted(source_samples, model_lookup.model_name.values.astype(str))})
+
+    gene_lookup = cell_model_gene_df[['gene_id', 'ensembl_gene_id']].drop_duplicates()
+    gene_lookup = gene_lookup[gene_annotation.is_protein_coding(gene_lookup.ensembl_gene_id.values, key='ENSEMBL', unique_on='Hugo')]
+    source_gene_names = np.unique(gene_lookup.ensembl_gene_id.values.astype(str))
+    gene_lookup = pd.DataFrame({'gene_id': gene_lookup.gene_id.values,
+                                'column': np.searchsorted(source_gene_names, gene_lookup.ensembl_gene_id.values.astype(str))})
+
+    # Accumulate sum and number of read counts of each (model, gene)
+    source_data = np.zeros((source_samples.shape[0], source_gene_names.shape[0]), dtype=np.float32)
+    n_values = np.zeros(source_data.shape, dtype=np.int32)
+    is_observed = np.zeros(source_data.shape, dtype=bool)
+    reader = pd.read_csv(cell_line_file, sep=',', usecols=['model_id', 'gene_id', 'read_count'], chunksize=chunksize)
+    for chunk in reader:
+        chunk = chunk.merge(model_lookup, on='model_id', how='inner')
+        chunk = chunk.merge(gene_lookup, on='gene_id', how='inner')
+        position = (chunk.row.values, chunk.column.values)
+        is_observed[position] = True
+
+        has_value = ~pd.isna(chunk.read_count.values)
+        position = (position[0][has_value], position[1][has_value])
+        np.add.at(source_data, position, chunk.read_count.values[has_value].astype(np.float32))
+        np.add.at(n_values, position, 1)
+
+    np.divide(source_data, n_values, out=source_data, where=n_values > 0)
+    del n_values
+
+    # Remove models and genes absent from the data, as pivot_table
+    observed_samples = np.where(np.any(is_observed, axis=1))[0]
+    observed_genes = np.where(np.any(is_observed, axis=0))[0]
+    if observed_samples.shape[0] < source_samples.shape[0] or observed_genes.shape[0] < source_gene_names.shape[0]:
+        source_data = source_data[np.ix_(observed_samples, observed_genes)]
+
+    return source_data, source_gene_names[observed_genes], source_samples[observed_samples]
@@ -10,6 +10,7 @@ barcode identification.
 
 import pandas as pd
 import numpy as np
+from data_reader.cna_store import CNAStore
 
 default_location = '../../data/2018_03_29_cna/tcga_breast/data.txt'
 
@@ -31,23 +32,10 @@ def read_cna_tumors(gene_name,\
         - list of the cna with nan if tumor has not been found
     """
     
-    #Read CNA
-    cna_df = pd.read_csv(cna_data_location, sep='\t')
-    
-    #Select the relevant row and transpose for later filtering
-    cna_df_filtered = cna_df[cna_df['Hugo_Symbol'] == gene_name]
-    cna_df_filtered = cna_df_filtered.transpose()
-    
-    #Shorten the barcode for later usage
-    length_barcode = np.min([len(e) for e in cna_df_filtered.index.values][2:])
-    shortened_barcode = [barcode[:length_barcode] for barcode in tumor_barcodes]
-    cna_df_filtered.index = [e[:length_barcode] for e in cna_df_filtered.index.values]
-    
-    #Retrieve cna
-    cna_tumors = [cna_df_filtered[cna_df_filtered.index == barcode] for barcode in shortened_barcode]
-    cna_tumors = [cna.values[0,0] if cna.shape[0] >= 1 else np.nan for cna in cna_tumors]
-    
-    return np.array(cna_tumors)
+    #The table is read once per process and queried by index
+    cna_store = CNAStore.load(cna_data_location)
+
+    return cna_store.query([gene_name], tumor_barcodes)[:,0]
 
 
 
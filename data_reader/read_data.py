@@ -10,12 +10,17 @@ files and convert them into a (samples, genes) format. Further processing is don
 source and target have the same genes, in the same order.
 
 Source and target sample names (barcodes in the case of tumors) are also retrieved.
+Results can be stored in an on-disk cache (see data_cache) to avoid re-parsing the
+input files at every call.
 """
 
+import numpy as np
 from data_reader.read_tumor_data import read_tumor_data
 from data_reader.read_cell_line_data import read_cell_line_data, read_cell_line_data_fpkm, read_cell_line_data_cell_passport
+from data_reader.read_cell_line_data import biomart_gene_status_file
 from data_reader.read_pdx_data import read_pdx_data
-from data_reader.harmonize_feature_naming import harmonize_feature_naming
+from data_reader.harmonize_feature_naming import harmonize_feature_naming, harmonize_feature_naming_domains
+from data_reader.data_cache import cache_key, load_cached_data, save_cached_data
 
 # For PRECISE-like files, i.e. in RDS
 precise_cl_folder = '../data/cell_line/'
@@ -33,7 +38,15 @@ def read_data(source_type,
             data_type,
             source_tissue=None,
             target_tissue=None,
-            remove_mytochondria=False):
+            remove_mytochondria=False,
+            cache_folder=None,
+            mmap_mode='r',
+            hash_input_files=False,
+            chunksize=None,
+            tumor_barcodes=None,
+            lazy=False,
+            dtype=None,
+            n_jobs=1):
     """
     Read data located in different files with one source and one target type and 
     homogenize the features to keep the overlapping ones in the same order.
@@ -47,6 +60,17 @@ def read_data(source_type,
         - target_tissue (str, optional, default to None): tissue of origin for the target
         - remove_mytochondria (bool, optional, default to False): whether mythocondrial 
         genes should be removed.
+        - cache_folder (str, optional, default to None): folder of the on-disk cache. If
+        None, no cache is used. Otherwise, data is loaded from the cache when available and
+        saved in it after reading. The parsed gene annotation is also persisted there.
+        - mmap_mode (str, optional, default to 'r'): memory-map mode of target_data and
+        source_data when loaded from the cache. None loads them fully in memory.
+        - hash_input_files (bool, optional, default to False): whether the cache key uses
+        the content of the input files instead of their size and modification time.
+        - chunksize (int, optional, default to None): if given, large cell line files (fpkm
+        and count_passport) are streamed by blocks of chunksize rows into float32 matrices.
+        - tumor_barcodes, lazy, dtype, n_jobs (optional): options of the tumor reader, see
+        read_one_data_source.
     OUTPUT:
         - target_data (np.ndarray): array with target data in the form (n_samples, n_genes).
         - source_data (np.ndarray): array with source data in the form (n_samples, n_genes).
@@ -58,15 +82,76 @@ def read_data(source_type,
         than in target_data.
     """
 
+    if cache_folder is not None:
+        parameters = {
+            'source_type': source_type.lower(),
+            'target_type': target_type.lower(),
+            'data_type': data_type.lower(),
+            'source_tissue': source_tissue,
+            'target_tissue': target_tissue,
+            'remove_mytochondria': remove_mytochondria,
+            'chunksize': chunksize,
+            'tumor_barcodes': None if tumor_barcodes is None else sorted(np.asarray(tumor_barcodes).astype(str).tolist()),
+            'dtype': None if dtype is None else np.dtype(dtype).str
+        }
+        input_files = list(data_source_files(source_type, data_type, source_tissue).values())\
+                    + list(data_source_files(target_type, data_type, target_tissue).values())\
+                    + ['%sgene_status.csv'%(lookup_folder)]
+        key = cache_key(parameters, input_files, hash_input_files)
+
+        cached_data = load_cached_data(key, cache_folder, mmap_mode)
+        if cached_data is not None:
+            return cached_data
+
+        data = _read_data(source_type, target_type, data_type, source_tissue,
+                         target_tissue, remove_mytochondria, chunksize, cache_folder,
+                         tumor_barcodes=tumor_barcodes, lazy=lazy, dtype=dtype, n_jobs=n_jobs)
+        save_cached_data(key, *data, cache_folder=cache_folder, parameters=parameters)
+
+        return load_cached_data(key, cache_folder, mmap_mode)
+
+    return _read_data(source_type, target_type, data_type, source_tissue,
+                     target_tissue, remove_mytochondria, chunksize,
+                     tumor_barcodes=tumor_barcodes, lazy=lazy, dtype=dtype, n_jobs=n_jobs)
+
+
+def _read_data(source_type,
+              target_type,
+              data_type,
+              source_tissue=None,
+              target_tissue=None,
+              remove_mytochondria=False,
+              chunksize=None,
+              annotation_cache_folder=None,
+              tumor_barcodes=None,
+              lazy=False,
+              dtype=None,
+              n_jobs=1):
+    """
+    Read and harmonize source and target without the data cache, see read_data. The parsed
+    gene annotation is persisted in annotation_cache_folder if given.
+    """
     # Read source data
     source_data, source_gene_names, source_samples = read_one_data_source(source_type,
                                                                           data_type,
-                                                                          source_tissue)
+                                                                          source_tissue,
+                                                                          chunksize,
+                                                                          annotation_cache_folder,
+                                                                          tumor_barcodes=tumor_barcodes,
+                                                                          lazy=lazy,
+                                                                          dtype=dtype,
+                                                                          n_jobs=n_jobs)
 
     # Read target data
     target_data, target_gene_names, target_samples = read_one_data_source(target_type,
                                                                           data_type,
-                                                                          target_tissue)
+                                                                          target_tissue,
+                                                                          chunksize,
+                                                                          annotation_cache_folder,
+                                                                          tumor_barcodes=tumor_barcodes,
+                                                                          lazy=lazy,
+                                                                          dtype=dtype,
+                                                                          n_jobs=n_jobs)
 
     # Homegenize to get same genes, i.e. features
     gene_lookup_file = '%sgene_status.csv'%(lookup_folder)
@@ -75,12 +160,119 @@ def read_data(source_type,
                                                                   target_gene_names,
                                                                   source_gene_names,
                                                                   remove_mytochondria,
-                                                                  gene_lookup_file)
+                                                                  gene_lookup_file,
+                                                                  annotation_cache_folder)
 
     return target_data, source_data, gene_names, source_samples, target_samples
 
 
-def read_one_data_source(model_type, data_type, tissue):
+def read_data_domains(domains,
+                    data_type,
+                    remove_mytochondria=False,
+                    chunksize=None,
+                    cache_folder=None):
+    """
+    Read several domains, each of them once, and homogenize the features of all of them
+    to keep the genes shared by all domains in the same order.
+
+    INPUT:
+        - domains (list): (model_type, tissue) of each domain, e.g. [('cell_line', None),
+        ('pdx', 'BRCA'), ('tumor', 'BRCA')].
+        - data_type (str): type of data, i.e. fpkm, count or count_passport.
+        - remove_mytochondria (bool, optional, default to False): whether mythocondrial
+        genes should be removed.
+        - chunksize (int, optional, default to None): see read_data.
+        - cache_folder (str, optional, default to None): folder where the parsed gene
+        annotation is persisted (see GeneAnnotationIndex).
+    OUTPUT:
+        - data (list): array of each domain in the form (n_samples, n_genes).
+        - gene_names (np.ndarray): array with the names of the genes, in the same order than
+        the features of all domains.
+        - samples (list): sample names of each domain, in the same order than data.
+    """
+    data, domain_gene_names, samples = [], [], []
+    for model_type, tissue in domains:
+        domain_data, gene_names, domain_samples = read_one_data_source(model_type, data_type, tissue, chunksize, cache_folder)
+        data.append(domain_data)
+        domain_gene_names.append(gene_names)
+        samples.append(domain_samples)
+
+    gene_lookup_file = '%sgene_status.csv'%(lookup_folder)
+    data, gene_names = harmonize_feature_naming_domains(data,
+                                                       domain_gene_names,
+                                                       remove_mytochondria,
+                                                       gene_lookup_file,
+                                                       cache_folder)
+
+    return data, gene_names, samples
+
+
+def data_source_files(model_type, data_type, tissue):
+    """
+    Files read for one source and one data type.
+
+    INPUT:
+        - model_type (str): type of the source, i.e. cell_line pdx or tumor.
+        - data_type (str): type of data, i.e. fpkm, count or count_passport.
+        - tissue (str, optional, default to None): tissue of origin
+    OUTPUT:
+        - files (dict): location of the files, with keys corresponding to the reader
+        arguments.
+    """
+    gene_lookup_file = '%sgene_status.csv'%(lookup_folder)
+
+    if model_type.lower() == 'tumor':
+        return {
+            'tumor_file': '%s%s_%s_netcdf'%(tumor_folder,
+                                            'count' if data_type == 'count_passport' else data_type,
+                                            tissue),
+            'gene_lookup_file': gene_lookup_file,
+            'biospecimen_file': '%sbiospec_%s'%(tumor_folder, tissue)
+        }
+
+    elif model_type.lower() == 'cell_line':
+        cell_line_lookup_file = '%scancer_type.csv'%(precise_cl_folder)
+
+        if data_type.lower() == 'fpkm':
+            return {
+                'cell_line_file': '%srnaseq_fpkm_protein_coding.csv'%(precise_cl_folder),
+                'gene_lookup_file': gene_lookup_file,
+                'cell_line_lookup_file': cell_line_lookup_file
+            }
+
+        elif data_type.lower() == 'count':
+            return {
+                'cell_line_file': '%srnaseq_readcounts_TCGA.RDS'%(precise_cl_folder),
+                'gene_lookup_file': gene_lookup_file,
+                'cell_line_lookup_file': cell_line_lookup_file
+            }
+
+        elif data_type.lower() == 'count_passport':
+            return {
+                'cell_line_file': '%srnaseq_latest.csv'%(cell_passport_cl_folder),
+                'gene_lookup_file': '%sgene_identifiers_latest.csv'%(cell_passport_cl_folder),
+                'cell_line_lookup_file': '%smodel_list_latest.csv'%(cell_passport_cl_folder),
+                'gene_annotation_file': biomart_gene_status_file
+            }
+
+    elif model_type.lower() == 'pdx':
+        return {
+            'pdx_file': '%spdx_%s_TCGA_index_fpkm.csv'%(pdx_folder, tissue),
+            'gene_lookup_file': gene_lookup_file
+        }
+
+    return {}
+
+
+def read_one_data_source(model_type,
+                        data_type,
+                        tissue,
+                        chunksize=None,
+                        cache_folder=None,
+                        tumor_barcodes=None,
+                        lazy=False,
+                        dtype=None,
+                        n_jobs=1):
     """
     Read data corresponding to one source and one data type.
     
@@ -88,6 +280,17 @@ def read_one_data_source(model_type, data_type, tissue):
         - model_type (str): type of the source, i.e. cell_line pdx or tumor.
         - data_type (str): type of data, i.e. fpkm, count or count_passport.
         - tissue (str, optional, default to None): tissue of origin
+        - chunksize (int, optional, default to None): number of rows read at once for
+        cell line fpkm and count_passport data. Whole files are read if None.
+        - cache_folder (str, optional, default to None): folder where the parsed gene
+        annotation is persisted (see GeneAnnotationIndex).
+        - tumor_barcodes (list, optional, default to None): barcodes of the tumors to read.
+        Only these samples are read from the file (see read_tumor_data_lazy).
+        - lazy (bool, optional, default to False): whether tumor counts are read by blocks
+        of genes of interest instead of loading the full matrix.
+        - dtype (np.dtype, optional, default to None): type of the tumor counts, e.g.
+        np.float32 or np.int32. Type of the file if None.
+        - n_jobs (int, optional, default to 1): number of threads reading tumor blocks.
     OUTPUT:
         - data (np.ndarray): array with target data in the form (n_samples, n_genes).
         - gene_names (np.ndarray): array with the names of the genes, in the same order than 
@@ -95,49 +298,48 @@ def read_one_data_source(model_type, data_type, tissue):
         - samples (np.ndarray): array with the target sample names, in the same order
         than in data.
     """
-    gene_lookup_file = '%sgene_status.csv'%(lookup_folder)
-    biospec_file = '%sbiospec_%s'%(tumor_folder, tissue)
+    files = data_source_files(model_type, data_type, tissue)
 
     if model_type.lower() == 'tumor':
-        tumor_file = '%s%s_%s_netcdf'%(tumor_folder,
-                                      'count' if data_type == 'count_passport' else data_type,
-                                      tissue)
-
-        return read_tumor_data(tumor_file,
-                              gene_lookup_file,
-                              biospec_file)
+        return read_tumor_data(files['tumor_file'],
+                              files['gene_lookup_file'],
+                              files['biospecimen_file'],
+                              lazy=lazy,
+                              dtype=dtype,
+                              n_jobs=n_jobs,
+                              cache_folder=cache_folder,
+                              tumor_barcodes=tumor_barcodes)
 
     elif model_type.lower() == 'cell_line':
-        cell_line_lookup_file = '%scancer_type.csv'%(precise_cl_folder)
-
         if data_type.lower() == 'fpkm':
-            cell_line_file = '%srnaseq_fpkm_protein_coding.csv'%(precise_cl_folder)
-            return read_cell_line_data_fpkm(cell_line_file,
-                                          gene_lookup_file,
-                                          cell_line_lookup_file,
-                                          tissue)
+            return read_cell_line_data_fpkm(files['cell_line_file'],
+                                          files['gene_lookup_file'],
+                                          files['cell_line_lookup_file'],
+                                          tissue,
+                                          chunksize,
+                                          cache_folder)
 
         elif data_type.lower() == 'count':
-            cell_line_file = '%srnaseq_readcounts_TCGA.RDS'%(precise_cl_folder)
-            return read_cell_line_data(cell_line_file,
-                                      gene_lookup_file,
-                                      cell_line_lookup_file,
-                                      tissue)
+            return read_cell_line_data(files['cell_line_file'],
+                                      files['gene_lookup_file'],
+                                      files['cell_line_lookup_file'],
+                                      tissue,
+                                      cache_folder)
 
         elif data_type.lower() == 'count_passport':
-            cell_line_file = '%srnaseq_latest.csv'%(cell_passport_cl_folder)
-            gene_lookup_file = '%sgene_identifiers_latest.csv'%(cell_passport_cl_folder)
-            cell_line_lookup_file = '%smodel_list_latest.csv'%(cell_passport_cl_folder)
-            return read_cell_line_data_cell_passport(cell_line_file,
-                                                  gene_lookup_file,
-                                                  cell_line_lookup_file,
-                                                  tissue)
+            return read_cell_line_data_cell_passport(files['cell_line_file'],
+                                                  files['gene_lookup_file'],
+                                                  files['cell_line_lookup_file'],
+                                                  tissue,
+                                                  chunksize,
+                                                  files['gene_annotation_file'],
+                                                  cache_folder)
 
     elif model_type.lower() == 'pdx':
         if data_type.lower() != 'fpkm':
             raise ValueError('FPKM not available for PDX.')
 
-        pdx_file = '%spdx_%s_TCGA_index_fpkm.csv'%(pdx_folder, tissue)
-        return read_pdx_data(pdx_file,
-                            gene_lookup_file,
-                            None)
\ No newline at end of file
+        return read_pdx_data(files['pdx_file'],
+                            files['gene_lookup_file'],
+                            None,
+                            cache_folder=cache_folder)
@@ -10,6 +10,7 @@ Comprehensive reader with lookup function.
 
 import numpy as np
 import pandas as pd
+from data_reader.drug_response_store import DrugResponseStore
 
 
 def read_drug_response(drug_id,
@@ -74,24 +75,9 @@ def read_drug_response_cell_lines(drug_id,
         - drug_name (str) : name of the drug
     """
         
-    #Read drug response and process data
-    drug_response = pd.read_csv(drug_response_file)
-    drug_response.columns = ['sample_name'] + list(drug_response.columns[1:])
-    drug_response = drug_response[['sample_name', str(drug_id)]]
-    drug_response = drug_response.dropna()
-    
-    #Take common sample
-    common_samples_names = np.intersect1d(cell_lines_sample_names, drug_response.sample_name.values)
-    common_samples_names_index = np.where(np.isin(cell_lines_sample_names, common_samples_names))[0]
-    cell_lines_sample_names = cell_lines_sample_names[common_samples_names_index]
-    
-    #Retrieve values
-    cell_lines_data = cell_lines_data[common_samples_names_index,:]
-    drug_response = np.array([drug_response[drug_response.sample_name == e][str(drug_id)].values[0] \
-                         for e in cell_lines_sample_names])
-    
-    #Read name
-    drug_name = pd.read_csv(drug_specification_file, sep=',')
-    drug_name = drug_name[drug_name.Identifier == drug_id]['Name'].values[0]
-    
-    return cell_lines_data, drug_response, cell_lines_sample_names, drug_name
\ No newline at end of file
+    #Files are parsed once per process, responses are retrieved by index lookups
+    drug_response_store = DrugResponseStore.load(drug_response_file, drug_specification_file)
+
+    return drug_response_store.read_drug_response(drug_id,
+                                                  cell_lines_data,
+                                                  cell_lines_sample_names)
\ No newline at end of file
@@ -11,6 +11,7 @@ comply with the input data.
 
 import pandas as pd
 import numpy as np
+from data_reader.mutation_store import MutationStore
 
 default_location = '../../data/2018_07_20_biomarkers/tcga_skin/BRAF_mutation_status.csv'
 default_detail_location = '../../data/2018_07_20_biomarkers/tcga_skin/BRAF_mutation_detailed.csv'
@@ -32,38 +33,10 @@ def read_mutations_tumors(gene_name,\
         - list of mutation status with -1 if tumor has not been found
     """
 
-    # Read mutation data
-    mutation_data = pd.read_csv(mutation_data_location, sep ='\t').transpose()
-    mutation_data = mutation_data[[0,2]]
-    mutation_data.columns = ['CLINICAL', 'MUTATIONS']
-    mutation_data = mutation_data.iloc[2:]
-    mutation_data = mutation_data[mutation_data.CLINICAL == 'Yes']
-
-    # Filter the samples according to their mutation status
-    samples = mutation_data.index
-    non_mutated_samples = mutation_data[pd.isna(mutation_data.MUTATIONS)].index.astype(np.str)
-    mutated_samples = mutation_data[~pd.isna(mutation_data.MUTATIONS)].index.astype(np.str)
-
-    # Compute mutation status
-    mutation_status = - np.ones(len(tumor_barcodes))
-
-    length_barcode = min([len(e) for e in samples])
-    truncated_tumor_names = [e[:length_barcode] for e in tumor_barcodes]
-    non_mutated_samples = [e[:length_barcode] for e in non_mutated_samples]
-    mutated_samples = [e[:length_barcode] for e in mutated_samples]
-
-    mutation_status[np.where(np.isin(truncated_tumor_names, non_mutated_samples))] = 0
-    mutation_status[np.where(np.isin(truncated_tumor_names, mutated_samples))] = 1
+    # Files are parsed once per process and queried by index
+    mutation_store = MutationStore.load({gene_name: (mutation_data_location, mutation_detailed_data_location)})
 
     if mutation_detailed_data_location is None:
-        return mutation_status
-
-    # Read more details
-    detail_data = pd.read_csv(mutation_detailed_data_location, sep='\t')
-    detail_data = detail_data[['Sample ID', 'Protein Change']]
-
-    mutation_status = mutation_status.astype(np.str)
-    for tumor_name, protein_change in detail_data.values:
-        mutation_status[np.isin(truncated_tumor_names, [tumor_name[:length_barcode]])] = protein_change
+        return mutation_store.query([gene_name], tumor_barcodes)[:,0].astype(float)
 
-    return mutation_status
\ No newline at end of file
+    return np.array(mutation_store.query_protein_changes([gene_name], tumor_barcodes)[gene_name].astype(str))
\ No newline at end of file
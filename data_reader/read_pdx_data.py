@@ -7,12 +7,14 @@ READ_PDX_DATA
 
 import numpy as np
 import pandas as pd
+from data_reader.gene_annotation_index import GeneAnnotationIndex
 
 
 def read_pdx_data(pdx_file,
                 gene_lookup_file=None,
                 cell_line_lookup_file=None,
-                tumor_type=None):
+                tumor_type=None,
+                cache_folder=None):
     
     #Read data
     pdx_data = pd.read_csv(pdx_file)
@@ -28,12 +30,10 @@ def read_pdx_data(pdx_file,
 
     if gene_lookup_file is not None:
         #Remove non-protein coding genes
-        genes_lookup_table = pd.read_csv(gene_lookup_file)
-        genes_lookup_table = genes_lookup_table[genes_lookup_table.status == 'protein_coding']
-        protein_coding_genes = np.array(genes_lookup_table.TCGA_name.values)
+        gene_annotation = GeneAnnotationIndex.load(gene_lookup_file, cache_folder=cache_folder)
 
         #Filter and retrieve data
-        protein_coding_genes_index = np.where(np.isin(genes_name, protein_coding_genes))[0]
+        protein_coding_genes_index = np.where(gene_annotation.is_protein_coding(genes_name))[0]
         filtered_formatted_data = numpy_formatted_data[:,protein_coding_genes_index]
         filtered_genes = genes_name[protein_coding_genes_index]
 
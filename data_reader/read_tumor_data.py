@@ -8,19 +8,42 @@ READ_TUMOR_DATA
 import xarray as xr
 import numpy as np
 import pandas as pd
+from data_reader.gene_annotation_index import GeneAnnotationIndex
+from joblib import Parallel, delayed
 
 
 
 def read_tumor_data(tumor_file,\
                     gene_lookup_file=None,\
-                    biospecimen_file=None):
+                    biospecimen_file=None,\
+                    missing_aliquots='raise',\
+                    lazy=False,\
+                    dtype=None,\
+                    gene_chunk_size=2000,\
+                    n_jobs=1,\
+                    cache_folder=None,\
+                    tumor_barcodes=None):
     
+    #Read only the genes (and samples) of interest, always when barcodes are selected
+    if lazy or tumor_barcodes is not None:
+        return read_tumor_data_lazy(tumor_file,
+                                    gene_lookup_file,
+                                    biospecimen_file,
+                                    missing_aliquots,
+                                    tumor_barcodes=tumor_barcodes,
+                                    dtype=dtype,
+                                    gene_chunk_size=gene_chunk_size,
+                                    n_jobs=n_jobs,
+                                    cache_folder=cache_folder)
+
     #Read data
     tumors_data = xr.open_dataset(tumor_file)
     tumors_data = tumors_data.sortby('ensemble_gene')
     
     #Transform data
     formatted_data = np.array(tumors_data['counts'])
+    if dtype is not None:
+        formatted_data = formatted_data.astype(dtype)
     
     #Pick gene names
     genes_names = np.array(tumors_data['ensemble_gene'])
@@ -28,12 +51,10 @@ def read_tumor_data(tumor_file,\
     
     #Remove non-protein coding genes
     if gene_lookup_file is not None:
-        genes_lookup_table = pd.read_csv(gene_lookup_file)
-        genes_lookup_table = genes_lookup_table[genes_lookup_table.status == 'protein_coding']
-        protein_coding_genes = np.array(genes_lookup_table.TCGA_name.values)
+        gene_annotation = GeneAnnotationIndex.load(gene_lookup_file, cache_folder=cache_folder)
     
         #Filter and retrieve data
-        protein_coding_genes_index = np.where(np.isin(genes_names, protein_coding_genes))[0]
+        protein_coding_genes_index = np.where(gene_annotation.is_protein_coding(genes_names))[0]
         formatted_data = formatted_data[:,protein_coding_genes_index]
         genes_names = genes_names[protein_coding_genes_index]
     
@@ -41,9 +62,166 @@ def read_tumor_data(tumor_file,\
     if biospecimen_file is not None:
         biospec_data = xr.open_dataset(biospecimen_file)[['barcode']]
         biospec_data = biospec_data.to_dataframe()
-        del biospec_data.index.name #for convenience
+        biospec_data.index.name = None #for convenience
         aliquot_values = np.array(tumors_data['aliquot']).astype(str)
-        barcode_value = [biospec_data[biospec_data.index == al].values[0][0] for al in aliquot_values]
+        barcode_value, missing_index = aliquots_to_barcodes(aliquot_values, biospec_data)
+
+        #Aliquots without barcode either raise an error or are removed
+        if missing_index.shape[0] > 0:
+            if missing_aliquots == 'drop':
+                formatted_data = np.delete(formatted_data, missing_index, 0)
+                barcode_value = np.delete(barcode_value, missing_index)
+            else:
+                raise ValueError('%s aliquot(s) not found in %s: %s'%(missing_index.shape[0],
+                                                                      biospecimen_file,
+                                                                      ', '.join(aliquot_values[missing_index[:10]])))
+
+        return formatted_data, genes_names, list(barcode_value)
+
+    return formatted_data, genes_names, []
+
+
+def read_tumor_data_lazy(tumor_file,
+                         gene_lookup_file=None,
+                         biospecimen_file=None,
+                         missing_aliquots='raise',
+                         tumor_barcodes=None,
+                         dtype=None,
+                         gene_chunk_size=2000,
+                         n_jobs=1,
+                         cache_folder=None):
+    """
+    Same as read_tumor_data, but the genes and samples to keep are computed first from
+    the coordinates, the lookup table and the biospecimen table. Counts are then read
+    from the NetCDF file by blocks of genes, so that the full matrix is never loaded.
+
+    INPUT:
+        - tumor_file, gene_lookup_file, biospecimen_file, missing_aliquots: see read_tumor_data.
+        - tumor_barcodes (list, optional, default to None): barcodes of interest. If given,
+        only the samples with one of these barcodes are read (requires biospecimen_file).
+        - dtype (np.dtype, optional, default to None): type of the returned counts, e.g.
+        np.float32 or np.int32. Type of the file if None.
+        - gene_chunk_size (int, optional, default to 2000): number of genes per block.
+        - n_jobs (int, optional, default to 1): number of threads reading blocks.
+        - cache_folder (str, optional, default to None): folder where the parsed gene
+        annotation is persisted (see GeneAnnotationIndex).
+    OUTPUT:
+        - formatted_data (np.ndarray): counts in the form (n_samples, n_genes).
+        - genes_names (np.ndarray): ENSEMBL names, sorted as in read_tumor_data.
+        - barcodes (list): barcode of each sample, empty if no biospecimen_file.
+    """
+    if tumor_barcodes is not None and biospecimen_file is None:
+        raise ValueError('A biospecimen file is required to select tumor barcodes')
+
+    tumors_data = xr.open_dataset(tumor_file)
+    counts = tumors_data['counts']
+    sample_dim = [dim for dim in counts.dims if dim != 'ensemble_gene'][0]
+    counts = counts.transpose(sample_dim, 'ensemble_gene')
+
+    #Genes sorted by name, as sortby, and filtered on protein coding genes
+    genes_names = np.array(tumors_data['ensemble_gene'])
+    gene_position = np.argsort(genes_names, kind='stable')
+    genes_names = np.array([str(name.split('.')[0]) for name in genes_names[gene_position]])
+    if gene_lookup_file is not None:
+        gene_annotation = GeneAnnotationIndex.load(gene_lookup_file, cache_folder=cache_folder)
+        protein_coding_genes_index = np.where(gene_annotation.is_protein_coding(genes_names))[0]
+        gene_position = gene_position[protein_coding_genes_index]
+        genes_names = genes_names[protein_coding_genes_index]
+
+    #Samples with a known barcode (and of interest)
+    sample_position = np.arange(counts.shape[0])
+    barcode_value = []
+    if biospecimen_file is not None:
+        biospec_data = xr.open_dataset(biospecimen_file)[['barcode']]
+        biospec_data = biospec_data.to_dataframe()
+        biospec_data.index.name = None #for convenience
+        aliquot_values = np.array(tumors_data['aliquot']).astype(str)
+        barcode_value, missing_index = aliquots_to_barcodes(aliquot_values, biospec_data)
+
+        if missing_index.shape[0] > 0 and missing_aliquots != 'drop':
+            raise ValueError('%s aliquot(s) not found in %s: %s'%(missing_index.shape[0],
+                                                                  biospecimen_file,
+                                                                  ', '.join(aliquot_values[missing_index[:10]])))
+        is_kept = np.ones(sample_position.shape[0], dtype=bool)
+        is_kept[missing_index] = False
+        if tumor_barcodes is not None:
+            is_kept &= np.isin(barcode_value.astype(str), np.asarray(tumor_barcodes).astype(str))
+        sample_position = sample_position[is_kept]
+        barcode_value = list(barcode_value[is_kept])
+
+    #Read blocks of contiguous genes, restricted to the range of selected samples
+    formatted_data = np.zeros((sample_position.shape[0], gene_position.shape[0]),
+                              dtype=np.dtype(dtype or counts.dtype))
+    if formatted_data.size == 0:
+        tumors_data.close()
         return formatted_data, genes_names, barcode_value
-    
-    return formatted_data, genes_names, []
\ No newline at end of file
+
+    file_order = np.argsort(gene_position)
+    sample_slice = slice(sample_position[0], sample_position[-1] + 1)
+    relative_sample_position = sample_position - sample_position[0]
+
+    def read_gene_block(block):
+        block_genes = gene_position[block]
+        gene_slice = slice(block_genes[0], block_genes[-1] + 1)
+        block_data = counts.isel({sample_dim: sample_slice, 'ensemble_gene': gene_slice}).values
+        formatted_data[:,block] = block_data[relative_sample_position][:,block_genes - block_genes[0]]
+
+    blocks = [file_order[i:i+gene_chunk_size] for i in range(0, file_order.shape[0], gene_chunk_size)]
+    Parallel(n_jobs=n_jobs, prefer='threads')(delayed(read_gene_block)(block) for block in blocks)
+    tumors_data.close()
+
+    return formatted_data, genes_names, barcode_value
+
+
+def aliquots_to_barcodes(aliquot_values, biospec_data):
+    """
+    Map aliquots to TCGA barcodes in one vectorized pass using a hash index on the
+    biospecimen table. When an aliquot appears several times in the table, the first
+    occurrence is used.
+
+    INPUT:
+        - aliquot_values (np.ndarray): aliquots to map.
+        - biospec_data (pd.DataFrame): biospecimen table indexed by aliquot, with the
+        barcode in its first column.
+    OUTPUT:
+        - barcodes (np.ndarray): barcode of each aliquot, None for aliquots not found.
+        - missing_index (np.ndarray): positions of the aliquots not found.
+    """
+    biospec_index = pd.Index(biospec_data.index.values.astype(str))
+    first_occurrence = ~biospec_index.duplicated(keep='first')
+    biospec_index = biospec_index[first_occurrence]
+    biospec_barcodes = biospec_data.iloc[:,0].values[first_occurrence]
+
+    position = biospec_index.get_indexer(np.asarray(aliquot_values).astype(str))
+    missing_index = np.where(position == -1)[0]
+
+    barcodes = biospec_barcodes[position].astype(object)
+    barcodes[missing_index] = None
+
+    return barcodes, missing_index
+
+
+if __name__ == '__main__':
+    from time import time
+
+    # Benchmark of the barcode lookup on synthetic biospecimen tables
+    for n_aliquots in [10000, 30000, 100000]:
+        aliquots = np.array(['aliquot-%s'%(i) for i in range(n_aliquots)])
+        biospec_data = pd.DataFrame({'barcode': ['TCGA-%s'%(i) for i in range(n_aliquots)]},
+                                    index=np.random.permutation(aliquots))
+        aliquot_values = np.random.permutation(aliquots)
+
+        start_time = time()
+        barcodes, _ = aliquots_to_barcodes(aliquot_values, biospec_data)
+        indexed_time = time() - start_time
+
+        # Previous implementation, timed on a subset and extrapolated
+        n_scanned = 500
+        start_time = time()
+        scanned_barcodes = [biospec_data[biospec_data.index == al].values[0][0] for al in aliquot_values[:n_scanned]]
+        scan_time = (time() - start_time) * n_aliquots / n_scanned
+        assert np.all(barcodes[:n_scanned] == scanned_barcodes)
+
+        print('%s aliquots: indexed lookup %.3f s, scan lookup %.1f s (extrapolated)'%(n_aliquots,
+                                                                                    indexed_time,
+                                                                                    scan_time))
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+TRANSLOCATION_STORE
+
+Parses the translocation data from http://www.tumorfusions.org once and answers
+queries for many gene pairs and tumor barcodes with hash-index lookups.
+"""
+
+import os
+import itertools
+import numpy as np
+import pandas as pd
+
+default_location = '../../data/2018_07_20_biomarkers/translocations/pancanfus.txt'
+
+_loaded_stores = {}
+
+
+class TranslocationStore():
+    """
+    Translocated tumor barcodes indexed by (Gene_A, Gene_B).
+    """
+
+    def __init__(self, data_location=default_location):
+        """
+        INPUT:
+            - data_location (str, optional): where data is located, with 'Gene_A', 'Gene_B'
+            and 'sampleId' columns.
+        """
+        df = pd.read_csv(data_location, sep='\t', usecols=['Gene_A', 'Gene_B', 'sampleId'])
+        df['sampleId'] = [e.replace('.', '-') for e in df['sampleId'].values.astype(str)]
+
+        # Barcodes of each ordered gene pair
+        pair_barcodes = df.groupby(['Gene_A', 'Gene_B'])['sampleId'].unique()
+        self._barcodes = dict(zip(pair_barcodes.index, pair_barcodes.values))
+
+    @classmethod
+    def load(cls, data_location=default_location):
+        """
+        Return the store of the given file, parsing it only once per process.
+        The store is re-parsed if the file has been modified.
+        """
+        key = (os.path.abspath(data_location), os.path.getmtime(data_location))
+        if key not in _loaded_stores:
+            _loaded_stores[key] = cls(data_location)
+        return _loaded_stores[key]
+
+    def translocated_barcodes(self, gene_A, gene_B):
+        """
+        Barcodes of the tumors with a translocation involving both genes, in any order.
+        """
+        barcodes = [self._barcodes.get(pair, []) for pair in itertools.product([gene_A, gene_B], repeat=2)]
+        return np.unique(np.concatenate(barcodes)).astype(str)
+
+    def query(self, gene_pairs, tumor_barcodes):
+        """
+        Translocation indicator of the given gene pairs for the given tumors.
+
+        INPUT:
+            - gene_pairs (list): list of (gene_A, gene_B) tuples.
+            - tumor_barcodes (list): list of tumor barcodes.
+        OUTPUT:
+            - is_translocated (np.ndarray): boolean matrix in the form (n_tumors, n_pairs).
+        """
+        is_translocated = np.zeros((len(tumor_barcodes), len(gene_pairs)), dtype=bool)
+
+        for i, (gene_A, gene_B) in enumerate(gene_pairs):
+            translocated_barcodes = self.translocated_barcodes(gene_A, gene_B)
+            if translocated_barcodes.shape[0] == 0:
+                continue
+
+            # Common barcode length
+            barcode_length = np.unique([len(e) for e in translocated_barcodes])
+            if barcode_length.shape[0] > 1:
+                raise ValueError('File does not the same barcoding length')
+            barcode_length = barcode_length[0]
+
+            # Map translocated tumors
+            truncated_tumor_names = pd.Index([e[5:5+barcode_length] for e in tumor_barcodes])
+            is_translocated[:,i] = truncated_tumor_names.isin(translocated_barcodes)
+
+        return is_translocated
+
+
+if __name__ == '__main__':
+    import tempfile
+    from time import time
+
+    # Benchmark on a synthetic fusion table: parsing the file for each gene pair (as the
+    # per-call reader did) against one parse followed by a single query.
+    genes = ['GENE%s'%(i) for i in range(100)]
+    n_fusions = 100000
+    fusion_file = os.path.join(tempfile.mkdtemp(), 'pancanfus.txt')
+    pd.DataFrame({'Gene_A': np.random.choice(genes, n_fusions),
+                  'Gene_B': np.random.choice(genes, n_fusions),
+                  'sampleId': ['%02d.%04d.01'%(i%50, np.random.randint(10000)) for i in range(n_fusions)]
+                 }).to_csv(fusion_file, sep='\t', index=False)
+    tumor_barcodes = ['TCGA-%02d-%04d-01A'%(i%50, i) for i in range(10000)]
+    gene_pairs = [(genes[i], genes[i+1]) for i in range(20)]
+
+    start_time = time()
+    per_pair = np.array([TranslocationStore(fusion_file).query([pair], tumor_barcodes)[:,0]
+                         for pair in gene_pairs]).transpose()
+    per_pair_time = time() - start_time
+
+    start_time = time()
+    batched = TranslocationStore.load(fusion_file).query(gene_pairs, tumor_barcodes)
+    batched_time = time() - start_time
+    assert np.all(per_pair == batched)
+
+    print('%s gene pairs: per pair parsing %.2f s, one store %.2f s'%(len(gene_pairs), per_pair_time, batched_time))
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+"""
+
+from gsea.gsea_io import read_gsea_expression, read_cls, read_gmt, read_chip, collapse_max_probe, write_gsea_reports
+from gsea.enrichment import gene_set_membership, enrichment_scores, phenotype_permutation_es, gsea_statistics
+from gsea.pv_export import export_pv_scores, export_expression, read_pv_scores, read_expression, gsea_text_files
+from gsea.gsea_results import GSEAResults, index_gsea_results, read_gsea_report
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+ENRICHMENT
+
+Phenotype-permutation GSEA (Subramanian et al 2005) with a continuous phenotype and a
+Pearson metric, as run by the Java implementation with -permute phenotype -metric Pearson
+-scoring_scheme weighted -norm meandiv.
+
+Metrics of all permutations are computed with one matrix product, and enrichment scores
+of all gene sets and permutations at once: running sums are only evaluated at the hits of
+each gene set, which are gathered in one array sorted by (gene set, rank).
+"""
+
+import numpy as np
+import pandas as pd
+
+# Number of permutations processed at once
+permutation_block_size = 100
+
+
+def gene_set_membership(gene_sets, gene_names, set_min=15, set_max=500):
+    """
+    Restrict gene sets to the genes of the dataset and filter them on their size.
+
+    INPUT:
+        - gene_sets (list): (name, description, genes) of each gene set, see read_gmt.
+        - gene_names (np.ndarray): genes of the dataset.
+        - set_min, set_max (int, optional, default to 15 and 500): size limits of the gene
+        sets after restriction, included.
+    OUTPUT:
+        - membership (dict): 'names', 'descriptions', 'sizes', 'hit_sets' (gene set of each
+        hit, sorted) and 'hit_genes' (gene index of each hit).
+    """
+    gene_index = pd.Series(np.arange(len(gene_names)), index=gene_names)
+    gene_index = gene_index[~gene_index.index.duplicated()]
+
+    names, descriptions, hit_genes = [], [], []
+    for name, description, genes in gene_sets:
+        genes = np.unique(gene_index.reindex(np.unique(genes)).dropna().values.astype(int))
+        if set_min <= genes.shape[0] <= set_max:
+            names.append(name)
+            descriptions.append(description)
+            hit_genes.append(genes)
+
+    sizes = np.array([g.shape[0] for g in hit_genes], dtype=int)
+    return {
+        'names': np.array(names, dtype=str),
+        'descriptions': np.array(descriptions, dtype=str),
+        'sizes': sizes,
+        'hit_sets': np.repeat(np.arange(sizes.shape[0]), sizes),
+        'hit_genes': np.concatenate(hit_genes) if hit_genes else np.zeros(0, dtype=int)
+    }
+
+
+def standardize_rows(data):
+    """
+    Center and scale each row to unit norm, such that Pearson correlations are dot products.
+    """
+    data = np.array(data, dtype=float)
+    data -= np.mean(data, 1)[:,np.newaxis]
+    norms = np.linalg.norm(data, axis=1)
+    norms[norms == 0] = np.inf
+    data /= norms[:,np.newaxis]
+    return data
+
+
+def enrichment_scores(metrics, membership, sort='real', return_positions=False):
+    """
+    Weighted (p=1) enrichment score of all gene sets for several ranked lists.
+
+    INPUT:
+        - metrics (np.ndarray): metric of each gene for each list, (n_genes, n_lists).
+        - membership (dict): see gene_set_membership.
+        - sort (str, optional, default to real): genes ranked by decreasing metric (real)
+        or by decreasing absolute metric (abs).
+        - return_positions (bool, optional, default to False): whether the rank at max and
+        the sorted ranks of the hits (n_hits, n_lists) are returned.
+    OUTPUT:
+        - es (np.ndarray): enrichment scores (n_gene_sets, n_lists), with rank at max and
+        hit ranks if return_positions.
+    """
+    n_genes, n_lists = metrics.shape
+    hit_sets, sizes = membership['hit_sets'], membership['sizes']
+    set_start = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(int)
+
+    #Rank of each gene in each list
+    abs_metrics = np.abs(metrics)
+    order = np.argsort(-(abs_metrics if sort == 'abs' else metrics), axis=0, kind='mergesort')
+    ranks = np.empty(order.shape, dtype=np.int64)
+    np.put_along_axis(ranks, order, np.arange(n_genes)[:,np.newaxis], axis=0)
+
+    #Hits sorted by (gene set, rank), hit_sets being sorted
+    set_offset = (hit_sets * n_genes)[:,np.newaxis]
+    hit_ranks = np.sort(ranks[membership['hit_genes']] + set_offset, axis=0) - set_offset
+    hit_weights = np.take_along_axis(np.take_along_axis(abs_metrics, order, 0), hit_ranks, 0)
+
+    #Running sums at each hit (maximum) and just before each hit (minimum)
+    cumulative_weights = np.cumsum(hit_weights, 0)
+    cumulative_weights -= np.repeat(cumulative_weights[set_start] - hit_weights[set_start], sizes, axis=0)
+    total_weights = np.repeat(cumulative_weights[set_start + sizes - 1], sizes, axis=0)
+    misses = hit_ranks - (np.arange(hit_ranks.shape[0]) - np.repeat(set_start, sizes))[:,np.newaxis]
+    miss_step = 1. / (n_genes - sizes[hit_sets])[:,np.newaxis]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        running_at_hit = cumulative_weights / total_weights - misses * miss_step
+        running_before_hit = (cumulative_weights - hit_weights) / total_weights - misses * miss_step
+    max_deviation = np.maximum.reduceat(running_at_hit, set_start, axis=0)
+    min_deviation = np.minimum(np.minimum.reduceat(running_before_hit, set_start, axis=0), 0)
+    es = np.where(max_deviation > -min_deviation, max_deviation, min_deviation)
+
+    if not return_positions:
+        return es
+
+    #Rank at max: hit reaching the maximum, or rank before the hit reaching the minimum
+    rank_at_max = np.zeros(es.shape, dtype=int)
+    for s, (start, size) in enumerate(zip(set_start, sizes)):
+        for j in range(n_lists):
+            if es[s,j] >= 0:
+                rank_at_max[s,j] = hit_ranks[start + np.argmax(running_at_hit[start:start+size,j]),j]
+            else:
+                rank_at_max[s,j] = hit_ranks[start + np.argmin(running_before_hit[start:start+size,j]),j] - 1
+    return es, rank_at_max, hit_ranks
+
+
+def leading_edge(es, rank_at_max, hit_ranks, membership, n_genes):
+    """
+    GSEA leading edge description of each gene set: tags, list and signal percentages,
+    from the observed enrichment scores, rank at max and hit ranks (see enrichment_scores).
+    """
+    descriptions = []
+    set_start = np.concatenate([[0], np.cumsum(membership['sizes'])[:-1]]).astype(int)
+    for s, (start, size) in enumerate(zip(set_start, membership['sizes'])):
+        set_ranks = hit_ranks[start:start+size]
+        if es[s] >= 0:
+            tags = np.sum(set_ranks <= rank_at_max[s]) / size
+            list_fraction = (rank_at_max[s] + 1) / n_genes
+        else:
+            tags = np.sum(set_ranks > rank_at_max[s]) / size
+            list_fraction = (n_genes - rank_at_max[s] - 1) / n_genes
+        signal = tags * (1 - list_fraction) * n_genes / (n_genes - size)
+        descriptions.append('tags=%.0f%%, list=%.0f%%, signal=%.0f%%'%(100*tags, 100*list_fraction, 100*signal))
+    return descriptions
+
+
+def phenotype_permutation_es(standardized_expression, phenotype, membership, n_perm=1000,
+                             sort='real', random_state=None):
+    """
+    Observed and permuted enrichment scores of one continuous phenotype.
+
+    INPUT:
+        - standardized_expression (np.ndarray): expression (n_genes, n_samples), see
+        standardize_rows.
+        - phenotype (np.ndarray): phenotype of each sample.
+        - membership (dict): see gene_set_membership.
+        - n_perm (int, optional, default to 1000): number of phenotype permutations.
+        - sort (str, optional, default to real): see enrichment_scores.
+        - random_state (int, optional, default to None): seed of the permutations.
+    OUTPUT:
+        - es, rank_at_max, hit_ranks (np.ndarray): observed enrichment scores, rank at max
+        and ranks of the hits, see enrichment_scores.
+        - null_es (np.ndarray): enrichment scores of the permutations (n_gene_sets, n_perm).
+    """
+    rng = np.random.RandomState(random_state)
+    standardized_phenotype = standardize_rows(phenotype[np.newaxis,:])[0]
+
+    metrics = standardized_expression.dot(standardized_phenotype)
+    es, rank_at_max, hit_ranks = enrichment_scores(metrics[:,np.newaxis], membership, sort, True)
+
+    #All permutations are drawn first, so that results do not depend on the block size
+    permutations = np.array([rng.permutation(phenotype.shape[0]) for _ in range(n_perm)], dtype=int)
+    null_es = np.zeros((membership['sizes'].shape[0], n_perm))
+    for start in range(0, n_perm, permutation_block_size):
+        permuted_phenotypes = standardized_phenotype[permutations[start:start+permutation_block_size]].transpose()
+        null_es[:,start:start+permutation_block_size] = enrichment_scores(standardized_expression.dot(permuted_phenotypes),
+                                                                          membership, sort)
+
+    return es[:,0], rank_at_max[:,0], hit_ranks[:,0], null_es
+
+
+def gsea_statistics(es, null_es):
+    """
+    Normalized enrichment scores (meandiv), nominal p-values, FDR q-values and FWER
+    p-values, as computed by GSEA.
+
+    INPUT:
+        - es (np.ndarray): observed enrichment score of each gene set.
+        - null_es (np.ndarray): permuted enrichment scores (n_gene_sets, n_perm).
+    OUTPUT:
+        - statistics (pd.DataFrame): ES, NES, NOM p-val, FDR q-val and FWER p-val of
+        each gene set.
+    """
+    positive_null = null_es >= 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        #Normalization by the mean of the permuted scores of the same sign
+        positive_mean = np.sum(np.where(positive_null, null_es, 0), 1) / np.sum(positive_null, 1)
+        negative_mean = -np.sum(np.where(positive_null, 0, null_es), 1) / np.sum(~positive_null, 1)
+        nes = np.where(es >= 0, es / positive_mean, es / negative_mean)
+        null_nes = np.where(positive_null, null_es / positive_mean[:,np.newaxis], null_es / negative_mean[:,np.newaxis])
+
+        #Nominal p-values among the permutations of the same sign
+        nominal_p = np.where(es >= 0,
+                             np.sum(positive_null & (null_es >= es[:,np.newaxis]), 1) / np.sum(positive_null, 1),
+                             np.sum(~positive_null & (null_es <= es[:,np.newaxis]), 1) / np.sum(~positive_null, 1))
+
+        fdr = np.full(es.shape[0], np.nan)
+        fwer = np.full(es.shape[0], np.nan)
+        for sign, side, null_side in [(1., es >= 0, positive_null), (-1., es < 0, ~positive_null)]:
+            #Scores of one sign, as positive values
+            values = sign * nes[side]
+            observed_values = np.sort(values)
+            null_values = np.sort(sign * null_nes[null_side])
+
+            #FDR: fraction of permuted scores above each score over the same fraction of observed scores
+            null_fraction = (null_values.shape[0] - np.searchsorted(null_values, values, 'left')) / null_values.shape[0]
+            observed_fraction = (observed_values.shape[0] - np.searchsorted(observed_values, values, 'left')) / observed_values.shape[0]
+            fdr[side] = np.minimum(null_fraction / observed_fraction, 1)
+
+            #FWER: fraction of permutations whose most extreme score is above each score
+            permutation_max = np.sort(np.max(np.where(null_side, sign * null_nes, -np.inf), 0))
+            fwer[side] = (permutation_max.shape[0] - np.searchsorted(permutation_max, values, 'left')) / permutation_max.shape[0]
+
+    return pd.DataFrame({
+        'ES': es,
+        'NES': nes,
+        'NOM p-val': nominal_p,
+        'FDR q-val': fdr,
+        'FWER p-val': fwer
+    })
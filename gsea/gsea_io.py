@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+GSEA_IO
+
+Read the inputs of GSEA (expression .txt, continuous phenotype .cls, or their npz
+versions, gene sets .gmt and probe annotation .chip) from local files, and write results in the format of the GSEA
+reports (gsea_report_for_<phenotype>_<pos|neg>_<timestamp>.xls).
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from gsea.pv_export import read_pv_scores, read_expression
+
+report_columns = [
+    'NAME',
+    'GS<br> follow link to MSigDB',
+    'GS DETAILS',
+    'SIZE',
+    'ES',
+    'NES',
+    'NOM p-val',
+    'FDR q-val',
+    'FWER p-val',
+    'RANK AT MAX',
+    'LEADING EDGE'
+]
+
+
+def read_gsea_expression(expression_file):
+    """
+    Read an expression file in GSEA .txt format, i.e. NAME and DESCRIPTION columns
+    followed by one column per sample, or an npz file written by export_expression.
+
+    INPUT:
+        - expression_file (str): path to the file.
+    OUTPUT:
+        - expression (np.ndarray): expression in the form (n_genes, n_samples).
+        - gene_names (np.ndarray): content of the NAME column.
+        - sample_names (np.ndarray): sample names.
+    """
+    if expression_file.endswith('.npz'):
+        expression, gene_names, sample_names = read_expression(expression_file)
+        return np.array(expression, dtype=float).transpose(), gene_names, sample_names
+
+    expression_df = pd.read_csv(expression_file, sep='\t', index_col=0)
+    expression_df = expression_df.drop(columns=['DESCRIPTION'], errors='ignore')
+
+    return expression_df.values.astype(float),\
+            np.array(expression_df.index, dtype=str),\
+            np.array(expression_df.columns, dtype=str)
+
+
+def read_cls(cls_file):
+    """
+    Read a continuous phenotype file (#numeric .cls), with one line of values per phenotype,
+    or an npz file written by export_pv_scores.
+
+    OUTPUT:
+        - phenotype_names (list): name of each phenotype, e.g. Factor_0.
+        - phenotypes (np.ndarray): values in the form (n_phenotypes, n_samples).
+    """
+    if cls_file.endswith('.npz'):
+        scores = read_pv_scores(cls_file)
+        return list(scores['phenotype_names']), np.array(scores['scores'], dtype=float)
+
+    with open(cls_file, 'r') as f:
+        lines = [l.strip() for l in f.read().split('\n') if l.strip() != '']
+
+    if lines[0] != '#numeric':
+        raise ValueError('%s is not a continuous phenotype file'%(cls_file))
+
+    phenotype_names = [l[1:] for l in lines[1::2]]
+    phenotypes = np.array([l.split() for l in lines[2::2]], dtype=float)
+
+    return phenotype_names, phenotypes
+
+
+def read_gmt(gmt_file):
+    """
+    Read gene sets in .gmt format.
+
+    OUTPUT:
+        - gene_sets (list): (name, description, genes) of each gene set.
+    """
+    gene_sets = []
+    with open(gmt_file, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n\r').split('\t')
+            if len(line) < 2:
+                continue
+            gene_sets.append((line[0], line[1], [g for g in line[2:] if g != '']))
+
+    return gene_sets
+
+
+def read_chip(chip_file):
+    """
+    Read a probe annotation file in .chip format.
+
+    OUTPUT:
+        - chip (pd.Series): gene symbol of each probe, indexed by probe ID.
+    """
+    chip_df = pd.read_csv(chip_file, sep='\t', dtype=str, usecols=['Probe Set ID', 'Gene Symbol'])
+    chip_df = chip_df.dropna()
+    chip_df = chip_df[~chip_df['Gene Symbol'].isin(['', '---'])]
+
+    return chip_df.drop_duplicates('Probe Set ID').set_index('Probe Set ID')['Gene Symbol']
+
+
+def collapse_max_probe(expression, probe_names, chip):
+    """
+    Collapse probes on gene symbols as GSEA Max_probe mode: for each sample, maximum
+    value of the probes of a gene. Probes without symbol are removed.
+
+    INPUT:
+        - expression (np.ndarray): expression in the form (n_probes, n_samples).
+        - probe_names (np.ndarray): probe ID of each row.
+        - chip (pd.Series): gene symbol of each probe ID, see read_chip.
+    OUTPUT:
+        - collapsed_expression (np.ndarray): expression in the form (n_symbols, n_samples).
+        - symbols (np.ndarray): sorted gene symbols.
+    """
+    probe_symbols = chip.reindex(probe_names).values
+    mapped_probes = np.where(pd.notnull(probe_symbols))[0]
+    probe_symbols = np.array(probe_symbols[mapped_probes], dtype=str)
+
+    #Sort probes by symbol and take the maximum of each run
+    order = np.argsort(probe_symbols, kind='mergesort')
+    probe_symbols = probe_symbols[order]
+    run_start = np.where(np.concatenate([[True], probe_symbols[1:] != probe_symbols[:-1]]))[0]\
+                if probe_symbols.shape[0] else np.zeros(0, dtype=int)
+
+    if run_start.shape[0] == 0:
+        return np.zeros((0, expression.shape[1])), probe_symbols
+    collapsed_expression = np.maximum.reduceat(expression[mapped_probes[order]], run_start, axis=0)
+
+    return collapsed_expression, probe_symbols[run_start]
+
+
+def write_gsea_reports(results, phenotype_name, report_folder, timestamp):
+    """
+    Write the positive and negative reports of one phenotype in GSEA format, readable by
+    read_gsea_results in fig3.
+
+    INPUT:
+        - results (pd.DataFrame): one row per gene set with report_columns.
+        - phenotype_name (str): phenotype name, e.g. Factor_0.
+        - report_folder (str): folder of the reports, created if needed.
+        - timestamp (int): suffix of the file names, as GSEA.
+    OUTPUT:
+        - report_files (list): path of the positive and negative reports.
+    """
+    os.makedirs(report_folder, exist_ok=True)
+
+    positive_results = results[results['ES'] >= 0].sort_values('NES', ascending=False)
+    negative_results = results[results['ES'] < 0].sort_values('NES', ascending=True)
+
+    report_files = []
+    for side, side_results in [('pos', positive_results), ('neg', negative_results)]:
+        report_file = os.path.join(report_folder, 'gsea_report_for_%s_%s_%s.xls'%(phenotype_name, side, timestamp))
+        side_results[report_columns].to_csv(report_file, sep='\t', index=False, na_rep='')
+        report_files.append(report_file)
+
+    return report_files
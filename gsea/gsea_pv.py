@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+GSEA_PV
+
+GSEA of the principal vector scores written by fig3 (scores_pv_*.npz and
+expression_tumors_*.npz, or their .cls and .txt versions), replacing the loop of Java
+runs of gsea_pv_source.sh and gsea_pv_target.sh. Phenotypes (i.e. principal vectors) run
+in a pool of processes and reports are written as the Java implementation does, such
+that read_gsea_results in fig3 can read them.
+
+Example, for the source principal vectors of cell lines on c2.cp:
+    python -m gsea.gsea_pv rnaseq c2.cp cell_line 20 --side source --n_jobs 8 --seed 0
+"""
+
+import os
+import argparse
+import numpy as np
+from time import time
+from joblib import Parallel, delayed
+from gsea.gsea_io import read_gsea_expression, read_cls, read_gmt, read_chip, collapse_max_probe, write_gsea_reports
+from gsea.enrichment import gene_set_membership, standardize_rows, phenotype_permutation_es, gsea_statistics, leading_edge
+
+gene_sets_folder = './gene_sets/'
+chip_file = './gene_sets/ENSEMBL_human_gene.chip'
+
+
+def gsea_phenotypes(expression_file,
+                    cls_file,
+                    gmt_file,
+                    output_folder,
+                    rpt_label,
+                    chip_file=None,
+                    phenotypes=None,
+                    n_perm=1000,
+                    set_min=15,
+                    set_max=500,
+                    sort='abs',
+                    n_jobs=1,
+                    random_state=None):
+    """
+    Phenotype-permutation GSEA of several continuous phenotypes on the same expression data.
+
+    INPUT:
+        - expression_file (str): expression in GSEA .txt format or npz (see export_expression).
+        - cls_file (str): continuous phenotypes in .cls format or npz (see export_pv_scores).
+        - gmt_file (str): gene sets in .gmt format.
+        - output_folder (str): folder where one report folder per phenotype is created, named
+        <rpt_label>_<phenotype>.Gsea.<timestamp> as GSEA.
+        - rpt_label (str): label of the reports, e.g. cell_line or tumors.
+        - chip_file (str, optional, default to None): probe annotation used to collapse the
+        expression on gene symbols (Max_probe). No collapse if None.
+        - phenotypes (list, optional, default to None): names of the phenotypes to test,
+        all if None.
+        - n_perm (int, optional, default to 1000): number of phenotype permutations.
+        - set_min, set_max (int, optional, default to 15 and 500): gene set size limits.
+        - sort (str, optional, default to abs): ranking of genes, real or abs (as in
+        gsea_pv_source.sh).
+        - n_jobs (int, optional, default to 1): number of worker processes.
+        - random_state (int, optional, default to None): seed of the permutations. Results
+        do not depend on n_jobs.
+    OUTPUT:
+        - results (dict): report (pd.DataFrame) of each phenotype.
+    """
+    expression, gene_names, _ = read_gsea_expression(expression_file)
+    if chip_file is not None:
+        expression, gene_names = collapse_max_probe(expression, gene_names, read_chip(chip_file))
+    standardized_expression = standardize_rows(expression)
+    del expression
+
+    membership = gene_set_membership(read_gmt(gmt_file), gene_names, set_min, set_max)
+
+    phenotype_names, phenotype_values = read_cls(cls_file)
+    selected_phenotypes = phenotype_names if phenotypes is None else list(phenotypes)
+    phenotype_index = [phenotype_names.index(p) for p in selected_phenotypes]
+
+    #One seed per phenotype drawn from random_state, independently of the workers
+    if random_state is None:
+        seeds = [None] * len(phenotype_index)
+    else:
+        seeds = np.random.RandomState(random_state).randint(np.iinfo(np.int32).max, size=len(phenotype_index))
+
+    permutation_results = Parallel(n_jobs=n_jobs, backend='loky')(delayed(phenotype_permutation_es)(standardized_expression,
+                                                                                                      phenotype_values[i],
+                                                                                                      membership,
+                                                                                                      n_perm,
+                                                                                                      sort,
+                                                                                                      seed)
+                                                                    for i, seed in zip(phenotype_index, seeds))
+
+    timestamp = int(time() * 1000)
+    results = {}
+    for phenotype_name, (es, rank_at_max, hit_ranks, null_es) in zip(selected_phenotypes, permutation_results):
+        report = gsea_statistics(es, null_es)
+        report.insert(0, 'NAME', membership['names'])
+        report.insert(1, 'GS<br> follow link to MSigDB', membership['names'])
+        report.insert(2, 'GS DETAILS', 'Details ...')
+        report.insert(3, 'SIZE', membership['sizes'])
+        report['RANK AT MAX'] = rank_at_max
+        report['LEADING EDGE'] = leading_edge(es, rank_at_max, hit_ranks, membership, gene_names.shape[0])
+
+        report_folder = os.path.join(output_folder, '%s_%s.Gsea.%s'%(rpt_label, phenotype_name.lower(), timestamp))
+        write_gsea_reports(report, phenotype_name, report_folder, timestamp)
+        results[phenotype_name] = report
+
+    return results
+
+
+if __name__ == '__main__':
+    # Same arguments as gsea_pv_source.sh and gsea_pv_target.sh
+    parser = argparse.ArgumentParser(description='GSEA of principal vector scores')
+    parser.add_argument('data_type', help='rnaseq or fpkm')
+    parser.add_argument('pathway', help='gene set collection, e.g. c2.cp')
+    parser.add_argument('source_type', help='cell_line or pdx')
+    parser.add_argument('n_pv', type=int, help='number of principal vectors')
+    parser.add_argument('n_perm', type=int, nargs='?', default=1000, help='number of permutations')
+    parser.add_argument('--side', default='source', choices=['source', 'target'])
+    parser.add_argument('--gene_sets_folder', default=gene_sets_folder, help='folder of the local .gmt files')
+    parser.add_argument('--chip', default=chip_file, help='local ENSEMBL .chip file')
+    parser.add_argument('--n_jobs', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    source_name = 'cl' if args.source_type == 'cell_line' else 'pdx'
+    expression_file = 'expression_tumors_%s.npz'%(args.data_type)
+    scores_file = 'scores_pv_%s_%s_%s.npz'%(args.data_type, args.side, args.n_pv)
+    if not os.path.isfile(scores_file):
+        #Text files written by previous versions of fig3
+        expression_file = '%s.txt'%(os.path.splitext(expression_file)[0])
+        scores_file = '%s.cls'%(os.path.splitext(scores_file)[0])
+
+    start_time = time()
+    gsea_phenotypes(expression_file,
+                    scores_file,
+                    os.path.join(args.gene_sets_folder, '%s.v6.2.symbols.gmt'%(args.pathway)),
+                    './output/%s_breast_all_%s_tumor_%s_%s'%(args.pathway, args.data_type, source_name, args.n_pv),
+                    args.source_type if args.side == 'source' else 'tumors',
+                    chip_file=args.chip,
+                    phenotypes=['Factor_%s'%(i) for i in range(args.n_pv)],
+                    n_perm=args.n_perm,
+                    n_jobs=args.n_jobs,
+                    random_state=args.seed)
+    print('GSEA of %s principal vectors computed in %.1f s'%(args.n_pv, time() - start_time))
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+GSEA_RESULTS
+
+Index of a tree of GSEA outputs (Java or gsea_pv), walked once:
+    <output_folder>/<folder>/<label>_factor_<i>.Gsea.<timestamp>/
+        gsea_report_for_Factor_<i>_<pos|neg>_<timestamp>.xls
+where folder starts with the gene set collection (e.g. c2.cp_breast_all_rnaseq_tumor_cl_20)
+and label is the side (e.g. cell_line, pdx or tumors). All reports are loaded in parallel
+in one tidy table, cached in Parquet (pickle if no Parquet engine is installed) and keyed
+on the fingerprint of the reports, so that figures never re-parse unchanged reports.
+"""
+
+import os
+import re
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+default_cache_folder = '../data/cache/gsea_results/'
+
+run_pattern = re.compile(r'^(.+)_factor_(\d+)\.Gsea\.(\d+)$')
+report_pattern = re.compile(r'^gsea_report_for_Factor_(\d+)_(pos|neg)_(\d+)\.xls$')
+
+index_columns = ['folder', 'collection', 'label', 'factor', 'direction', 'timestamp', 'file']
+value_columns = ['SIZE', 'ES', 'NES', 'NOM p-val', 'FDR q-val', 'FWER p-val']
+
+_loaded_results = {}
+
+
+def index_gsea_results(output_folder):
+    """
+    Walk a tree of GSEA outputs once and index the reports. When a report has been
+    computed several times, the latest one is kept.
+
+    INPUT:
+        - output_folder (str): root of the tree.
+    OUTPUT:
+        - index (pd.DataFrame): one row per report with index_columns, file being the path
+        to the report.
+    """
+    rows = []
+    for root, dirs, files in os.walk(output_folder):
+        run = run_pattern.match(os.path.basename(root))
+        if run is None:
+            continue
+        #Reports are at the top of each run folder
+        dirs[:] = []
+
+        folder = os.path.relpath(os.path.dirname(root), output_folder)
+        folder_name = os.path.basename(os.path.abspath(os.path.dirname(root)))
+        for file_name in files:
+            report = report_pattern.match(file_name)
+            if report is None or report.group(1) != run.group(2):
+                continue
+            rows.append([folder,
+                         folder_name.split('_')[0],
+                         run.group(1),
+                         int(run.group(2)),
+                         report.group(2),
+                         int(report.group(3)),
+                         os.path.join(root, file_name)])
+
+    index = pd.DataFrame(rows, columns=index_columns)
+    index = index.sort_values('timestamp').drop_duplicates(['folder', 'label', 'factor', 'direction'], keep='last')
+    return index.sort_values(['folder', 'label', 'factor', 'direction']).reset_index(drop=True)
+
+
+def read_gsea_report(report_file):
+    """
+    Read the NAME and statistics columns of one GSEA report, non-numeric values (e.g. ---)
+    being set to nan.
+    """
+    report_df = pd.read_csv(report_file, sep='\t', usecols=lambda c: c in ['NAME'] + value_columns)
+    for column in value_columns:
+        if column in report_df.columns:
+            report_df[column] = pd.to_numeric(report_df[column], errors='coerce')
+    return report_df.reindex(columns=['NAME'] + value_columns)
+
+
+class GSEAResults():
+    """
+    All reports of a tree of GSEA outputs.
+
+    ATTRIBUTES:
+        - index (pd.DataFrame): one row per report, see index_gsea_results.
+        - results (pd.DataFrame): one row per (report, gene set), with the index columns
+        (except file) and NAME, SIZE, ES, NES, NOM p-val, FDR q-val, FWER p-val.
+    """
+
+    def __init__(self, output_folder, cache_folder=None, n_jobs=1, index=None):
+        """
+        INPUT:
+            - output_folder (str): root of the tree.
+            - cache_folder (str, optional, default to None): folder of the cached table,
+            e.g. default_cache_folder. No cache if None.
+            - n_jobs (int, optional, default to 1): number of threads reading the reports.
+            - index (pd.DataFrame, optional, default to None): index of the tree, walked if None.
+        """
+        self.output_folder = output_folder
+        self.index = index_gsea_results(output_folder) if index is None else index
+
+        cache_file = None
+        if cache_folder is not None:
+            cache_file = os.path.join(cache_folder, 'gsea_results_%s'%(_results_key(self.index)))
+            self.results = _read_table(cache_file)
+            if self.results is not None:
+                return
+
+        reports = Parallel(n_jobs=n_jobs, prefer='threads')(delayed(read_gsea_report)(f) for f in self.index['file'])
+        report_index = np.repeat(np.arange(self.index.shape[0]), [r.shape[0] for r in reports])
+        self.results = pd.concat([self.index.drop(columns=['file']).iloc[report_index].reset_index(drop=True),
+                                  pd.concat(reports, ignore_index=True) if reports else
+                                  pd.DataFrame(columns=['NAME'] + value_columns)],
+                                 axis=1)
+
+        if cache_file is not None:
+            os.makedirs(cache_folder, exist_ok=True)
+            _write_table(self.results, cache_file)
+
+    @classmethod
+    def load(cls, output_folder, cache_folder=None, n_jobs=1):
+        """
+        Return the results of the given tree, loading them only once per process.
+        The tree is walked at each call and results are re-loaded if any report has been
+        added or modified, e.g. when GSEA is re-run into an existing folder.
+        """
+        index = index_gsea_results(output_folder)
+        key = (os.path.abspath(output_folder), _results_key(index),
+               None if cache_folder is None else os.path.abspath(cache_folder))
+        if key not in _loaded_results:
+            _loaded_results[key] = cls(output_folder, cache_folder, n_jobs, index)
+        return _loaded_results[key]
+
+    def query(self, folder=None, collection=None, label=None, factor=None, direction=None):
+        """
+        Results restricted to the given values of the index columns (all if None).
+        """
+        mask = np.ones(self.results.shape[0], dtype=bool)
+        for column, value in [('folder', folder), ('collection', collection), ('label', label),
+                              ('factor', factor), ('direction', direction)]:
+            if value is not None:
+                mask &= (self.results[column] == value).values
+        return self.results[mask]
+
+    def pv_results(self, folder, n_pv, source_name='cell_line', target_name='tumor'):
+        """
+        Results of one folder in the format of read_gsea_results in fig3: for each
+        principal vector, a DataFrame with NAME and FDR and NES of source and target.
+        """
+        folder_results = self.query(folder=folder)
+        gsea_results = dict()
+        for number_components in range(0, n_pv):
+            factor_results = folder_results[folder_results['factor'] == number_components]
+            source_df = factor_results[factor_results['label'] == source_name]
+            target_df = factor_results[factor_results['label'] == target_name]
+            if source_df.shape[0] == 0 or target_df.shape[0] == 0:
+                raise ValueError('No GSEA report for factor %s in %s'%(number_components, folder))
+
+            df = source_df.merge(target_df,
+                                 on='NAME',
+                                 how='left',
+                                 suffixes=['_source', '_target']
+                                )[['NAME', 'FDR q-val_source', 'FDR q-val_target', 'NES_source', 'NES_target']]
+            df.columns = [
+                'NAME',
+                'FDR_source_%s'%(number_components),
+                'FDR_target_%s'%(number_components),
+                'NES_source_%s'%(number_components),
+                'NES_target_%s'%(number_components)
+            ]
+            gsea_results[number_components] = df.reset_index(drop=True)
+
+        return gsea_results
+
+
+def _results_key(index):
+    #Fingerprint (path, size and modification time) of the indexed reports. Computed here
+    #rather than with data_reader.data_cache, such that gsea does not import data_reader (and R).
+    fingerprints = []
+    for report_file in sorted(set(index['file'])):
+        report_stat = os.stat(report_file)
+        fingerprints.append([os.path.abspath(report_file), report_stat.st_size, report_stat.st_mtime_ns])
+    key_content = json.dumps({'reader': 'gsea_results', 'files': fingerprints}, sort_keys=True)
+    return hashlib.sha1(key_content.encode('utf-8')).hexdigest()
+
+
+def _read_table(cache_file):
+    #Parquet if available, pickle otherwise
+    for extension, reader in [('parquet', pd.read_parquet), ('pkl', pd.read_pickle)]:
+        if os.path.isfile('%s.%s'%(cache_file, extension)):
+            return reader('%s.%s'%(cache_file, extension))
+    return None
+
+
+def _write_table(table, cache_file):
+    try:
+        extension = 'parquet'
+        tmp_file = '%s.%s.tmp'%(cache_file, os.getpid())
+        table.to_parquet(tmp_file, index=False)
+    except ImportError:
+        extension = 'pkl'
+        table.to_pickle(tmp_file)
+    os.replace(tmp_file, '%s.%s'%(cache_file, extension))
+
+
+if __name__ == '__main__':
+    import sys
+    from time import time
+
+    # Load a tree of GSEA outputs twice: reports parsed, then read from the cache
+    output_folder = sys.argv[1] if len(sys.argv) > 1 else './output/'
+    cache_folder = default_cache_folder
+
+    start_time = time()
+    gsea_output = GSEAResults(output_folder, cache_folder, n_jobs=8)
+    print('%s reports indexed and parsed in %.2f s'%(gsea_output.index.shape[0], time() - start_time))
+
+    start_time = time()
+    gsea_output = GSEAResults(output_folder, cache_folder)
+    print('%s rows loaded from cache in %.2f s'%(gsea_output.results.shape[0], time() - start_time))
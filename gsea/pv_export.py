@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+PV_EXPORT
+
+Export of principal vector loadings, projected scores and expression data in binary npz
+files (scores_pv_<data_type>_<side>_<n_pv>.npz and expression_tumors_<data_type>.npz),
+read directly by the Python GSEA engine. Text files used by the Java GSEA (.cls and .txt)
+are only written on demand by gsea_text_files, when missing or older than the npz files.
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+
+def export_pv_scores(scores_file, components, expression, gene_names, sample_names):
+    """
+    Save principal vector loadings and the scores of the samples projected on them.
+
+    INPUT:
+        - scores_file (str): npz file, e.g. scores_pv_rnaseq_source_20.npz.
+        - components (np.ndarray): principal vectors in the form (n_pv, n_genes).
+        - expression (np.ndarray): data in the form (n_samples, n_genes).
+        - gene_names, sample_names (np.ndarray): names of the genes and samples.
+    OUTPUT:
+        - scores (np.ndarray): scores in the form (n_pv, n_samples).
+    """
+    scores = components.dot(expression.transpose())
+    _savez(scores_file,
+           loadings=components,
+           scores=scores,
+           phenotype_names=np.array(['Factor_%s'%(i) for i in range(components.shape[0])], dtype=str),
+           gene_names=np.array(gene_names, dtype=str),
+           sample_names=np.array(sample_names, dtype=str))
+    return scores
+
+
+def export_expression(expression_file, expression, gene_names, sample_names):
+    """
+    Save expression data in the form (n_samples, n_genes), e.g. expression_tumors_rnaseq.npz.
+    """
+    _savez(expression_file,
+           expression=expression,
+           gene_names=np.array(gene_names, dtype=str),
+           sample_names=np.array(sample_names, dtype=str))
+
+
+def read_pv_scores(scores_file):
+    """
+    Read a file written by export_pv_scores, as a dictionary of arrays.
+    """
+    with np.load(scores_file, allow_pickle=False) as content:
+        return {k: content[k] for k in content.files}
+
+
+def read_expression(expression_file):
+    """
+    Read a file written by export_expression.
+
+    OUTPUT:
+        - expression (np.ndarray): data in the form (n_samples, n_genes).
+        - gene_names, sample_names (np.ndarray): names of the genes and samples.
+    """
+    with np.load(expression_file, allow_pickle=False) as content:
+        return content['expression'], content['gene_names'], content['sample_names']
+
+
+def write_cls(cls_file, phenotype_names, scores):
+    """
+    Write continuous phenotypes in .cls format, as fig3 did.
+    """
+    with open(cls_file, 'w') as file:
+        file.write('#numeric')
+        for name, coef in zip(phenotype_names, scores):
+            file.write('\n#%s\n'%(name))
+            file.write(' '.join(coef.astype(str)))
+
+
+def write_gsea_expression(txt_file, expression, gene_names, sample_names):
+    """
+    Write expression data (n_samples, n_genes) in GSEA .txt format, as fig3 did.
+    """
+    df = pd.DataFrame(expression, columns=gene_names)
+    df = df.transpose()
+    df.columns = sample_names
+    df['DESCRIPTION'] = 'na'
+    df['NAME'] = gene_names
+    df = df.set_index(['NAME', 'DESCRIPTION'])
+    df.to_csv(txt_file, sep='\t')
+
+
+def gsea_text_files(scores_file, expression_file):
+    """
+    Text files required by the Java GSEA, converted from the npz files only if they are
+    missing or older than them.
+
+    INPUT:
+        - scores_file (str): npz file written by export_pv_scores.
+        - expression_file (str): npz file written by export_expression.
+    OUTPUT:
+        - cls_file, txt_file (str): paths of the .cls and .txt files, next to the npz files.
+    """
+    cls_file = '%s.cls'%(os.path.splitext(scores_file)[0])
+    txt_file = '%s.txt'%(os.path.splitext(expression_file)[0])
+
+    if _is_outdated(cls_file, scores_file):
+        scores = read_pv_scores(scores_file)
+        tmp_file = '%s.%s.tmp'%(cls_file, os.getpid())
+        write_cls(tmp_file, scores['phenotype_names'], scores['scores'])
+        os.replace(tmp_file, cls_file)
+
+    if _is_outdated(txt_file, expression_file):
+        expression, gene_names, sample_names = read_expression(expression_file)
+        tmp_file = '%s.%s.tmp'%(txt_file, os.getpid())
+        write_gsea_expression(tmp_file, expression, gene_names, sample_names)
+        os.replace(tmp_file, txt_file)
+
+    return cls_file, txt_file
+
+
+def _is_outdated(text_file, npz_file):
+    return not os.path.isfile(text_file) or os.path.getmtime(text_file) < os.path.getmtime(npz_file)
+
+
+def _savez(file_name, **arrays):
+    #Atomic write, np.savez appending .npz to names without this extension
+    tmp_file = '%s.%s.tmp.npz'%(os.path.splitext(file_name)[0], os.getpid())
+    np.savez(tmp_file, **arrays)
+    os.replace(tmp_file, file_name)
+
+
+if __name__ == '__main__':
+    # Called by gsea_pv_source.sh and gsea_pv_target.sh before the Java runs
+    parser = argparse.ArgumentParser(description='Convert npz PV scores to GSEA text files')
+    parser.add_argument('data_type', help='rnaseq or fpkm')
+    parser.add_argument('side', choices=['source', 'target'])
+    parser.add_argument('n_pv', type=int)
+    args = parser.parse_args()
+
+    scores_file = 'scores_pv_%s_%s_%s.npz'%(args.data_type, args.side, args.n_pv)
+    expression_file = 'expression_tumors_%s.npz'%(args.data_type)
+    if os.path.isfile(scores_file) and os.path.isfile(expression_file):
+        gsea_text_files(scores_file, expression_file)
@@ -18,7 +18,10 @@ else
     n_perm=1000
 fi
 
-for i in $(seq 68 $n_pv)
+# Text files converted from the npz files written by fig3, if needed
+python -m gsea.pv_export $data_type source $n_pv
+
+for i in $(seq 0 $((n_pv-1)))
 do
 	echo $i
 	java -cp gsea-3.0.jar \
@@ -1,12 +1,15 @@
 #!/bin/sh
 
 n_pv=$1
+n_jobs=${2:-1}
 pathways="h.all c2.cp c2.cp.kegg c2.cp.reactome c2.cp.biocarta c2.cgp"
 
+# Python engine (gsea/gsea_pv.py), gene sets and chip read from ./gene_sets/.
+# The Java runs are still available with gsea_pv_source.sh and gsea_pv_target.sh.
 for p in $pathways
 do
-	cputool -c 100 -- screen -d -m sh gsea_pv_source.sh "rnaseq" $p "cell_line" $n_pv 1000
-	cputool -c 100 -- screen -d -m sh gsea_pv_target.sh "rnaseq" $p "cell_line" $n_pv 1000
-	cputool -c 100 -- screen -d -m sh gsea_pv_source.sh "fpkm" $p "pdx" $n_pv 1000
-	cputool -c 100 -- screen -d -m sh gsea_pv_target.sh "fpkm" $p "pdx" $n_pv 1000
+	python -m gsea.gsea_pv "rnaseq" $p "cell_line" $n_pv 1000 --side source --n_jobs $n_jobs
+	python -m gsea.gsea_pv "rnaseq" $p "cell_line" $n_pv 1000 --side target --n_jobs $n_jobs
+	python -m gsea.gsea_pv "fpkm" $p "pdx" $n_pv 1000 --side source --n_jobs $n_jobs
+	python -m gsea.gsea_pv "fpkm" $p "pdx" $n_pv 1000 --side target --n_jobs $n_jobs
 done 
\ No newline at end of file
@@ -3,23 +3,30 @@
 Created on Mon Mar  5 18:31:41 2018
 
 @author: soufiane
+
+DESeq normalization, either through DESeq (R engine) or through a NumPy port of
+estimateSizeFactorsForMatrix (numpy engine) which does not require an R interpreter.
 """
 
-import rpy2
-import rpy2.robjects as robjects
-from rpy2.robjects.packages import importr
-import rpy2.robjects.numpy2ri
+import numpy as np
 from normalization_methods.normalization_parameters import NormalizationParameter
 
+# Number of genes (or samples) processed at once by the NumPy engine
+block_size = 1024
+
 
 def DESeq_normalization(count_data, return_instance=False, coef=None):
-    
-    coef = coef or NormalizationParameter()
+
+    coef = NormalizationParameter() if coef is None else coef
 
     #Custom import
+    import rpy2
+    import rpy2.robjects as robjects
+    from rpy2.robjects.packages import importr
+    import rpy2.robjects.numpy2ri
     rpy2.robjects.numpy2ri.activate()
     importr('DESeq')
-    
+
     #Transform the input count data and feed it to R
     n_samples, n_genes = count_data.shape
     count_cell_lines_R = robjects.r.matrix(count_data.astype(int).transpose(), nrow=n_genes, ncol=n_samples)
@@ -43,3 +50,90 @@ def DESeq_normalization(count_data, return_instance=False, coef=None):
     if not return_instance:
         return X_DESeq.transpose()
     return X_DESeq.transpose(), coef
+
+
+def DESeq_normalization_numpy(count_data, return_instance=False, coef=None):
+    """
+    DESeq normalization computed with NumPy. Gives the same output as DESeq_normalization.
+
+    The fitted parameters are stored as a dictionary with the size factors and the
+    log geometric means of the genes. When coef is given with fitted parameters, size
+    factors of count_data are computed against the stored geometric means, which allows
+    to normalize new samples without refitting.
+    """
+
+    coef = NormalizationParameter() if coef is None else coef
+
+    count_data = count_data.astype(int)
+    size_factors = DESeq_sample_size_factors(count_data, coef)
+    X_DESeq = count_data / size_factors[:,np.newaxis]
+
+    if not return_instance:
+        return X_DESeq
+    return X_DESeq, coef
+
+
+def DESeq_sample_size_factors(count_data, coef):
+    """
+    Size factor of each sample of (integer) count data. Parameters are fitted and stored
+    in coef if not available.
+    """
+    if coef.parameters is None:
+        log_geometric_means = DESeq_log_geometric_means(count_data)
+        size_factors = DESeq_size_factors(count_data, log_geometric_means)
+        coef.parameters = {
+            'size_factors': size_factors,
+            'log_geometric_means': log_geometric_means
+        }
+    else:
+        size_factors = DESeq_size_factors(count_data, coef.parameters['log_geometric_means'])
+
+    return size_factors
+
+
+def DESeq_log_geometric_means(count_data):
+    """
+    Log of the geometric mean of each gene across samples, -inf for genes with a zero count.
+    """
+    #Blocks of genes to avoid a log copy of the whole matrix
+    log_geometric_means = np.zeros(count_data.shape[1])
+    with np.errstate(divide='ignore'):
+        for start in range(0, count_data.shape[1], block_size):
+            log_geometric_means[start:start+block_size] = np.mean(np.log(count_data[:,start:start+block_size]), 0)
+    return log_geometric_means
+
+
+def DESeq_size_factors(count_data, log_geometric_means):
+    """
+    Size factor of each sample: median ratio to the geometric means, computed on the genes
+    with a finite geometric mean.
+    """
+    finite_genes = np.where(np.isfinite(log_geometric_means))[0]
+    if finite_genes.shape[0] == 0:
+        return np.full(count_data.shape[0], np.nan)
+
+    #Blocks of samples to avoid a log copy of the whole matrix
+    size_factors = np.zeros(count_data.shape[0])
+    with np.errstate(divide='ignore'):
+        for start in range(0, count_data.shape[0], block_size):
+            log_ratios = np.log(count_data[start:start+block_size,finite_genes]) - log_geometric_means[finite_genes]
+            size_factors[start:start+block_size] = np.exp(np.median(log_ratios, 1))
+    return size_factors
+
+
+if __name__ == '__main__':
+    from time import time
+
+    # Synthetic negative binomial counts to compare engines
+    n_samples, n_genes = 200, 15000
+    count_data = np.random.negative_binomial(5, 0.01, size=(n_samples, n_genes))
+    count_data *= np.random.randint(1, 5, size=(n_samples, 1))
+
+    start_time = time()
+    X_numpy = DESeq_normalization_numpy(count_data)
+    print('DESeq normalization (numpy). Computed in %s s'%(time() - start_time))
+
+    start_time = time()
+    X_R = np.array(DESeq_normalization(count_data))
+    print('DESeq normalization (R). Computed in %s s'%(time() - start_time))
+    print('Maximum absolute difference: %s'%(np.max(np.abs(X_R - X_numpy))))
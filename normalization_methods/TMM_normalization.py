@@ -3,22 +3,27 @@
 Created on Mon Mar  5 18:26:46 2018
 
 @author: soufiane
+
+TMM normalization, either through edgeR (R engine) or through a NumPy port of
+edgeR's calcNormFactors (numpy engine) which does not require an R interpreter.
 """
-import rpy2
-import rpy2.robjects as robjects
-import rpy2.robjects.numpy2ri
-from rpy2.robjects.packages import importr
+import numpy as np
+from scipy.stats import rankdata
 from normalization_methods.normalization_parameters import NormalizationParameter
 
 
 def TMM_normalization(count_data, return_instance=False, coef=None):
-    
-    coef = coef or NormalizationParameter()
+
+    coef = NormalizationParameter() if coef is None else coef
 
     #Custom import
+    import rpy2
+    import rpy2.robjects as robjects
+    import rpy2.robjects.numpy2ri
+    from rpy2.robjects.packages import importr
     rpy2.robjects.numpy2ri.activate()
     importr('edgeR')
-    
+
     #Transform the input count data and feed it to R
     n_samples, n_genes = count_data.shape
     count_cell_lines_R = robjects.r.matrix(count_data.transpose(), nrow=n_genes, ncol=n_samples)
@@ -36,7 +41,7 @@ def TMM_normalization(count_data, return_instance=False, coef=None):
         coef.parameters = robjects.r["Dnorm"]
     else:
         robjects.r.assign('Dnorm', coef.parameters)
-    
+
     #Run TMM normalization with API
     X_TMM = robjects.r('''
         rellibsize <- colSums(D$counts)/exp(mean(log(colSums(D$counts))))
@@ -48,3 +53,152 @@ def TMM_normalization(count_data, return_instance=False, coef=None):
         #Transpose it back to have it in a scikit-learn format
         return X_TMM.transpose()
     return X_TMM.transpose(), coef
+
+
+def TMM_normalization_numpy(count_data, return_instance=False, coef=None):
+    """
+    TMM normalization computed with NumPy. Gives the same output as TMM_normalization.
+
+    The fitted parameters are stored as a dictionary with the normalization factors,
+    the reference sample and the scaling used to center the factors. When coef is
+    given with fitted parameters, factors of count_data are computed against the stored
+    reference, which allows to normalize new samples without refitting.
+    """
+
+    coef = NormalizationParameter() if coef is None else coef
+
+    size_factors = TMM_sample_size_factors(count_data, coef)
+    X_TMM = np.round(count_data / size_factors[:,np.newaxis])
+
+    if not return_instance:
+        return X_TMM
+    return X_TMM, coef
+
+
+def TMM_sample_size_factors(count_data, coef):
+    """
+    Size factor of each sample, i.e. TMM factor times relative library size, such that
+    TMM normalized data is round(count_data / size_factors). Parameters are fitted and
+    stored in coef if not available.
+    """
+    lib_size = np.sum(count_data, 1)
+    if coef.parameters is None:
+        reference_index = TMM_reference_sample(count_data, lib_size)
+        reference = np.array(count_data[reference_index], dtype=float)
+        reference_lib_size = lib_size[reference_index]
+
+        raw_factors = TMM_factors(count_data, reference, reference_lib_size, lib_size)
+        scaling = np.exp(np.mean(np.log(raw_factors)))
+        coef.parameters = {
+            'norm_factors': raw_factors / scaling,
+            'reference': reference,
+            'reference_lib_size': reference_lib_size,
+            'scaling': scaling
+        }
+        norm_factors = coef.parameters['norm_factors']
+    else:
+        norm_factors = TMM_factors(count_data,
+                                  coef.parameters['reference'],
+                                  coef.parameters['reference_lib_size'],
+                                  lib_size) / coef.parameters['scaling']
+
+    #Normalize with the relative library size, as in the R engine
+    return norm_factors * lib_size / np.exp(np.mean(np.log(lib_size)))
+
+
+def TMM_reference_sample(count_data, lib_size=None, p=0.75):
+    """
+    Index of the reference sample used by edgeR: the sample whose upper-quartile,
+    computed on the genes expressed in at least one sample, is the closest to the mean.
+    """
+    lib_size = np.sum(count_data, 1) if lib_size is None else lib_size
+    expressed_genes = np.where(np.max(count_data, 0) > 0)[0]
+
+    f75 = TMM_upper_quartiles(count_data, expressed_genes, p) / lib_size
+    if np.median(f75) < 1e-20:
+        return int(np.argmax(TMM_sqrt_sums(count_data, expressed_genes)))
+    return int(np.argmin(np.abs(f75 - np.mean(f75))))
+
+
+def TMM_upper_quartiles(count_data, expressed_genes, p=0.75):
+    #Sample per sample to avoid copies of the whole matrix
+    return np.array([np.percentile(x[expressed_genes], 100*p) for x in count_data])
+
+
+def TMM_sqrt_sums(count_data, expressed_genes):
+    #Reference selection when upper-quartiles are all zero
+    return np.array([np.sum(np.sqrt(x[expressed_genes])) for x in count_data])
+
+
+def TMM_factors(count_data,
+                reference,
+                reference_lib_size,
+                lib_size=None,
+                logratio_trim=.3,
+                sum_trim=0.05,
+                do_weighting=True,
+                A_cutoff=-1e10):
+    """
+    Non-centered TMM factor of each sample against a reference sample. Port of
+    edgeR's .calcFactorTMM, vectorized over genes.
+    """
+    lib_size = np.sum(count_data, 1) if lib_size is None else lib_size
+    reference = np.asarray(reference, dtype=float)
+    factors = np.ones(count_data.shape[0])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_reference = np.log2(reference / reference_lib_size)
+        v_reference = (reference_lib_size - reference) / reference_lib_size / reference
+
+        for i in range(count_data.shape[0]):
+            obs = np.asarray(count_data[i], dtype=float)
+            log_obs = np.log2(obs / lib_size[i])
+
+            log_R = log_obs - log_reference
+            abs_E = (log_obs + log_reference) / 2
+            v = (lib_size[i] - obs) / lib_size[i] / obs + v_reference
+
+            finite = np.isfinite(log_R) & np.isfinite(abs_E) & (abs_E > A_cutoff)
+            log_R = log_R[finite]
+            abs_E = abs_E[finite]
+            v = v[finite]
+
+            if log_R.shape[0] == 0 or np.max(np.abs(log_R)) < 1e-6:
+                continue
+
+            n = log_R.shape[0]
+            lo_L = np.floor(n * logratio_trim) + 1
+            hi_L = n + 1 - lo_L
+            lo_S = np.floor(n * sum_trim) + 1
+            hi_S = n + 1 - lo_S
+
+            rank_R = rankdata(log_R)
+            rank_E = rankdata(abs_E)
+            keep = (rank_R >= lo_L) & (rank_R <= hi_L) & (rank_E >= lo_S) & (rank_E <= hi_S)
+
+            if do_weighting:
+                f = np.nansum(log_R[keep] / v[keep]) / np.nansum(1. / v[keep])
+            else:
+                f = np.nanmean(log_R[keep])
+            factors[i] = 2 ** (0 if np.isnan(f) else f)
+
+    return factors
+
+
+if __name__ == '__main__':
+    from time import time
+
+    # Synthetic negative binomial counts to compare engines
+    n_samples, n_genes = 200, 15000
+    count_data = np.random.negative_binomial(2, 0.01, size=(n_samples, n_genes))
+    count_data *= np.random.randint(1, 5, size=(n_samples, 1))
+    count_data[:, :500] = 0
+
+    start_time = time()
+    X_numpy = TMM_normalization_numpy(count_data)
+    print('TMM normalization (numpy). Computed in %s s'%(time() - start_time))
+
+    start_time = time()
+    X_R = np.array(TMM_normalization(count_data))
+    print('TMM normalization (R). Computed in %s s'%(time() - start_time))
+    print('Maximum absolute difference: %s'%(np.max(np.abs(X_R - X_numpy))))
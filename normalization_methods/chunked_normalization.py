@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+CHUNKED_NORMALIZATION
+
+Out-of-core normalization, transformation and standardization of matrices that do not
+fit in memory, e.g. np.memmap, h5py or zarr datasets. Data is read by blocks of samples:
+global statistics (library sizes, TMM reference, DESeq geometric means, quantile
+reference and scaler) are computed in a first pass and applied in a second pass, only
+one block being loaded at once. Results are identical to fused_feature_engineering with
+the numpy engine.
+"""
+
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+from normalization_methods.normalization_parameters import NormalizationParameter
+from normalization_methods.feature_engineering import _sample_factors, _apply_sample_factors, _transform_samples
+from normalization_methods.TMM_normalization import TMM_upper_quartiles, TMM_sqrt_sums, TMM_factors
+from normalization_methods.DESeq_normalization import DESeq_size_factors
+from normalization_methods.quantile_normalization import quantile_map
+
+chunked_normalization_methods = ['total_count', 'voom', 'upper_quartile', 'median', 'tmm', 'deseq', 'quantile', '']
+
+
+def chunked_feature_engineering(data,
+                                normalization_method=None,
+                                transformation_method=None,
+                                mean_center=False,
+                                std_unit=False,
+                                return_instance=False,
+                                coef=None,
+                                output=None,
+                                dtype=None,
+                                block_size=1000,
+                                scaler_block_size=100):
+    """
+    Normalization, transformation and standardization computed by blocks of samples.
+
+    INPUT:
+        - data (array-like): count data in the form (n_samples, n_genes), sliceable by rows,
+        e.g. np.memmap, h5py or zarr dataset.
+        - normalization_method, transformation_method, mean_center, std_unit,
+        return_instance, coef: see feature_engineering. Normalizations are computed with
+        the numpy engine. Quantile transformation, which requires all samples of a gene,
+        is not available.
+        - output (array-like, optional, default to None): writable array of shape
+        data.shape where processed data is written, e.g. np.lib.format.open_memmap. An
+        in-memory array is created if None.
+        - dtype (np.dtype, optional, default to None): type of the processed blocks, e.g.
+        np.float32. Float64 if None.
+        - block_size (int, optional, default to 1000): number of samples loaded at once.
+        Should be a multiple of scaler_block_size for results identical to
+        fused_feature_engineering.
+        - scaler_block_size (int, optional, default to 100): number of samples used at once
+        to fit the scaler, see block_size of fused_feature_engineering.
+    OUTPUT:
+        - output: processed data, with coef if return_instance.
+    """
+    coef = NormalizationParameter() if coef is None else coef
+    dtype = np.dtype(dtype or np.float64)
+    normalization_method = (normalization_method or '').lower()
+    transformation_method = (transformation_method or '').lower()
+
+    if normalization_method not in chunked_normalization_methods:
+        raise ValueError('%s is not available for chunked normalization'%(normalization_method))
+    if transformation_method == 'quantile':
+        raise ValueError('Quantile transformation is not available for chunked normalization')
+
+    n_samples = data.shape[0]
+    blocks = [(start, min(start + block_size, n_samples)) for start in range(0, n_samples, block_size)]
+
+    #First pass(es): normalization parameters
+    factors = None
+    if normalization_method == 'tmm':
+        factors = _chunked_TMM_size_factors(data, blocks, coef, dtype)
+    elif normalization_method == 'deseq':
+        factors = _chunked_DESeq_size_factors(data, blocks, coef, dtype)
+    elif normalization_method == 'quantile':
+        if coef.parameters is None or coef.parameters is True:
+            coef.parameters = _chunked_quantile_reference(data, blocks)
+    elif normalization_method != '':
+        #Per-sample statistics, fitted block per block
+        if coef.parameters is None:
+            block_parameters = []
+            for start, stop in blocks:
+                block_coef = NormalizationParameter()
+                _sample_factors(_read_block(data, start, stop, normalization_method, dtype),
+                                normalization_method, block_coef)
+                block_parameters.append(block_coef.parameters)
+            coef.parameters = np.concatenate(block_parameters)
+        factors = _sample_factors(None, normalization_method, coef)
+
+    output = np.empty(data.shape, dtype=dtype) if output is None else output
+    fit_scaler = coef.scaler is None
+    if fit_scaler:
+        coef.scaler = StandardScaler(with_mean=mean_center, with_std=std_unit)
+
+    #Second pass: normalization and transformation, fitting the scaler on the processed blocks
+    for start, stop in blocks:
+        if normalization_method == 'quantile':
+            processed_block = np.asarray(quantile_map(np.asarray(data[start:stop]), coef.parameters), dtype=dtype)
+        else:
+            processed_block = _read_block(data, start, stop, normalization_method, dtype)
+            if factors is not None:
+                _apply_sample_factors(processed_block, normalization_method, coef, factors[start:stop])
+        processed_block = _transform_samples(processed_block, transformation_method)
+
+        if fit_scaler:
+            for scaler_start in range(0, stop - start, scaler_block_size):
+                coef.scaler.partial_fit(processed_block[scaler_start:scaler_start+scaler_block_size])
+            output[start:stop] = processed_block
+        else:
+            output[start:stop] = coef.scaler.transform(processed_block, copy=False)
+
+    #Third pass: standardization with the scaler fitted on all samples
+    if fit_scaler:
+        for start, stop in blocks:
+            output[start:stop] = coef.scaler.transform(np.array(output[start:stop], dtype=dtype), copy=False)
+
+    if return_instance:
+        return output, coef
+    return output
+
+
+def _read_block(data, start, stop, normalization_method, dtype):
+    #In-memory copy of a block of samples, truncated for DESeq as in fused_feature_engineering
+    block = np.array(data[start:stop], dtype=dtype)
+    if normalization_method == 'deseq':
+        np.trunc(block, out=block)
+    return block
+
+
+def _chunked_TMM_size_factors(data, blocks, coef, dtype):
+    #Library sizes and genes expressed in at least one sample
+    lib_size = []
+    max_counts = np.full(data.shape[1], -np.inf)
+    for start, stop in blocks:
+        block = _read_block(data, start, stop, 'tmm', dtype)
+        lib_size.append(np.sum(block, 1))
+        np.maximum(max_counts, np.max(block, 0), out=max_counts)
+    lib_size = np.concatenate(lib_size)
+
+    if coef.parameters is None:
+        #Reference sample, see TMM_reference_sample
+        expressed_genes = np.where(max_counts > 0)[0]
+        f75 = np.concatenate([TMM_upper_quartiles(_read_block(data, start, stop, 'tmm', dtype), expressed_genes)
+                              for start, stop in blocks]) / lib_size
+        if np.median(f75) < 1e-20:
+            sqrt_sums = np.concatenate([TMM_sqrt_sums(_read_block(data, start, stop, 'tmm', dtype), expressed_genes)
+                                        for start, stop in blocks])
+            reference_index = int(np.argmax(sqrt_sums))
+        else:
+            reference_index = int(np.argmin(np.abs(f75 - np.mean(f75))))
+        reference = np.array(_read_block(data, reference_index, reference_index+1, 'tmm', dtype)[0], dtype=float)
+        reference_lib_size = lib_size[reference_index]
+        scaling = None
+    else:
+        reference = coef.parameters['reference']
+        reference_lib_size = coef.parameters['reference_lib_size']
+        scaling = coef.parameters['scaling']
+
+    raw_factors = np.concatenate([TMM_factors(_read_block(data, start, stop, 'tmm', dtype),
+                                              reference,
+                                              reference_lib_size,
+                                              lib_size[start:stop])
+                                  for start, stop in blocks])
+
+    if scaling is None:
+        scaling = np.exp(np.mean(np.log(raw_factors)))
+        coef.parameters = {
+            'norm_factors': raw_factors / scaling,
+            'reference': reference,
+            'reference_lib_size': reference_lib_size,
+            'scaling': scaling
+        }
+
+    #Normalize with the relative library size, as in TMM_sample_size_factors
+    return raw_factors / scaling * lib_size / np.exp(np.mean(np.log(lib_size)))
+
+
+def _chunked_DESeq_size_factors(data, blocks, coef, dtype):
+    if coef.parameters is None:
+        #Log geometric means, accumulated sample per sample as np.mean along samples
+        log_sums = None
+        with np.errstate(divide='ignore'):
+            for start, stop in blocks:
+                for log_sample in np.log(_read_block(data, start, stop, 'deseq', dtype)):
+                    if log_sums is None:
+                        log_sums = log_sample.copy()
+                    else:
+                        log_sums += log_sample
+        log_geometric_means = np.zeros(data.shape[1])
+        if log_sums is not None:
+            log_geometric_means[:] = log_sums / data.shape[0]
+    else:
+        log_geometric_means = coef.parameters['log_geometric_means']
+
+    size_factors = np.concatenate([DESeq_size_factors(_read_block(data, start, stop, 'deseq', dtype), log_geometric_means)
+                                   for start, stop in blocks])
+
+    if coef.parameters is None:
+        coef.parameters = {
+            'size_factors': size_factors,
+            'log_geometric_means': log_geometric_means
+        }
+    return size_factors
+
+
+def _chunked_quantile_reference(data, blocks):
+    #Mean of the sorted samples, accumulated sample per sample as np.mean along samples
+    sorted_sums = None
+    for start, stop in blocks:
+        for sorted_sample in np.sort(np.asarray(data[start:stop]), 1):
+            if sorted_sums is None:
+                sum_dtype = np.float64 if sorted_sample.dtype.kind in 'biu' else sorted_sample.dtype
+                sorted_sums = np.zeros(sorted_sample.shape[0], dtype=sum_dtype)
+            sorted_sums += sorted_sample
+    return sorted_sums / data.shape[0]
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    import tracemalloc
+    from time import time
+    from normalization_methods.feature_engineering import fused_feature_engineering
+
+    # Memory-mapped synthetic counts, compared to the in-memory fused pipeline
+    n_samples, n_genes = 2000, 20000
+    folder = tempfile.mkdtemp()
+    count_data = np.lib.format.open_memmap(os.path.join(folder, 'counts.npy'), mode='w+',
+                                           dtype=np.float64, shape=(n_samples, n_genes))
+    for start in range(0, n_samples, 500):
+        count_data[start:start+500] = np.random.negative_binomial(2, 0.01, size=(min(500, n_samples-start), n_genes))
+    count_data.flush()
+    input_size = count_data.nbytes
+
+    for normalization_method in ['TMM', 'DESeq', 'quantile', 'total_count']:
+        output = np.lib.format.open_memmap(os.path.join(folder, 'processed.npy'), mode='w+',
+                                           dtype=np.float64, shape=(n_samples, n_genes))
+        tracemalloc.start()
+        start_time = time()
+        chunked_feature_engineering(count_data, normalization_method, 'log', True, True, output=output, block_size=200)
+        chunked_time = time() - start_time
+        chunked_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        start_time = time()
+        X_fused = fused_feature_engineering(count_data, normalization_method, 'log', True, True, engine='numpy')
+        fused_time = time() - start_time
+        fused_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        print('%s + log + z-score: in memory %.2fx input in %.2f s, chunked %.2fx input in %.2f s, identical: %s'%(
+            normalization_method, fused_peak / input_size, fused_time, chunked_peak / input_size,
+            chunked_time, np.array_equal(X_fused, output)))
+        del X_fused, output
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+COMBAT_NORMALIZATION
+
+NumPy port of the parametric empirical Bayes ComBat (Johnson et al, Biostatistics 2007)
+as implemented in combat.py (https://github.com/brentp/combat.py), previously cloned and
+run on a DataFrame in fig4_biomarker_test. Batch effects only, no other covariate.
+
+All ComBat estimates (batch means, pooled variance, additive and multiplicative batch
+effects and the sums of squares of the empirical Bayes iterations) are functions of the
+mean and variance of each gene in each batch. Data is therefore read once to compute these
+moments, iterations run on (n_genes,) vectors, and the correction is one affine transform
+per gene and batch, computed in place in the type of the data (e.g. float32).
+
+Fitted parameters (standardization, batch effects of each batch) are kept in a
+NormalizationParameter, such that new samples of a fitted batch, or a new batch adjusted
+to the fitted standardization, can be corrected without refitting.
+"""
+
+import numpy as np
+from normalization_methods.normalization_parameters import NormalizationParameter
+
+# Convergence criterion of the empirical Bayes iterations, as combat.py
+convergence_threshold = 0.0001
+
+
+def combat_normalization(data, batch, reference_batch=None, return_instance=False, coef=None, dtype=None):
+    """
+    Remove batch effects with ComBat.
+
+    INPUT:
+        - data (np.ndarray): data in the form (n_samples, n_genes), e.g. log-normalized.
+        - batch (np.ndarray): batch of each sample.
+        - reference_batch (optional, default to None): batch used as reference, i.e. left
+        unchanged, the others being adjusted to its mean and variance (as ref.batch in sva).
+        All batches are adjusted to the pooled mean and variance if None.
+        - return_instance (bool, optional, default to False): whether the fitted parameters
+        should be returned.
+        - coef (NormalizationParameter, optional, default to None): fitted parameters. When
+        given, samples are corrected with the stored standardization and batch effects;
+        batches absent from the fit are estimated against the stored standardization.
+        - dtype (np.dtype, optional, default to None): type of the output, e.g. np.float32.
+        Statistics are computed in float64.
+    OUTPUT:
+        - corrected_data (np.ndarray): data without batch effects, (n_samples, n_genes).
+        - coef (NormalizationParameter): fitted parameters, if return_instance.
+    """
+    coef = NormalizationParameter() if coef is None else coef
+    batch = np.asarray(batch)
+    batch_levels = list(np.unique(batch))
+    batch_rows = {level: np.where(batch == level)[0] for level in batch_levels}
+
+    #Moments of the batches not fitted yet only, such that fitted batches can be corrected sample per sample
+    fitted_levels = [] if coef.parameters is None else list(coef.parameters['gamma_star'])
+    moments = {level: _batch_moments(data, batch_rows[level]) for level in batch_levels if level not in fitted_levels}
+
+    if coef.parameters is None:
+        coef.parameters = _fit_standardization(moments, batch_levels, reference_batch)
+    parameters = coef.parameters
+
+    #Empirical Bayes batch effects of the batches not fitted yet
+    for level in batch_levels:
+        if level not in parameters['gamma_star']:
+            gamma_star, delta_star = _batch_effects(moments[level], parameters)
+            parameters['gamma_star'][level] = gamma_star
+            parameters['delta_star'][level] = delta_star
+
+    corrected_data = np.array(data, dtype=np.dtype(dtype or np.float64))
+    for level in batch_levels:
+        if level == parameters['reference_batch']:
+            continue
+        scale, shift = _batch_transform(parameters, level)
+        rows = batch_rows[level]
+        corrected_data[rows] = corrected_data[rows] * scale.astype(corrected_data.dtype) + shift.astype(corrected_data.dtype)
+
+    if not return_instance:
+        return corrected_data
+    return corrected_data, coef
+
+
+def _batch_moments(data, rows):
+    #Number of samples, mean and population variance of each gene in one batch
+    if rows.shape[0] < 2:
+        raise ValueError('ComBat requires at least two samples per batch')
+    batch_data = data[rows]
+    mean = np.mean(batch_data, 0, dtype=np.float64)
+    variance = np.var(batch_data, 0, dtype=np.float64)
+    return rows.shape[0], mean, variance
+
+
+def _fit_standardization(moments, batch_levels, reference_batch):
+    #Grand mean and pooled variance of each gene, from all batches or from the reference one
+    if reference_batch is not None:
+        if reference_batch not in batch_levels:
+            raise ValueError('Reference batch %s is not a batch of the data'%(reference_batch))
+        _, grand_mean, var_pooled = moments[reference_batch]
+    else:
+        n_samples = np.array([moments[level][0] for level in batch_levels], dtype=float)
+        batch_means = np.array([moments[level][1] for level in batch_levels])
+        batch_variances = np.array([moments[level][2] for level in batch_levels])
+        grand_mean = n_samples.dot(batch_means) / np.sum(n_samples)
+        var_pooled = n_samples.dot(batch_variances) / np.sum(n_samples)
+
+    parameters = {
+        'grand_mean': grand_mean,
+        'var_pooled': var_pooled,
+        'variable_genes': var_pooled > 0,
+        'reference_batch': reference_batch,
+        'gamma_star': {},
+        'delta_star': {}
+    }
+    if reference_batch is not None:
+        parameters['gamma_star'][reference_batch] = np.zeros(grand_mean.shape[0])
+        parameters['delta_star'][reference_batch] = np.ones(grand_mean.shape[0])
+
+    return parameters
+
+
+def _batch_effects(batch_moments, parameters):
+    """
+    Empirical Bayes estimates of the additive (gamma) and multiplicative (delta) effects
+    of one batch on standardized data. Genes without variance are left unchanged.
+    """
+    n_samples, batch_mean, batch_variance = batch_moments
+    variable_genes = parameters['variable_genes']
+    std_pooled = np.sqrt(parameters['var_pooled'][variable_genes])
+
+    #Mean and unbiased variance of the standardized data in the batch
+    gamma_hat = (batch_mean[variable_genes] - parameters['grand_mean'][variable_genes]) / std_pooled
+    delta_hat = batch_variance[variable_genes] / std_pooled ** 2 * n_samples / (n_samples - 1.)
+
+    #Priors (variance of gamma_hat without and of delta_hat with bias correction, as combat.py)
+    gamma_bar, t2 = np.mean(gamma_hat), np.var(gamma_hat)
+    delta_mean, delta_variance = np.mean(delta_hat), np.var(delta_hat, ddof=1)
+    a_prior = (2 * delta_variance + delta_mean ** 2) / delta_variance
+    b_prior = (delta_mean * delta_variance + delta_mean ** 3) / delta_variance
+
+    #Posterior means iterated until convergence. The sum of squares of the standardized data
+    #around g, sum((s - g)^2), is (n - 1) delta_hat + n (gamma_hat - g)^2.
+    gamma_old, delta_old = gamma_hat, delta_hat
+    change = 1
+    while change > convergence_threshold:
+        gamma_new = (t2 * n_samples * gamma_hat + delta_old * gamma_bar) / (t2 * n_samples + delta_old)
+        sum_squares = (n_samples - 1) * delta_hat + n_samples * (gamma_hat - gamma_new) ** 2
+        delta_new = (0.5 * sum_squares + b_prior) / (n_samples / 2. + a_prior - 1.)
+        change = max(np.max(np.abs(gamma_new - gamma_old) / gamma_old),
+                     np.max(np.abs(delta_new - delta_old) / delta_old))
+        gamma_old, delta_old = gamma_new, delta_new
+
+    gamma_star = np.zeros(variable_genes.shape[0])
+    delta_star = np.ones(variable_genes.shape[0])
+    gamma_star[variable_genes] = gamma_new
+    delta_star[variable_genes] = delta_new
+    return gamma_star, delta_star
+
+
+def _batch_transform(parameters, level):
+    #Correction of one batch as x * scale + shift, i.e. ((x - m) / s - gamma) / sqrt(delta) * s + m
+    scale = 1. / np.sqrt(parameters['delta_star'][level])
+    shift = parameters['grand_mean'] - (parameters['grand_mean']
+                                        + parameters['gamma_star'][level] * np.sqrt(parameters['var_pooled'])) * scale
+    return scale, shift
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    from time import time
+
+    # Tumors and cell lines on 15000 genes as in fig4_biomarker_test, with additive and
+    # multiplicative batch effects
+    n_genes, n_target, n_source = 15000, 1000, 500
+    X_target = np.random.randn(n_target, n_genes) + 5
+    X_source = 1.5 * np.random.randn(n_source, n_genes) + 5 + np.random.randn(n_genes)
+    X_total = np.concatenate([X_target, X_source])
+    batch = np.array([0]*n_target + [1]*n_source)
+
+    start_time = time()
+    corrected_data = combat_normalization(X_total, batch)
+    print('ComBat, float64: %.2f s'%(time() - start_time))
+
+    start_time = time()
+    corrected_data_32 = combat_normalization(X_total.astype(np.float32), batch, dtype=np.float32)
+    print('ComBat, float32: %.2f s (maximum difference to float64: %.2e)'%(time() - start_time,
+                                                                          np.max(np.abs(corrected_data_32 - corrected_data))))
+
+    # Fit on the first half of the samples of each batch, apply to the second half
+    first_half = np.concatenate([np.arange(n_target//2), n_target + np.arange(n_source//2)])
+    second_half = np.setdiff1d(np.arange(n_target + n_source), first_half)
+    _, coef = combat_normalization(X_total[first_half], batch[first_half], return_instance=True)
+    start_time = time()
+    combat_normalization(X_total[second_half], batch[second_half], coef=coef)
+    print('ComBat, fitted parameters applied to new samples: %.2f s'%(time() - start_time))
+
+    # External implementation used before in fig4_biomarker_test, if cloned in ./combat/
+    if os.path.isdir('./combat/'):
+        import pandas as pd
+        sys.path.insert(0, './combat/')
+        from combat import combat
+
+        start_time = time()
+        data = pd.DataFrame(X_total.transpose())
+        external_corrected_data = np.array(combat.combat(data, batch=pd.Series(batch))).transpose()
+        print('combat.py: %.2f s (maximum difference: %.2e)'%(time() - start_time,
+                                                             np.max(np.abs(external_corrected_data - corrected_data))))
+    else:
+        print('combat.py not found in ./combat/, comparison skipped')
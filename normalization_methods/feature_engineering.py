@@ -7,7 +7,12 @@ Created on Wed Mar 14 11:27:09 2018
 
 from normalization_methods.transform import transform_data
 from normalization_methods.normalize import normalize_data
+from normalization_methods.normalization_parameters import NormalizationParameter
+from normalization_methods.TMM_normalization import TMM_sample_size_factors
+from normalization_methods.DESeq_normalization import DESeq_sample_size_factors
+from normalization_methods.percentile_normalization import nonzero_percentile, percentile_factors
 import numpy as np
+from sklearn.preprocessing import StandardScaler, quantile_transform
 
 
 def feature_engineering(data,\
@@ -16,21 +21,203 @@ def feature_engineering(data,\
                         mean_center=False,\
                         std_unit=False,\
                         return_instance=False,\
-                        coef=None):
+                        coef=None,\
+                        engine='r',\
+                        inplace=False,\
+                        dtype=None):
     
+    #Fused pipeline, see fused_feature_engineering
+    if inplace or dtype is not None:
+        return fused_feature_engineering(data, normalization_method, transformation_method,
+                                         mean_center, std_unit, return_instance, coef, engine,
+                                         inplace, dtype)
+
     if normalization_method == 'voom':
-        voom_transformed_data = normalize_data(data, 'voom', False, coef)
+        voom_transformed_data = normalize_data(data, 'voom', False, coef, engine)
         if transformation_method =='voom':
-            voom_transformed_data = np.log(normalize_data(data, 'voom', False, coef))
+            voom_transformed_data = np.log(voom_transformed_data)
         else:
             voom_transformed_data = transform_data(voom_transformed_data, transformation_method, False, False, return_instance, coef)
             
         return transform_data(voom_transformed_data, None, mean_center, std_unit, return_instance, coef)
     
     if return_instance:
-        normalized_data, coef = normalize_data(data, normalization_method, return_instance, coef)
+        normalized_data, coef = normalize_data(data, normalization_method, return_instance, coef, engine)
         return transform_data(normalized_data, transformation_method, mean_center, std_unit, return_instance, coef)
     else:
-        normalized_data = normalize_data(data, normalization_method, return_instance, coef)
+        normalized_data = normalize_data(data, normalization_method, return_instance, coef, engine)
         return transform_data(normalized_data, transformation_method, mean_center, std_unit, return_instance, coef)
-    
\ No newline at end of file
+
+
+def fused_feature_engineering(data,
+                              normalization_method=None,
+                              transformation_method=None,
+                              mean_center=False,
+                              std_unit=False,
+                              return_instance=False,
+                              coef=None,
+                              engine='r',
+                              inplace=False,
+                              dtype=None,
+                              block_size=100):
+    """
+    Normalization, transformation and standardization computed on one matrix updated in
+    place. Normalizations that rescale samples (total_count, voom, upper_quartile, median
+    and, with the numpy engine, TMM and DESeq) only compute one factor per sample. Other
+    normalizations produce one normalized copy, which is then updated in place. Peak memory
+    is therefore close to the size of the data instead of several copies.
+
+    INPUT:
+        - data (np.ndarray): count data in the form (n_samples, n_genes).
+        - normalization_method, transformation_method, mean_center, std_unit,
+        return_instance, coef, engine: see feature_engineering.
+        - inplace (bool, optional, default to False): whether data can be overwritten. Only
+        possible when data is already a float array of type dtype, copied otherwise.
+        - dtype (np.dtype, optional, default to None): type of the output, e.g. np.float32.
+        Float64 if None.
+        - block_size (int, optional, default to 100): number of samples used at once to
+        fit the scaler.
+    OUTPUT:
+        - data (np.ndarray): processed data, with coef if return_instance.
+    """
+    coef = NormalizationParameter() if coef is None else coef
+    dtype = np.dtype(dtype or np.float64)
+    normalization_method = (normalization_method or '').lower()
+    transformation_method = (transformation_method or '').lower()
+
+    #Normalization, as a scaling of samples whenever possible
+    rescaled_methods = ['total_count', 'voom', 'upper_quartile', 'median', '']
+    if engine.lower() == 'numpy':
+        rescaled_methods += ['tmm', 'deseq']
+    if normalization_method in rescaled_methods:
+        if inplace and isinstance(data, np.ndarray) and data.dtype == dtype and data.flags.writeable:
+            processed_data = data
+        else:
+            processed_data = np.array(data, dtype=dtype)
+        _rescale_samples(processed_data, normalization_method, coef)
+    else:
+        processed_data, coef = normalize_data(data, normalization_method, True, coef, engine)
+        #Copied if normalize_data returned the data itself (e.g. unknown method)
+        if not inplace and isinstance(data, np.ndarray) and np.may_share_memory(processed_data, data):
+            processed_data = np.array(processed_data, dtype=dtype)
+        else:
+            processed_data = np.asarray(processed_data, dtype=dtype)
+
+    #Transformation
+    processed_data = _transform_samples(processed_data, transformation_method)
+
+    #Standardization, the scaler being fitted by blocks of samples
+    if coef.scaler is None:
+        coef.scaler = StandardScaler(with_mean=mean_center, with_std=std_unit)
+        for start in range(0, processed_data.shape[0], block_size):
+            coef.scaler.partial_fit(processed_data[start:start+block_size])
+    processed_data = coef.scaler.transform(processed_data, copy=False)
+
+    if return_instance:
+        return processed_data, coef
+    return processed_data
+
+
+def _rescale_samples(count_data, normalization_method, coef):
+    #Normalize the samples of count_data in place
+    if normalization_method == 'deseq':
+        np.trunc(count_data, out=count_data)
+    factors = _sample_factors(count_data, normalization_method, coef)
+    _apply_sample_factors(count_data, normalization_method, coef, factors)
+
+
+def _sample_factors(count_data, normalization_method, coef):
+    #Factor of each sample, parameters being fitted if not available in coef
+    if normalization_method == 'tmm':
+        return TMM_sample_size_factors(count_data, coef)
+
+    elif normalization_method == 'deseq':
+        return DESeq_sample_size_factors(count_data, coef)
+
+    elif normalization_method == 'total_count':
+        if coef.parameters is None:
+            coef.parameters = np.sum(count_data, 1, dtype=np.float64)
+        return coef.parameters
+
+    elif normalization_method == 'voom':
+        if coef.parameters is None:
+            coef.parameters = np.sum(count_data, 1, dtype=np.float64) + 1.
+        return coef.parameters
+
+    elif normalization_method in ['upper_quartile', 'median']:
+        if coef.parameters is None:
+            coef.parameters = nonzero_percentile(count_data, 75 if normalization_method == 'upper_quartile' else 50)
+        return percentile_factors(coef.parameters)
+
+
+def _apply_sample_factors(count_data, normalization_method, coef, factors):
+    #Rescale in place the samples of count_data (or of a block of samples) by their factors
+    if normalization_method == 'tmm':
+        count_data /= factors[:,np.newaxis].astype(count_data.dtype)
+        np.round(count_data, out=count_data)
+
+    elif normalization_method == 'deseq':
+        count_data /= factors[:,np.newaxis].astype(count_data.dtype)
+
+    elif normalization_method == 'total_count':
+        count_data /= factors[:,np.newaxis].astype(count_data.dtype)
+        count_data *= np.mean(coef.parameters)
+
+    elif normalization_method == 'voom':
+        count_data += 0.5
+        count_data /= factors[:,np.newaxis].astype(count_data.dtype)
+        count_data *= 10**6
+
+    elif normalization_method in ['upper_quartile', 'median']:
+        count_data *= factors[:,np.newaxis].astype(count_data.dtype)
+
+
+def _transform_samples(processed_data, transformation_method):
+    #Transformation of processed_data, in place except for quantile
+    if transformation_method == 'log':
+        processed_data += 1
+        np.log(processed_data, out=processed_data)
+    elif transformation_method == 'voom':
+        np.log(processed_data, out=processed_data)
+    elif transformation_method == 'anscombe':
+        processed_data += 3./8.
+        np.sqrt(processed_data, out=processed_data)
+    elif transformation_method == 'quantile':
+        processed_data = quantile_transform(processed_data, output_distribution='normal', copy=False)
+    elif transformation_method != '':
+        print('ERROR: not an available transformation method')
+    return processed_data
+
+if __name__ == '__main__':
+    import tracemalloc
+    from time import time
+
+    # Memory benchmark on synthetic counts: current pipeline against the fused one
+    n_samples, n_genes = 500, 20000
+    count_data = np.random.negative_binomial(2, 0.01, size=(n_samples, n_genes)).astype(float)
+    input_size = count_data.nbytes
+
+    for normalization_method in ['TMM', 'total_count']:
+        tracemalloc.start()
+        start_time = time()
+        X_current = feature_engineering(count_data, normalization_method, 'log', True, True, engine='numpy')
+        current_time = time() - start_time
+        current_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del X_current
+
+        fused_runs = [(np.float64, False), (np.float32, False), (np.float64, True)]
+        for dtype, inplace in fused_runs:
+            input_data = count_data.copy() if inplace else count_data
+            tracemalloc.start()
+            start_time = time()
+            X_fused = feature_engineering(input_data, normalization_method, 'log', True, True,
+                                          engine='numpy', inplace=inplace, dtype=dtype)
+            fused_time = time() - start_time
+            fused_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del X_fused, input_data
+
+            print('%s + log + z-score (%s%s): current %.1fx input in %.2f s, fused %.2fx input in %.2f s'%(
+                normalization_method, np.dtype(dtype).name, ', in place' if inplace else '',
+                current_peak / input_size, current_time, fused_peak / input_size, fused_time))
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+FEATURE_SELECTION
+
+Selection of the genes with the highest variance across one or several domains (e.g.
+tumors and cell lines in fig4_biomarker_test), without concatenating them. Mean and sum of
+squared deviations of each gene are accumulated block of samples per block and merged with
+the pairwise formula of Chan et al (Welford's one-pass update, for blocks), such that
+domains can be np.memmap, h5py datasets or generators of blocks. Genes are then selected
+with np.argpartition instead of a full sort.
+"""
+
+import numpy as np
+
+default_block_size = 1000
+
+
+class GeneStatistics():
+    """
+    Streaming mean and variance of each gene.
+
+    ATTRIBUTES:
+        - n_samples (int): number of samples seen.
+        - mean (np.ndarray): mean of each gene, (n_genes,).
+        - m2 (np.ndarray): sum of squared deviations to the mean of each gene, (n_genes,).
+    """
+
+    def __init__(self):
+        self.n_samples = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, block):
+        """
+        Add a block of samples (n_block_samples, n_genes).
+        """
+        block = np.asarray(block)
+        if block.shape[0] == 0:
+            return self
+
+        block_statistics = GeneStatistics()
+        block_statistics.n_samples = block.shape[0]
+        block_statistics.mean = np.mean(block, 0, dtype=np.float64)
+        block_statistics.m2 = np.var(block, 0, dtype=np.float64) * block.shape[0]
+        return self.merge(block_statistics)
+
+    def merge(self, other):
+        """
+        Merge the statistics of other samples (GeneStatistics) into these statistics.
+        """
+        if other.n_samples == 0:
+            return self
+        if self.n_samples == 0:
+            self.n_samples, self.mean, self.m2 = other.n_samples, other.mean.copy(), other.m2.copy()
+            return self
+
+        n_samples = self.n_samples + other.n_samples
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.n_samples / n_samples
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.n_samples * other.n_samples / n_samples
+        self.n_samples = n_samples
+        return self
+
+    def variance(self, ddof=0):
+        return self.m2 / (self.n_samples - ddof)
+
+
+def _iterate_blocks(data, block_size=default_block_size):
+    #Blocks of samples of an array-like sliceable by rows, or blocks given by an iterable
+    if hasattr(data, 'shape'):
+        for start in range(0, data.shape[0], block_size):
+            yield data[start:start+block_size]
+    else:
+        for block in data:
+            yield block
+
+
+def gene_statistics(domains, block_size=default_block_size):
+    """
+    Statistics of each gene over the samples of all domains, as if they were concatenated.
+
+    INPUT:
+        - domains (list): data of each domain in the form (n_samples, n_genes), either
+        array-like sliceable by rows (np.ndarray, np.memmap, h5py dataset), or iterables of
+        blocks of samples (e.g. generators).
+        - block_size (int, optional, default to 1000): number of samples loaded at once.
+    OUTPUT:
+        - statistics (GeneStatistics): mean and variance of each gene.
+    """
+    statistics = GeneStatistics()
+    for data in domains:
+        for block in _iterate_blocks(data, block_size):
+            statistics.update(block)
+    return statistics
+
+
+def top_variance_genes(variance, n_genes):
+    """
+    Index of the n_genes genes with the highest variance, by decreasing variance. Same
+    output as np.argsort(variance, kind='stable')[::-1][:n_genes], ties included, with a
+    partial sort.
+    """
+    n_genes = min(n_genes, variance.shape[0])
+    if n_genes <= 0:
+        return np.zeros(0, dtype=int)
+
+    #Variance of the n_genes-th gene, then genes above it and ties with the largest index
+    threshold = variance[np.argpartition(variance, variance.shape[0] - n_genes)[variance.shape[0] - n_genes]]
+    above_genes = np.where(variance > threshold)[0]
+    tied_genes = np.where(variance == threshold)[0][::-1][:n_genes - above_genes.shape[0]]
+    selected_genes = np.concatenate([above_genes, tied_genes])
+
+    return selected_genes[np.lexsort((-selected_genes, -variance[selected_genes]))]
+
+
+def select_top_variance_genes(domains, n_genes, block_size=default_block_size):
+    """
+    Index of the n_genes genes with the highest variance over the samples of all domains,
+    by decreasing variance. See gene_statistics for the domains.
+    """
+    return top_variance_genes(gene_statistics(domains, block_size).variance(), n_genes)
+
+
+if __name__ == '__main__':
+    from time import time
+
+    # Tumors and cell lines as in fig4_biomarker_test, top 15000 genes
+    n_genes = 20000
+    X_target = np.random.randn(1000, n_genes) * np.random.gamma(2, size=n_genes)
+    X_source = np.random.randn(500, n_genes) * np.random.gamma(2, size=n_genes)
+
+    start_time = time()
+    X_total = np.concatenate([X_target, X_source])
+    sorted_genes = np.argsort(np.var(X_total, 0))[::-1][:15000]
+    print('Concatenation and argsort: %.2f s'%(time() - start_time))
+    del X_total
+
+    start_time = time()
+    selected_genes = select_top_variance_genes([X_target, X_source], 15000)
+    print('Streaming statistics and argpartition: %.2f s'%(time() - start_time))
+    print('Same genes: %s'%(np.array_equal(np.sort(sorted_genes), np.sort(selected_genes))))
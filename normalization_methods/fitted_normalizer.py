@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+FITTED_NORMALIZER
+
+Normalization, transformation and standardization fitted once on a dataset and then
+applied to new batches of samples, without refitting. Fitted normalizers can be saved
+on disk and cached, keyed on the parameters and on the content of the fitted data.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from joblib import dump, load
+from normalization_methods.normalization_parameters import NormalizationParameter
+from normalization_methods.feature_engineering import fused_feature_engineering
+
+default_cache_folder = '../data/cache/normalizers/'
+
+normalizer_version = 1
+
+
+class FittedNormalizer():
+    """
+    Normalizer with separated fit and transform steps.
+
+    Reference-based parameters (TMM reference sample, DESeq geometric means and quantile
+    reference with the numpy engine) and the scaler are fitted once. Normalizations that
+    only depend on each sample (total_count, voom, upper_quartile, median, and TMM and
+    DESeq with the R engine) are re-estimated on each batch.
+    """
+
+    def __init__(self,
+                 normalization_method=None,
+                 transformation_method=None,
+                 mean_center=False,
+                 std_unit=False,
+                 engine='numpy',
+                 dtype=None):
+        """
+        INPUT:
+            - normalization_method, transformation_method, mean_center, std_unit, engine,
+            dtype: see feature_engineering.
+        """
+        self.normalization_method = normalization_method
+        self.transformation_method = transformation_method
+        self.mean_center = mean_center
+        self.std_unit = std_unit
+        self.engine = engine
+        self.dtype = dtype
+        self.coef = None
+
+    def fit(self, data):
+        self.fit_transform(data)
+        return self
+
+    def fit_transform(self, data):
+        """
+        Fit the parameters on data (n_samples, n_genes) and return the processed data.
+        """
+        processed_data, self.coef = fused_feature_engineering(data,
+                                                              self.normalization_method,
+                                                              self.transformation_method,
+                                                              self.mean_center,
+                                                              self.std_unit,
+                                                              return_instance=True,
+                                                              coef=NormalizationParameter(),
+                                                              engine=self.engine,
+                                                              dtype=self.dtype)
+        return processed_data
+
+    def transform(self, data):
+        """
+        Process new samples (n_samples, n_genes) with the fitted parameters.
+        """
+        if self.coef is None:
+            raise ValueError('FittedNormalizer has not been fitted')
+
+        coef = NormalizationParameter(self._reference_parameters(), self.coef.scaler)
+        return fused_feature_engineering(data,
+                                         self.normalization_method,
+                                         self.transformation_method,
+                                         self.mean_center,
+                                         self.std_unit,
+                                         coef=coef,
+                                         engine=self.engine,
+                                         dtype=self.dtype)
+
+    def save(self, file_name):
+        """
+        Save the fitted normalizer. Per-sample parameters are not saved.
+        """
+        if self.coef is None:
+            raise ValueError('FittedNormalizer has not been fitted')
+
+        content = {
+            'version': normalizer_version,
+            'settings': self._settings(),
+            'parameters': self._reference_parameters(),
+            'scaler': self.coef.scaler
+        }
+        tmp_file = '%s.%s.tmp'%(file_name, os.getpid())
+        dump(content, tmp_file)
+        os.replace(tmp_file, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        content = load(file_name)
+        if content['version'] != normalizer_version:
+            raise ValueError('%s has been saved with another version of FittedNormalizer'%(file_name))
+
+        settings = content['settings']
+        normalizer = cls(settings['normalization_method'],
+                         settings['transformation_method'],
+                         settings['mean_center'],
+                         settings['std_unit'],
+                         settings['engine'],
+                         settings['dtype'])
+        normalizer.coef = NormalizationParameter(content['parameters'], content['scaler'])
+        return normalizer
+
+    def _settings(self):
+        return {
+            'normalization_method': self.normalization_method,
+            'transformation_method': self.transformation_method,
+            'mean_center': self.mean_center,
+            'std_unit': self.std_unit,
+            'engine': self.engine,
+            'dtype': None if self.dtype is None else np.dtype(self.dtype).str
+        }
+
+    def _reference_parameters(self):
+        #Parameters that do not depend on the samples of a batch
+        reference_methods = ['quantile']
+        if self.engine.lower() == 'numpy':
+            reference_methods += ['tmm', 'deseq']
+        if (self.normalization_method or '').lower() in reference_methods:
+            return self.coef.parameters
+        return None
+
+
+def fit_normalizer(data,
+                   normalization_method=None,
+                   transformation_method=None,
+                   mean_center=False,
+                   std_unit=False,
+                   engine='numpy',
+                   dtype=None,
+                   cache_folder=None):
+    """
+    Fit a FittedNormalizer on data, re-using the one saved in cache_folder if the same
+    parameters have already been fitted on the same data.
+
+    INPUT:
+        - data (np.ndarray): data in the form (n_samples, n_genes).
+        - normalization_method, transformation_method, mean_center, std_unit, engine,
+        dtype: see feature_engineering.
+        - cache_folder (str, optional, default to None): folder of the cache, e.g.
+        default_cache_folder. No cache if None.
+    OUTPUT:
+        - normalizer (FittedNormalizer): fitted normalizer.
+    """
+    normalizer = FittedNormalizer(normalization_method, transformation_method, mean_center,
+                                  std_unit, engine, dtype)
+    if cache_folder is None:
+        return normalizer.fit(data)
+
+    cache_file = os.path.join(cache_folder, '%s.normalizer'%(normalizer_key(normalizer, data)))
+    if os.path.isfile(cache_file):
+        return FittedNormalizer.load(cache_file)
+
+    normalizer.fit(data)
+    os.makedirs(cache_folder, exist_ok=True)
+    normalizer.save(cache_file)
+
+    return normalizer
+
+
+def normalizer_key(normalizer, data):
+    """
+    Key of a normalizer fitted on data: hash of its settings and of the data content.
+    """
+    data = np.ascontiguousarray(data)
+    data_hash = hashlib.sha1(data.view(np.uint8)).hexdigest()
+
+    key_content = {
+        'version': normalizer_version,
+        'settings': normalizer._settings(),
+        'data': [data_hash, list(data.shape), data.dtype.str]
+    }
+    key_content = json.dumps(key_content, sort_keys=True)
+
+    return hashlib.sha1(key_content.encode('utf-8')).hexdigest()
+
+
+if __name__ == '__main__':
+    import tempfile
+    from time import time
+
+    # Fit once on a reference dataset, then project new batches with saved parameters
+    n_samples, n_genes = 500, 20000
+    reference_data = np.random.negative_binomial(2, 0.01, size=(n_samples, n_genes))
+    new_batch = np.random.negative_binomial(2, 0.01, size=(50, n_genes))
+    cache_folder = tempfile.mkdtemp()
+
+    start_time = time()
+    normalizer = fit_normalizer(reference_data, 'TMM', 'log', True, False, cache_folder=cache_folder)
+    print('TMM + log fitted in %.3f s'%(time() - start_time))
+
+    start_time = time()
+    normalizer = fit_normalizer(reference_data, 'TMM', 'log', True, False, cache_folder=cache_folder)
+    print('TMM + log loaded from cache in %.3f s'%(time() - start_time))
+
+    start_time = time()
+    X_batch = normalizer.transform(new_batch)
+    print('New batch of %s samples projected in %.3f s'%(new_batch.shape[0], time() - start_time))
@@ -10,45 +10,55 @@ Centralize normalization methods. All the code has been picked from different no
 used in /results/. The idea is just to get a central code that has not to be called
 everytime.
 
+TMM, DESeq and quantile normalization have two engines: 'r' (default) runs the
+Bioconductor implementation through rpy2, 'numpy' runs a NumPy port that gives the
+same results without starting an R interpreter.
+
 Requirement:
-    R 3.14
+    R 3.14 (only for the R engine)
     numpy
     pandas
 """
 
 import numpy as np
 
-from normalization_methods.TMM_normalization import TMM_normalization
-from normalization_methods.DESeq_normalization import DESeq_normalization
+from normalization_methods.TMM_normalization import TMM_normalization, TMM_normalization_numpy
+from normalization_methods.DESeq_normalization import DESeq_normalization, DESeq_normalization_numpy
 from normalization_methods.total_count_normalization import total_count_normalization
 from normalization_methods.voom_normalization import voom_normalization
 from normalization_methods.normalization_parameters import NormalizationParameter
-from normalization_methods.quantile_normalization import quantile_normalization
+from normalization_methods.quantile_normalization import quantile_normalization, quantile_normalization_numpy
+from normalization_methods.percentile_normalization import upper_quartile_normalization, median_normalization
 
-def normalize_data(count_data, normalization_method, return_instance=False, coef=True):
+def normalize_data(count_data, normalization_method, return_instance=False, coef=None, engine='r'):
     
     normalization_method = normalization_method or ''
+    if engine.lower() not in ['r', 'numpy']:
+        raise ValueError('%s is not an available engine. Should be \'r\' or \'numpy\''%(engine))
+    use_numpy = engine.lower() == 'numpy'
 
     if normalization_method.lower() == 'tmm':
+        if use_numpy:
+            return TMM_normalization_numpy(count_data, return_instance, coef)
         return TMM_normalization(count_data, return_instance, coef)
     
     elif normalization_method.lower() == 'deseq':
+        if use_numpy:
+            return DESeq_normalization_numpy(count_data, return_instance, coef)
         return DESeq_normalization(count_data, return_instance, coef)
     
     elif normalization_method.lower() == 'total_count':
         return total_count_normalization(count_data, return_instance, coef)
 
     elif normalization_method.lower() == 'upper_quartile':
-        upper_quartile_value = [np.percentile(x[np.where(x != 0)],75) for x in count_data]
-        mean_count = np.mean(upper_quartile_value)
-        normalized_counts =  (1. * count_data.transpose() / upper_quartile_value).transpose() * mean_count
+        return upper_quartile_normalization(count_data, return_instance, coef)
 
     elif normalization_method.lower() == 'median':
-        median_counts = [np.median(x[np.where(x!=0)]) for x in count_data]
-        mean_count = np.mean(median_counts)
-        normalized_counts = (1. * count_data.transpose() / median_counts).transpose() * mean_count
+        return median_normalization(count_data, return_instance, coef)
 
     elif normalization_method.lower() == 'quantile':
+        if use_numpy:
+            return quantile_normalization_numpy(count_data, return_instance, coef)
         return quantile_normalization(count_data, return_instance, coef)
 
     elif normalization_method.lower() == 'voom':
@@ -61,10 +71,6 @@ def normalize_data(count_data, normalization_method, return_instance=False, coef
         else:
             return count_data
 
-    if return_instance:
-        return normalized_counts, NormalizationParameter()
-    return normalized_counts
-
 
 if __name__ == '__main__':
     from time import time
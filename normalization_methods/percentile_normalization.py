@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+PERCENTILE_NORMALIZATION
+
+Upper-quartile and median normalization: each sample is divided by a percentile of its
+non-zero counts and multiplied by the mean of these percentiles. Percentiles of dense
+arrays are computed from row-sorted blocks of samples. scipy.sparse matrices are never
+densified: only the non-zero values of each sample (one CSR segment) are sorted.
+"""
+
+import numpy as np
+import scipy.sparse
+from normalization_methods.normalization_parameters import NormalizationParameter
+
+# Number of samples sorted at once
+block_size = 1000
+
+
+def upper_quartile_normalization(count_data, return_instance=False, coef=None):
+    return percentile_normalization(count_data, 75, return_instance, coef)
+
+
+def median_normalization(count_data, return_instance=False, coef=None):
+    return percentile_normalization(count_data, 50, return_instance, coef)
+
+
+def percentile_normalization(count_data, q, return_instance=False, coef=None):
+    """
+    Normalize each sample by the q-th percentile of its non-zero counts.
+
+    INPUT:
+        - count_data (np.ndarray or scipy.sparse matrix): counts (n_samples, n_genes).
+        - q (float): percentile, e.g. 75 for upper-quartile normalization.
+        - return_instance (bool, optional, default to False): whether coef is returned.
+        - coef (NormalizationParameter, optional, default to None): percentile of each
+        sample, computed if not available.
+    OUTPUT:
+        - normalized_counts: normalized data, sparse if count_data is sparse. Samples
+        without non-zero count are left to zero.
+    """
+    coef = NormalizationParameter() if coef is None else coef
+    if coef.parameters is None:
+        coef.parameters = nonzero_percentile(count_data, q)
+    factors = percentile_factors(coef.parameters)
+
+    if scipy.sparse.issparse(count_data):
+        normalized_counts = scipy.sparse.csr_matrix(count_data, dtype=float, copy=True)
+        normalized_counts.data *= np.repeat(factors, np.diff(normalized_counts.indptr))
+    else:
+        normalized_counts = count_data * factors[:,np.newaxis]
+
+    if return_instance:
+        return normalized_counts, coef
+    return normalized_counts
+
+
+def percentile_factors(sample_percentiles):
+    """
+    Multiplicative factor of each sample, i.e. mean percentile over sample percentile.
+    Samples without non-zero count (nan percentile) get a factor of 1.
+    """
+    sample_percentiles = np.asarray(sample_percentiles, dtype=float)
+    available = np.isfinite(sample_percentiles) & (sample_percentiles != 0)
+    factors = np.ones(sample_percentiles.shape[0])
+    factors[available] = np.mean(sample_percentiles[available]) / sample_percentiles[available]
+    return factors
+
+
+def nonzero_percentile(count_data, q):
+    """
+    q-th percentile (linear interpolation, as np.percentile) of the non-zero values of
+    each row, nan for rows without non-zero value.
+
+    INPUT:
+        - count_data (np.ndarray or scipy.sparse matrix): data (n_samples, n_genes).
+        - q (float): percentile between 0 and 100.
+    OUTPUT:
+        - percentiles (np.ndarray): percentile of each sample.
+    """
+    if scipy.sparse.issparse(count_data):
+        return _sparse_nonzero_percentile(scipy.sparse.csr_matrix(count_data), q)
+
+    #Rows of dense blocks are sorted at once, faster than selecting their non-zero values
+    percentiles = np.zeros(count_data.shape[0])
+    for start in range(0, count_data.shape[0], block_size):
+        block = count_data[start:start+block_size]
+        sorted_data = np.sort(block, axis=1)
+        n_nonzero = np.count_nonzero(sorted_data, axis=1)
+        n_zero = sorted_data.shape[1] - n_nonzero
+        if sorted_data.shape[1] > 0 and np.min(sorted_data[:,0]) < 0:
+            n_negative = np.count_nonzero(sorted_data < 0, axis=1)
+        else:
+            n_negative = np.zeros(sorted_data.shape[0], dtype=int)
+
+        #Non-zero values are the negative ones followed by the positive ones
+        def nonzero_value(k):
+            column = np.where(k < n_negative, k, k + n_zero)
+            return sorted_data[np.arange(sorted_data.shape[0]), np.minimum(column, sorted_data.shape[1] - 1)]
+
+        percentiles[start:start+block_size] = _interpolate(nonzero_value, n_nonzero, q)
+
+    return percentiles
+
+
+def _sparse_nonzero_percentile(count_data, q):
+    #Only the stored values of each row (CSR segment) are sorted, explicit zeros being removed
+    has_explicit_zeros = np.any(count_data.data == 0)
+    percentiles = np.full(count_data.shape[0], np.nan)
+    for i in range(count_data.shape[0]):
+        values = count_data.data[count_data.indptr[i]:count_data.indptr[i+1]]
+        if has_explicit_zeros:
+            values = values[values != 0]
+        if values.shape[0] == 0:
+            continue
+
+        #Linear interpolation between the two closest ranks, as np.percentile
+        sorted_values = np.sort(values)
+        position = (values.shape[0] - 1) * q / 100.
+        lower_value = float(sorted_values[int(np.floor(position))])
+        upper_value = float(sorted_values[int(np.ceil(position))])
+        percentiles[i] = lower_value + (upper_value - lower_value) * (position - np.floor(position))
+
+    return percentiles
+
+
+def _interpolate(nonzero_value, n_nonzero, q):
+    #Linear interpolation between the two closest ranks, as np.percentile
+    position = (np.maximum(n_nonzero, 1) - 1) * q / 100.
+    lower = np.floor(position).astype(int)
+    upper = np.ceil(position).astype(int)
+    lower_value = nonzero_value(lower).astype(float)
+    upper_value = nonzero_value(upper).astype(float)
+
+    percentiles = lower_value + (upper_value - lower_value) * (position - lower)
+    percentiles[n_nonzero == 0] = np.nan
+    return percentiles
+
+
+if __name__ == '__main__':
+    from time import time
+
+    # Synthetic sparse counts, compared to the previous per-sample loop
+    n_samples, n_genes = 10000, 20000
+    count_data = np.random.negative_binomial(1, 0.05, size=(n_samples, n_genes))
+    count_data[np.random.rand(n_samples, n_genes) < 0.7] = 0
+    count_data[0] = 0
+
+    start_time = time()
+    loop_percentiles = [np.percentile(x[np.where(x != 0)],75) for x in count_data[1:]]
+    print('Per-sample loop: %.2f s'%(time() - start_time))
+
+    start_time = time()
+    vectorized_percentiles = nonzero_percentile(count_data, 75)
+    print('Vectorized: %.2f s'%(time() - start_time))
+
+    sparse_data = scipy.sparse.csr_matrix(count_data)
+    start_time = time()
+    sparse_percentiles = nonzero_percentile(sparse_data, 75)
+    print('Sparse: %.2f s'%(time() - start_time))
+
+    print('Maximum absolute difference: %s (dense), %s (sparse)'%(np.max(np.abs(vectorized_percentiles[1:] - loop_percentiles)),
+                                                                  np.max(np.abs(sparse_percentiles[1:] - loop_percentiles))))
+    print('Dense %.0f MB, sparse %.0f MB'%(count_data.nbytes / 1e6,
+                                          (sparse_data.data.nbytes + sparse_data.indices.nbytes + sparse_data.indptr.nbytes) / 1e6))
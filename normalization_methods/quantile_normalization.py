@@ -3,22 +3,27 @@
 Created on Mon Mar  5 18:26:46 2018
 
 @author: soufiane
+
+Quantile normalization, either through limma (R engine) or through a NumPy port of
+normalizeQuantiles (numpy engine) which does not require an R interpreter.
 """
-import rpy2
-import rpy2.robjects as robjects
-import rpy2.robjects.numpy2ri
-from rpy2.robjects.packages import importr
+import numpy as np
+from scipy.stats import rankdata
 from normalization_methods.normalization_parameters import NormalizationParameter
 
 
 def quantile_normalization(count_data, return_instance=False, coef=None):
-    
-    coef = coef or NormalizationParameter()
+
+    coef = NormalizationParameter() if coef is None else coef
 
     #Custom import
+    import rpy2
+    import rpy2.robjects as robjects
+    import rpy2.robjects.numpy2ri
+    from rpy2.robjects.packages import importr
     rpy2.robjects.numpy2ri.activate()
     importr('limma')
-    
+
     #Transform the input count data and feed it to R
     n_samples, n_genes = count_data.shape
     count_cell_lines_R = robjects.r.matrix(count_data.transpose(), nrow=n_genes, ncol=n_samples)
@@ -35,3 +40,63 @@ def quantile_normalization(count_data, return_instance=False, coef=None):
         #Transpose it back to have it in a scikit-learn format
         return X_quantile.transpose()
     return X_quantile.transpose(), coef
+
+
+def quantile_normalization_numpy(count_data, return_instance=False, coef=None):
+    """
+    Quantile normalization computed with NumPy. Gives the same output as
+    quantile_normalization (limma's normalizeQuantiles with ties=TRUE) on data
+    without missing values.
+
+    The fitted parameter is the reference distribution, i.e. the mean of the sorted
+    samples. When coef is given with a fitted reference, count_data is mapped on it.
+    """
+
+    coef = NormalizationParameter() if coef is None else coef
+
+    if coef.parameters is None or coef.parameters is True:
+        coef.parameters = quantile_reference(count_data)
+
+    X_quantile = quantile_map(count_data, coef.parameters)
+
+    if not return_instance:
+        return X_quantile
+    return X_quantile, coef
+
+
+def quantile_reference(count_data):
+    """
+    Reference distribution: mean across samples of the sorted gene values.
+    """
+    return np.mean(np.sort(count_data, 1), 0)
+
+
+def quantile_map(count_data, reference):
+    """
+    Map each sample on the reference distribution. Ties get the average rank and
+    values are linearly interpolated on the reference, as in R's approx.
+    """
+    ranks = rankdata(count_data, axis=1)
+
+    lower_index = np.floor(ranks).astype(int) - 1
+    upper_index = np.minimum(lower_index + 1, reference.shape[0] - 1)
+    interpolation = ranks - 1 - lower_index
+
+    return reference[lower_index] + interpolation * (reference[upper_index] - reference[lower_index])
+
+
+if __name__ == '__main__':
+    from time import time
+
+    # Synthetic negative binomial counts to compare engines
+    n_samples, n_genes = 200, 15000
+    count_data = np.random.negative_binomial(2, 0.01, size=(n_samples, n_genes)).astype(float)
+
+    start_time = time()
+    X_numpy = quantile_normalization_numpy(count_data)
+    print('Quantile normalization (numpy). Computed in %s s'%(time() - start_time))
+
+    start_time = time()
+    X_R = np.array(quantile_normalization(count_data))
+    print('Quantile normalization (R). Computed in %s s'%(time() - start_time))
+    print('Maximum absolute difference: %s'%(np.max(np.abs(X_R - X_numpy))))
@@ -45,7 +45,7 @@ def transform_data(count_data, transformation_method,\
         
         
     # Create NormalizationParameter instance for further processing.
-    coef = coef or NormalizationParameter()
+    coef = NormalizationParameter() if coef is None else coef
     if coef.scaler is None:
         coef.scaler = StandardScaler(with_mean=mean_center, with_std=std_unit)
         coef.scaler.fit(transformed_data)
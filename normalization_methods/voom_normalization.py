@@ -10,7 +10,7 @@ from normalization_methods.normalization_parameters import NormalizationParamete
 
 def voom_normalization(count_data, return_instance=False, coef=None):
 	
-	coef = coef or NormalizationParameter()
+	coef = NormalizationParameter() if coef is None else coef
 	if coef.parameters is None:
 		coef.parameters = (np.sum(count_data,1) + 1.)
 
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+"""
+
+from pipeline.prepare_data import prepare_data
+from pipeline.drug_response_runner import ResultStore, read_drug_list, drug_response_jobs, tissue_drug_responses,\
+                                          save_tissue_data, run_drug_response_jobs
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+DRUG_RESPONSE_RUNNER
+
+Predictive performance of all (drug, tissue, method, n_pv) jobs of a drug list (e.g.
+input/drug_list.txt), replacing the drug-by-drug loops of fig4_predictive_performance_comparison.
+Normalized tissue matrices are saved once as .npy files and memory-mapped read-only by
+the workers of a process pool, which only receive file names and response indices.
+
+Results are recorded in one append-only SQLite table indexed by the job and its parameters.
+Each result is committed as soon as its job finishes, such that an interrupted run resumes
+with the jobs that were not finished.
+"""
+
+import os
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+import scipy.stats
+from time import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sklearn.model_selection import GroupKFold, GridSearchCV
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.linear_model import ElasticNet
+from data_reader.drug_response_store import DrugResponseStore
+from analysis.ridge_path import RidgePathCV
+
+default_store_file = './output/pred_performance/pred_performance.sqlite'
+default_memmap_folder = '../data/cache/drug_response_runner/'
+drug_response_file = './data/cell_line/ic50.csv'
+drug_specification_file = './data/cell_line/drugs_specifications.csv'
+
+# Methods that do not depend on the number of principal vectors (stored with n_pv = 0)
+baseline_methods = ['ridge', 'elasticnet']
+
+_opened_memmaps = {}
+
+
+def read_drug_list(drug_file):
+    """
+    Read a drug list, e.g. input/drug_list.txt, with one "drug ID,tissue" per line.
+
+    OUTPUT:
+        - drug_list (list): (drug_id, tissue) of each line, in the same order.
+    """
+    with open(drug_file, 'r') as drug_file_reader:
+        lines = [l.strip() for l in drug_file_reader.read().split('\n') if l.strip() != '']
+
+    return [(int(l.split(',')[0]), l.split(',')[1]) for l in lines]
+
+
+def drug_response_jobs(drug_list, methods, n_pv_values):
+    """
+    All (drug_id, tissue, method, n_pv) jobs of a drug list, n_pv being 0 for baselines.
+    """
+    jobs = []
+    for drug_id, tissue in drug_list:
+        for method in methods:
+            for n_pv in ([0] if method in baseline_methods else n_pv_values):
+                jobs.append((int(drug_id), tissue, method, int(n_pv)))
+    return jobs
+
+
+def tissue_drug_responses(drug_list,
+                          source_names,
+                          drug_response_file=drug_response_file,
+                          drug_specification_file=drug_specification_file):
+    """
+    Responses of the samples of each tissue to its drugs, from DrugResponseStore.
+
+    INPUT:
+        - drug_list (list): (drug_id, tissue) pairs.
+        - source_names (dict): names of the source samples of each tissue, in the same order
+        as the rows of the source data.
+    OUTPUT:
+        - responses (dict): for each (drug_id, tissue), the tuple (sample_index, response)
+        of the samples with a known response.
+        - drug_names (dict): name of each (drug_id, tissue).
+    """
+    drug_response_store = DrugResponseStore.load(drug_response_file, drug_specification_file)
+
+    responses, drug_names = {}, {}
+    for tissue in sorted(set(t for _, t in drug_list)):
+        drug_ids = [d for d, t in drug_list if t == tissue]
+        response = drug_response_store.response_matrix(source_names[tissue], drug_ids)
+        for i, drug_id in enumerate(drug_ids):
+            sample_index = np.where(~response.mask[:,i])[0]
+            responses[drug_id, tissue] = (sample_index, response.data[sample_index,i])
+            drug_names[drug_id, tissue] = drug_response_store.drug_names.get(str(drug_id))
+
+    return responses, drug_names
+
+
+def save_tissue_data(source_data, target_data, memmap_folder=default_memmap_folder):
+    """
+    Save the normalized data of each tissue as .npy files to be memory-mapped by workers.
+
+    INPUT:
+        - source_data, target_data (dict): data of each tissue, (n_samples, n_genes).
+        - memmap_folder (str, optional): folder of the files.
+    OUTPUT:
+        - data_files (dict): for each tissue, the files of its 'source' and 'target' data.
+    """
+    os.makedirs(memmap_folder, exist_ok=True)
+
+    data_files = {}
+    for tissue in source_data:
+        data_files[tissue] = {}
+        for side, data in [('source', source_data[tissue]), ('target', target_data[tissue])]:
+            data_file = os.path.join(memmap_folder, '%s_%s.npy'%(tissue.replace(' ', '_').replace('/', ''), side))
+            tmp_file = '%s.%s.tmp'%(data_file, os.getpid())
+            with open(tmp_file, 'wb') as f:
+                np.save(f, np.ascontiguousarray(data), allow_pickle=False)
+            os.replace(tmp_file, data_file)
+            data_files[tissue][side] = data_file
+
+    return data_files
+
+
+class ResultStore():
+    """
+    Append-only SQLite table of predictive performances, one row per job and parameters.
+    """
+
+    def __init__(self, store_file=default_store_file):
+        """
+        INPUT:
+            - store_file (str, optional): SQLite database, created if needed.
+        """
+        self.store_file = store_file
+        if os.path.dirname(store_file) != '':
+            os.makedirs(os.path.dirname(store_file), exist_ok=True)
+
+        self._execute('CREATE TABLE IF NOT EXISTS results ('
+                      'drug_id INTEGER, tissue TEXT, method TEXT, n_pv INTEGER, parameters TEXT, '
+                      'performance REAL, duration REAL, created REAL, '
+                      'PRIMARY KEY (drug_id, tissue, method, n_pv, parameters))')
+
+    def _execute(self, query, arguments=()):
+        #One short transaction per call, such that results are committed immediately
+        connection = sqlite3.connect(self.store_file, timeout=60)
+        try:
+            with connection:
+                return connection.execute(query, arguments).fetchall()
+        finally:
+            connection.close()
+
+    @staticmethod
+    def parameter_key(parameters):
+        #Canonical text of the parameters, part of the primary key
+        return json.dumps(parameters if parameters is not None else {}, sort_keys=True,
+                          default=lambda v: v.tolist() if hasattr(v, 'tolist') else str(v))
+
+    def completed(self, parameters=None):
+        """
+        Set of (drug_id, tissue, method, n_pv) jobs already computed with these parameters.
+        """
+        rows = self._execute('SELECT drug_id, tissue, method, n_pv FROM results WHERE parameters = ?',
+                             (self.parameter_key(parameters),))
+        return set(rows)
+
+    def append(self, job, performance, duration=None, parameters=None):
+        """
+        Record the performance of one job. Existing results are never overwritten.
+        """
+        drug_id, tissue, method, n_pv = job
+        self._execute('INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                      (int(drug_id), tissue, method, int(n_pv), self.parameter_key(parameters),
+                       float(performance), duration, time()))
+
+    def to_frame(self):
+        """
+        All results as a DataFrame.
+        """
+        connection = sqlite3.connect(self.store_file, timeout=60)
+        try:
+            return pd.read_sql_query('SELECT * FROM results', connection)
+        finally:
+            connection.close()
+
+    def performance(self, method, parameters=None):
+        """
+        Results of one method in the format of the fig4 pickles: for each (drug_id, tissue),
+        the performance for each n_pv (or the performance itself for baselines).
+        """
+        results = self.to_frame()
+        results = results[(results['method'] == method) & (results['parameters'] == self.parameter_key(parameters))]
+
+        performance = {}
+        for (drug_id, tissue), drug_results in results.groupby(['drug_id', 'tissue'], sort=True):
+            drug_results = drug_results.sort_values('n_pv')
+            if method in baseline_methods:
+                performance[drug_id, tissue] = drug_results['performance'].values[0]
+            else:
+                performance[drug_id, tissue] = dict(zip(drug_results['n_pv'], drug_results['performance']))
+
+        return performance
+
+
+def _open_memmap(data_file):
+    #Memory-maps are opened once per worker process
+    if data_file not in _opened_memmaps:
+        _opened_memmaps[data_file] = np.load(data_file, mmap_mode='r')
+    return _opened_memmaps[data_file]
+
+
+def evaluate_job(job, data_files, sample_index, response, parameters):
+    """
+    Predictive performance of one job, run in a worker process.
+
+    INPUT:
+        - job (tuple): (drug_id, tissue, method, n_pv). Method is ridge or elasticnet for
+        the baselines (nested cross-validation, as fig4), otherwise the method of
+        DrugResponsePredictor, e.g. consensus.
+        - data_files (dict): 'source' and 'target' files of the tissue (see save_tissue_data).
+        - sample_index (np.ndarray): source samples with a known response.
+        - response (np.ndarray): response of these samples.
+        - parameters (dict): see run_drug_response_jobs.
+    OUTPUT:
+        - job (tuple), performance (float), duration (float).
+    """
+    start_time = time()
+    _, _, method, n_pv = job
+    source_data = _open_memmap(data_files['source'])
+    X_source = np.array(source_data[sample_index])
+
+    if method in baseline_methods:
+        performance = _baseline_performance(X_source, response, method, parameters)
+    else:
+        from precise import DrugResponsePredictor
+        #Domain adaptation on the source samples not used for the response
+        predictor = DrugResponsePredictor(source_data=np.delete(source_data, sample_index, 0),
+                                          method=method,
+                                          n_representations=parameters['n_representations'],
+                                          target_data=_open_memmap(data_files['target']),
+                                          n_pv=n_pv,
+                                          n_factors=parameters['n_factors'],
+                                          n_jobs=1,
+                                          mean_center=parameters['mean_center'],
+                                          std_unit=parameters['std_unit'],
+                                          l1_ratio=parameters['l1_ratio'])
+        predictor.alpha_values = list(parameters['alpha_values'])
+        predictor.fit(X_source, response, use_data=True)
+        performance = predictor.compute_predictive_performance(X_source, response)
+
+    return job, float(performance), time() - start_time
+
+
+def _baseline_performance(X_source, response, method, parameters):
+    #Correlation of the responses predicted by nested cross-validation, grouped by response as fig4
+    predicted_response = np.zeros(X_source.shape[0])
+    for train_index, test_index in GroupKFold(10).split(X_source, response, response):
+        if method == 'ridge':
+            regression = RidgePathCV(parameters['baseline_alpha_values'], cv=10, with_std=True)
+        else:
+            regression = GridSearchCV(Pipeline([
+                                        ('normalization', StandardScaler(with_mean=parameters['mean_center'], with_std=True)),
+                                        ('regression', ElasticNet(parameters['l1_ratio']))
+                                    ]),
+                                    cv=10, param_grid={'regression__alpha': parameters['baseline_alpha_values']},
+                                    scoring='neg_mean_squared_error')
+        regression.fit(X_source[train_index], response[train_index])
+        predicted_response[test_index] = regression.predict(X_source[test_index])
+
+    return scipy.stats.pearsonr(predicted_response, response)[0]
+
+
+def run_drug_response_jobs(jobs,
+                           data_files,
+                           responses,
+                           store,
+                           parameters,
+                           n_jobs=1,
+                           verbose=True):
+    """
+    Run the jobs not yet in the store over a pool of processes, recording each result as
+    soon as it is computed. Failed jobs are reported and not recorded, such that they are
+    run again by the next call.
+
+    INPUT:
+        - jobs (list): (drug_id, tissue, method, n_pv) jobs, see drug_response_jobs.
+        - data_files (dict): files of each tissue, see save_tissue_data.
+        - responses (dict): (sample_index, response) of each (drug_id, tissue), see
+        tissue_drug_responses.
+        - store (ResultStore): where results are recorded.
+        - parameters (dict): n_factors, n_representations, mean_center, std_unit, l1_ratio,
+        alpha_values (domain adaptation) and baseline_alpha_values. Part of the key of the
+        results.
+        - n_jobs (int, optional, default to 1): number of worker processes.
+        - verbose (bool, optional, default to True).
+    OUTPUT:
+        - n_computed (int): number of jobs computed in this run.
+        - failed_jobs (dict): error of each job that failed.
+    """
+    completed_jobs = store.completed(parameters)
+    remaining_jobs = [tuple(j) for j in jobs if tuple(j) not in completed_jobs]
+    if verbose:
+        print('%s jobs, %s already computed'%(len(jobs), len(jobs) - len(remaining_jobs)))
+
+    n_computed, failed_jobs = 0, {}
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = {executor.submit(evaluate_job,
+                                   job,
+                                   data_files[job[1]],
+                                   responses[job[0], job[1]][0],
+                                   responses[job[0], job[1]][1],
+                                   parameters): job
+                   for job in remaining_jobs}
+
+        for future in as_completed(futures):
+            #A failed job (e.g. too few responses for GroupKFold) does not stop the others
+            try:
+                job, performance, duration = future.result()
+            except Exception as e:
+                failed_jobs[futures[future]] = '%s: %s'%(type(e).__name__, e)
+                if verbose:
+                    print('%s failed: %s'%(futures[future], failed_jobs[futures[future]]))
+                continue
+            store.append(job, performance, duration, parameters)
+            n_computed += 1
+            if verbose:
+                print('%s/%s %s: %.3f (%.1f s)'%(n_computed, len(remaining_jobs), job, performance, duration))
+
+    return n_computed, failed_jobs
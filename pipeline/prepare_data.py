@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Soufiane Mourragui
+
+PREPARE_DATA
+
+Read and normalize the data of several (source, target, tissue) jobs at once. Each source
+(and source tissue) is read once and shared, while target loading, harmonization and normalization of each
+job run in a pool of processes. Workers are separate processes (loky backend), so that
+each of them has its own R interpreter when rpy2-based normalizations are used.
+"""
+
+from joblib import Parallel, delayed
+from data_reader.read_data import read_one_data_source, lookup_folder
+from data_reader.harmonize_feature_naming import harmonize_feature_naming
+from normalization_methods.feature_engineering import feature_engineering
+
+
+def prepare_data(jobs,
+                data_type='count',
+                target_mean_center=True,
+                target_std_unit=False,
+                source_mean_center=False,
+                source_std_unit=False,
+                remove_mytochondria=False,
+                engine='r',
+                dtype=None,
+                cache_folder=None,
+                n_jobs=1):
+    """
+    Prepare the data of several jobs, e.g. one per tumor tissue for the same cell lines.
+
+    INPUT:
+        - jobs (list): list of (source_type, source_tissue, target_type, target_tissue,
+        normalization_method, transformation_method) tuples, e.g. ('cell_line', None, 'tumor',
+        'BRCA', 'TMM', 'log') or ('pdx', 'BRCA', 'tumor', 'BRCA', 'TMM', 'log'). Source tissue
+        None reads cell lines of all tissues; PDX require a tissue.
+        - data_type (str, optional, default to count): type of data, i.e. fpkm, count or
+        count_passport.
+        - target_mean_center, target_std_unit (bool, optional, default to True and False):
+        standardization of the target data.
+        - source_mean_center, source_std_unit (bool, optional, default to False): same for
+        source data, usually centered later during cross-validation.
+        - remove_mytochondria (bool, optional, default to False): whether mythocondrial
+        genes should be removed.
+        - engine (str, optional, default to r): normalization engine, see normalize_data.
+        - dtype (np.dtype, optional, default to None): type of the normalized data, e.g.
+        np.float32 (see feature_engineering).
+        - cache_folder (str, optional, default to None): folder where the parsed gene
+        annotation is persisted (see GeneAnnotationIndex).
+        - n_jobs (int, optional, default to 1): number of worker processes.
+    OUTPUT:
+        - prepared_data (dict): for each job, the tuple (target_data, source_data,
+        gene_names, source_samples, target_samples) as returned by read_data, with
+        normalized data.
+    """
+    jobs = [tuple(job) for job in jobs]
+
+    #Read each source once. Large arrays are memory-mapped when sent to the workers.
+    source_keys = sorted(set(job[:2] for job in jobs), key=str)
+    sources = {(source_type, source_tissue): read_one_data_source(source_type, data_type, source_tissue,
+                                                                  cache_folder=cache_folder)
+               for source_type, source_tissue in source_keys}
+
+    parameters = {
+        'data_type': data_type,
+        'target_mean_center': target_mean_center,
+        'target_std_unit': target_std_unit,
+        'source_mean_center': source_mean_center,
+        'source_std_unit': source_std_unit,
+        'remove_mytochondria': remove_mytochondria,
+        'engine': engine,
+        'dtype': dtype,
+        'cache_folder': cache_folder
+    }
+    prepared_data = Parallel(n_jobs=n_jobs, backend='loky')(delayed(prepare_job)(job, sources[job[:2]], **parameters)
+                                                            for job in jobs)
+
+    return dict(zip(jobs, prepared_data))
+
+
+def prepare_job(job,
+               source,
+               data_type='count',
+               target_mean_center=True,
+               target_std_unit=False,
+               source_mean_center=False,
+               source_std_unit=False,
+               remove_mytochondria=False,
+               engine='r',
+               dtype=None,
+               cache_folder=None):
+    """
+    Read the target of one job, harmonize it with the (already read) source and normalize
+    both. See prepare_data for the parameters.
+    """
+    _, _, target_type, tissue, normalization_method, transformation_method = job
+    source_data, source_gene_names, source_samples = source
+
+    target_data, target_gene_names, target_samples = read_one_data_source(target_type, data_type, tissue,
+                                                                          cache_folder=cache_folder)
+    target_data, source_data, gene_names = harmonize_feature_naming(target_data,
+                                                                    source_data,
+                                                                    target_gene_names,
+                                                                    source_gene_names,
+                                                                    remove_mytochondria,
+                                                                    '%sgene_status.csv'%(lookup_folder),
+                                                                    cache_folder)
+
+    target_data = feature_engineering(target_data,
+                                      normalization_method,
+                                      transformation_method,
+                                      target_mean_center,
+                                      target_std_unit,
+                                      engine=engine,
+                                      dtype=dtype)
+    source_data = feature_engineering(source_data,
+                                      normalization_method,
+                                      transformation_method,
+                                      source_mean_center,
+                                      source_std_unit,
+                                      engine=engine,
+                                      dtype=dtype)
+
+    return target_data, source_data, gene_names, source_samples, target_samples